@@ -7,4 +7,53 @@ def opencv2qimage(frame):
     h, w, ch = rgbImage.shape
     bytesPerLine = ch * w
     convertToQtFormat = QtGui.QImage(rgbImage.data, w, h, bytesPerLine, QtGui.QImage.Format_RGB888)
-    return convertToQtFormat
\ No newline at end of file
+    return convertToQtFormat
+
+
+def resize_to_fit(frame, width, height):
+    """
+    Resize a frame to fit in width x height with the aspect ratio kept. Shrinking uses area averaging,
+    enlarging (e.g. a small zoom window) uses nearest neighbour so individual pixels stay visible.
+
+    Area averaging over a large, non-integer ratio is slow, so big reductions first go bilinearly to twice
+    the target size and then take the exact 2:1 area step.
+
+    :return: (resized frame, scale factor)
+    """
+    h, w = frame.shape[:2]
+    scale = min(height * 1.0 / h, width * 1.0 / w)
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    if size == (w, h):
+        return frame, 1.0
+    if scale >= 1:
+        return cv2.resize(frame, size, interpolation=cv2.INTER_NEAREST), scale
+    if scale < 0.5:
+        frame = cv2.resize(frame, (size[0] * 2, size[1] * 2), interpolation=cv2.INTER_LINEAR)
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA), scale
+
+
+def opencv2qimage_scaled(frame, width, height):
+    """
+    Convert a BGR frame to a QImage fitting in width x height with the aspect ratio kept.
+
+    The frame is shrunk before anything else touches it, and handed to Qt as BGR where supported so no
+    color conversion is needed at all. Unlike :func:`opencv2qimage` the result owns its pixels, so it
+    can be handed to another thread.
+    """
+    frame, _ = resize_to_fit(frame, width, height)
+    return bgr2qimage(frame)
+
+
+def bgr2qimage(frame):
+    """
+    Copy a (preview sized) BGR frame into a QImage that owns its pixels
+    """
+    if hasattr(QtGui.QImage, 'Format_BGR888'):  # Qt >= 5.14
+        fmt = QtGui.QImage.Format_BGR888
+    else:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        fmt = QtGui.QImage.Format_RGB888
+    if not frame.flags['C_CONTIGUOUS']:
+        frame = frame.copy()
+    h, w, ch = frame.shape
+    return QtGui.QImage(frame.data, w, h, ch * w, fmt).copy()
\ No newline at end of file
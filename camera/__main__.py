@@ -4,13 +4,24 @@ CameraThread GUI classes using OpenCV and PyQt
 import argparse
 import cv2
 import logging
+import os
 import sys
+import time
 
 from PyQt5.QtWidgets import QApplication, QMessageBox, QInputDialog
 
+from camera.burst import BurstRecorder, EncoderSettings
 from camera.camera_app import CameraApp
 from camera.camera_thread import CameraThread
+from camera.discovery import DeviceDiscovery
+from camera.journal import JournalRecorder
+from camera.multi_preview import MultiPreview
+from camera.negotiation import Policy
 from camera.preview import Preview
+from camera.processing import PROCESSORS, create_processor
+from camera.server import FrameServer
+from camera.sources import open_source
+from camera.video_recorder import VideoRecorder
 
 _logger = logging.getLogger(__name__)
 
@@ -26,42 +37,209 @@ if __name__ == '__main__':
     parser.add_argument('--gui', action='store_true', help='Use GUI to display preview')
     parser.add_argument('--qt', action='store_true', help='Use full Qt GUI; must be used with --gui')
     parser.add_argument('-v', '--verbose', action='store_true', help='Increase output verbosity')
+    parser.add_argument('--source', action='append',
+                        help='Capture from camera:N, synthetic[:WxH[@FPS][:PATTERN]] or file:PATH[@FPS] '
+                             'instead of the first camera, e.g. synthetic:3840x2160@60:noise. '
+                             'Give it several times to show several sources side by side (needs --gui)')
+    parser.add_argument('--cameras', metavar='IDS',
+                        help='Open several devices at once, e.g. 0,1,2, or "all" for every device found '
+                             '(needs --gui)')
+    parser.add_argument('--mode', default='max-res:15', metavar='POLICY',
+                        help='How to pick a camera\'s resolution, pixel format and frame rate: max-fps[:RES] '
+                             '(e.g. max-fps:1080p), max-res[:FPS] (e.g. max-res:15), an exact WxH[@FPS][:FOURCC] '
+                             '(e.g. 1920x1080@30:MJPG), or legacy to request 3840x2160 and take what comes back '
+                             '(default: %(default)s)')
+    parser.add_argument('--low-latency', action='store_true',
+                        help='Always show the freshest frame: shrink the driver\'s frame queue and skip queued '
+                             'frames instead of decoding them')
+    parser.add_argument('--rescan', action='store_true', help='Ignore the cached list of camera devices')
+    parser.add_argument('--stats-interval', type=float, default=5.0, metavar='T',
+                        help='Without --gui, print pipeline statistics every T seconds; 0 to disable '
+                             '(default: %(default)s). With --gui, press F3 for an overlay instead')
+    burst = parser.add_argument_group('burst capture', 'Record numbered frames without a preview')
+    burst.add_argument('--burst', type=int, default=0, metavar='N', help='Number of frames to record (0: no limit)')
+    burst.add_argument('--interval', type=float, default=0.0, metavar='T',
+                       help='Seconds between frames (0: every captured frame)')
+    burst.add_argument('--duration', type=float, default=0.0, metavar='D', help='Seconds to record for (0: no limit)')
+    burst.add_argument('--output', default=os.path.join(os.path.expanduser('~'), 'burst_0001.png'),
+                       help='First output file; later ones are numbered after it (default: %(default)s)')
+    burst.add_argument('--format', choices=sorted(EncoderSettings.FORMATS), default='png', help='Output format')
+    burst.add_argument('--png-compression', type=int, default=3, choices=range(10), metavar='0-9',
+                       help='PNG compression level (default: %(default)s)')
+    burst.add_argument('--jpeg-quality', type=int, default=95, metavar='0-100',
+                       help='JPEG quality (default: %(default)s)')
+    video = parser.add_argument_group('video recording', 'Record a clip without a preview')
+    video.add_argument('--record', metavar='FILE', help='Record video to FILE until --duration elapses or Ctrl+C')
+    video.add_argument('--fps', type=float, default=0.0,
+                       help='Frame rate of the recording (default: what the camera reports)')
+    video.add_argument('--fourcc', help='Four character codec code (default: depends on the container)')
+    raw = parser.add_argument_group('raw recording', 'Record unencoded frames to a memory-mapped journal; '
+                                                     'see python -m camera.journal to read or convert it')
+    raw.add_argument('--journal', metavar='FILE', help='Record raw frames to FILE')
+    raw.add_argument('--journal-frames', type=int, default=300, metavar='N',
+                     help='Number of frames to make room for (default: %(default)s)')
+    parser.add_argument('--processor', action='append', metavar='NAME[:FPS][:thread|process]',
+                        help='Analyse frames and draw the results over the preview (needs --gui --qt); one of '
+                             '%s, e.g. sharpness:10:process. May be given more than once' % ', '.join(PROCESSORS))
+    serve = parser.add_argument_group('frame server', 'Serve frames to other processes without a preview; '
+                                                      'see camera.server for reading from shared memory')
+    serve.add_argument('--serve', metavar='[HOST:]PORT',
+                       help='Stream MJPEG over HTTP on PORT; unauthenticated, so only on localhost unless a HOST '
+                            'such as 0.0.0.0 is given')
+    serve.add_argument('--shm', metavar='NAME', help='Publish raw frames to the shared memory block NAME')
+    serve.add_argument('--shm-slots', type=int, default=8, metavar='N',
+                       help='Frames kept in shared memory (default: %(default)s)')
+    serve.add_argument('--stream-quality', type=int, default=80, metavar='0-100',
+                       help='JPEG quality of the HTTP stream (default: %(default)s)')
+    serve.add_argument('--stream-fps', type=float, default=30.0, metavar='FPS',
+                       help='Most frames per second encoded for HTTP clients, who may ask for fewer with '
+                            '?fps=N (default: %(default)s)')
     args = parser.parse_args()
 
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG)
 
-    if not args.gui:
-        cam = CameraThread(gui=args.gui)
+    if not args.gui and (args.cameras or len(args.source or []) > 1):
+        parser.error('several cameras can only be shown with --gui')
+    try:
+        policy = None if args.mode == 'legacy' else Policy.parse(args.mode)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.processor and not (args.gui and args.qt):
+        parser.error('--processor needs --gui --qt')
+    try:
+        processors = [create_processor(spec) for spec in args.processor or []]
+    except ValueError as e:
+        parser.error(str(e))
+    address = None
+    if args.serve:
+        host, _, port = args.serve.rpartition(':')
+        try:
+            address = (host or '127.0.0.1', int(port))
+        except ValueError:
+            parser.error('--serve expects [HOST:]PORT, got %r' % args.serve)
+    sources = [open_source(spec) for spec in args.source or []]
+    source = sources[0] if sources else None
+    # Modes of the default camera from the discovery cache, so negotiating does not list them again
+    known_modes = DeviceDiscovery().modes(0) if source is None and policy is not None else None
+
+    if not args.gui and (address or args.shm):
+        cam = CameraThread(gui=True, source=source, stats_interval=args.stats_interval,
+                           policy=policy, low_latency=args.low_latency, modes=known_modes)
+        server = FrameServer(cam, address=address, shm_name=args.shm, shm_slots=args.shm_slots,
+                             quality=args.stream_quality, max_fps=args.stream_fps)
+        cam.start()
+        server.start()
+        if address:
+            print('Streaming on http://%s:%d/' % server.address[:2])
+        if args.shm:
+            print('Publishing frames to shared memory %r' % server.publisher.name)
+        try:
+            deadline = time.monotonic() + args.duration if args.duration else float('inf')
+            while time.monotonic() < deadline and cam.isRunning():
+                time.sleep(0.1)
+        except KeyboardInterrupt:
+            _logger.warning('Server stopped by user')
+        finally:
+            server.stop()
+            cam.stop_flag = True
+            cam.wait()
+    elif not args.gui and args.journal:
+        cam = CameraThread(gui=True, source=source, stats_interval=args.stats_interval,
+                           policy=policy, low_latency=args.low_latency, modes=known_modes)
+        recorder = JournalRecorder(cam, args.journal, args.journal_frames)
+        cam.start()
+        try:
+            recorder.run()
+        except KeyboardInterrupt:
+            _logger.warning('Recording stopped by user')
+        finally:
+            cam.stop_flag = True
+            cam.wait()
+        print('%d frames written to %s, %d missed' % (recorder.journal.count, args.journal, recorder.missed))
+    elif not args.gui and args.record:
+        cam = CameraThread(gui=True, source=source, stats_interval=args.stats_interval,
+                           policy=policy, low_latency=args.low_latency, modes=known_modes)
+        recorder = VideoRecorder(cam, args.record, fps=args.fps or cam.get(cv2.CAP_PROP_FPS) or 30.0,
+                                 fourcc=args.fourcc)
+        cam.start()
+        recorder.start()
+        try:
+            deadline = time.monotonic() + args.duration if args.duration else float('inf')
+            while time.monotonic() < deadline and recorder.isRunning():
+                time.sleep(0.1)
+        except KeyboardInterrupt:
+            _logger.warning('Recording stopped by user')
+        finally:
+            recorder.stop()
+            recorder.wait()
+            cam.stop_flag = True
+            cam.wait()
+        print('%d frames written to %s, %d dropped' % (recorder.written, args.record, recorder.dropped))
+    elif not args.gui and (args.burst or args.interval or args.duration):
+        cam = CameraThread(gui=True, source=source, stats_interval=args.stats_interval,
+                           policy=policy, low_latency=args.low_latency, modes=known_modes)
+        cam.start()
+        recorder = BurstRecorder(cam.ring, args.output,
+                                 EncoderSettings(args.format, args.png_compression, args.jpeg_quality),
+                                 count=args.burst, interval=args.interval, duration=args.duration)
+        recorder.progress.connect(lambda written, fps, mbps: print('%d frames, %.1f fps, %.1f MB/s' %
+                                                                   (written, fps, mbps)))
+        try:
+            recorder.run()
+        except KeyboardInterrupt:
+            _logger.warning('Operation cancelled by user')
+        finally:
+            cam.stop_flag = True
+            cam.wait()
+        if recorder.missed:
+            print('%d frames missed' % recorder.missed)
+    elif not args.gui:
+        cam = CameraThread(gui=args.gui, source=source, stats_interval=args.stats_interval,
+                           policy=policy, low_latency=args.low_latency, modes=known_modes)
         cam.run()
     else:
         app = QApplication(sys.argv)
 
-        devices = []
-        for i in range(10):
-            cap = cv2.VideoCapture(i)
-            if cap.isOpened():
-                devices.append(i)
-            cap.release()
-
-        if len(devices) == 0:
-            _logger.error('No camera device available')
-            QMessageBox.critical(None, 'No camera', 'No camera device available')
-            sys.exit()
-        elif len(devices) == 1:
-            device_id = devices[0]
+        if sources:
+            names = [str(i) for i in range(len(sources))]
+            cams = [CameraThread(gui=args.gui, parent=app, source=source, policy=policy, low_latency=args.low_latency,
+                                 defer_negotiation=True)
+                    for source in sources]
         else:
-            item, ok = QInputDialog.getItem(None, 'Select camera', 'Choose a camera:', [str(i) for i in devices], 0, False)
-            if not ok:
-                _logger.warning('Operation cancelled by user')
-                sys.exit()
+            discovery = DeviceDiscovery()
+            if args.cameras and args.cameras != 'all':
+                devices = [int(i) for i in args.cameras.split(',')]
             else:
-                device_id = int(item)
+                devices = [device.index for device in discovery.discover(refresh=args.rescan)]
+
+            if len(devices) == 0:
+                _logger.error('No camera device available')
+                QMessageBox.critical(None, 'No camera', 'No camera device available')
+                sys.exit()
+            elif len(devices) > 1 and not args.cameras:
+                items = [str(i) for i in devices] + ['All']
+                item, ok = QInputDialog.getItem(None, 'Select camera', 'Choose a camera:', items, 0, False)
+                if not ok:
+                    _logger.warning('Operation cancelled by user')
+                    sys.exit()
+                elif item != 'All':
+                    devices = [int(item)]
+
+            names = [str(i) for i in devices]
+            # Modes come from the discovery cache, and each camera negotiates on its own capture thread so
+            # the window appears straight away
+            cams = [CameraThread(gui=args.gui, parent=app, source=discovery.open(device_id), policy=policy,
+                                 low_latency=args.low_latency, modes=discovery.modes(device_id),
+                                 defer_negotiation=True)
+                    for device_id in devices]
+            discovery.close()
 
-        cam = CameraThread(camera_id=device_id, gui=args.gui, parent=app)
-        if not args.qt:
-            widget = Preview(cam)
+        if len(cams) > 1:
+            widget = MultiPreview(cams, names)
+        elif not args.qt:
+            widget = Preview(cams[0])
         else:
-            widget = CameraApp(cam)
+            widget = CameraApp(cams[0], processors=processors)
             widget.show()
         sys.exit(app.exec_())
@@ -0,0 +1,296 @@
+"""
+Benchmark of the capture -> transform -> convert -> display/save pipeline
+
+Runs headless against a synthetic source and times each stage on its own, across resolutions and
+rotate/flip/zoom settings. Results are printed as a table and can be saved as JSON and compared with an
+earlier run::
+
+    python -m camera.benchmark --output bench.json
+    python -m camera.benchmark --resolutions vga,4k --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import logging
+
+import cv2
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+RESOLUTIONS = {
+    'vga': (640, 480),
+    'hd': (1280, 720),
+    'fhd': (1920, 1080),
+    '4k': (3840, 2160),
+}
+
+# name: (rotate count, flip up-down, flip left-right, zoom to the centre half)
+VIEWS = {
+    'plain': (0, False, False, False),
+    'rot90': (1, False, False, False),
+    'flip': (0, True, True, False),
+    'zoom': (0, False, False, True),
+    'rot90-flip-zoom': (1, True, True, True),
+}
+
+WRITE_FORMATS = {
+    'png1': ('.png', (cv2.IMWRITE_PNG_COMPRESSION, 1)),
+    'png3': ('.png', (cv2.IMWRITE_PNG_COMPRESSION, 3)),
+    'jpg95': ('.jpg', (cv2.IMWRITE_JPEG_QUALITY, 95)),
+    'bmp': ('.bmp', ()),
+    'npy': ('.npy', ()),
+}
+
+
+def measure(func, iterations, warmup=2):
+    """
+    Time ``func`` and record the peak memory allocated by one extra call
+
+    :return: dict with latency percentiles in milliseconds, calls per second and peak memory in MB
+    """
+    for _ in range(warmup):
+        func()
+    times = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter()
+        func()
+        times[i] = time.perf_counter() - start
+
+    # Separate pass so tracing does not skew the timings
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p90, p99 = np.percentile(times, (50, 90, 99)) * 1000
+    return {
+        'iterations': iterations,
+        'mean_ms': float(times.mean() * 1000),
+        'p50_ms': float(p50),
+        'p90_ms': float(p90),
+        'p99_ms': float(p99),
+        'max_ms': float(times.max() * 1000),
+        'per_s': float(1.0 / times.mean()),
+        'peak_mb': peak / 1e6,
+    }
+
+
+def legacy_get_image(frame, rotate_count, flipud, fliplr, crop, roi):
+    """
+    The preview path before FrameTransform and the render worker: reorient the whole frame, draw the ROI
+    on a full-size copy, then crop, as ``CameraApp.getImage`` used to
+
+    :param crop: (x1, y1, x2, y2) in oriented coordinates, or None
+    """
+    from .camera_app import CameraApp
+
+    image = frame
+    for _ in range(rotate_count % 4):
+        image = np.rot90(image)
+    if flipud:
+        image = np.flipud(image)
+    if fliplr:
+        image = np.fliplr(image)
+    image = CameraApp.drawROIRectange(image, roi[0], roi[1], (0, 255, 0))
+    if crop is not None:
+        x1, y1, x2, y2 = crop
+        image = image[y1:y2, x1:x2]
+    return image
+
+
+class Benchmark(object):
+    """
+    Runs each stage for every resolution (and view setting, where it matters) and collects the results
+    """
+    def __init__(self, resolutions, views, formats, iterations, preview_size=(800, 600)):
+        self.resolutions = resolutions
+        self.views = views
+        self.formats = formats
+        self.iterations = iterations
+        self.preview_size = preview_size
+        self.results = []
+
+    def _record(self, stage, resolution, view, stats):
+        entry = dict(stage=stage, resolution=resolution, view=view, **stats)
+        self.results.append(entry)
+        print('%-22s %-5s %-16s p50 %8.2f ms  p99 %8.2f ms  %8.1f/s  peak %7.1f MB' %
+              (stage, resolution, view or '', stats['p50_ms'], stats['p99_ms'], stats['per_s'], stats['peak_mb']))
+        sys.stdout.flush()
+
+    def run(self):
+        from PyQt5.QtCore import Qt
+        from PyQt5.QtGui import QPixmap
+        from PyQt5.QtWidgets import QApplication
+
+        from . import opencv2qimage, opencv2qimage_scaled
+        from .camera_app import CameraApp, ViewState
+        from .camera_thread import CameraThread
+        from .sources import SyntheticSource
+        from .transform import FrameTransform
+
+        self._app = QApplication.instance() or QApplication(sys.argv)
+        tmpdir = tempfile.mkdtemp(prefix='camera-benchmark-')
+        try:
+            for resolution in self.resolutions:
+                width, height = RESOLUTIONS[resolution]
+                # Unthrottled, so the read stage measures the capture path rather than the frame rate
+                cam = CameraThread(source=SyntheticSource(width, height, fps=0, pattern='noise'), gui=True)
+                ring, source = cam.ring, cam._cap
+
+                def capture():
+                    ret, image = source.read(ring.writeBuffer())
+                    ring.commit(time.monotonic(), image)
+
+                self._record('CameraThread.read', resolution, None, measure(capture, self.iterations))
+                frame = ring.latest().image
+
+                # A real CameraApp, with its capture thread stopped so it does not compete for the CPU
+                widget = CameraApp(cam)
+                cam.stop_flag = True
+                cam.wait()
+                preview_w, preview_h = self.preview_size
+
+                for view in self.views:
+                    rotate, flipud, fliplr, zoom = VIEWS[view]
+                    crop = None
+                    if zoom:
+                        oh, ow = FrameTransform(frame.shape, rotate).oriented_shape
+                        crop = (ow // 4, oh // 4, ow * 3 // 4, oh * 3 // 4)
+                    transform = FrameTransform(frame.shape, rotate, flipud, fliplr, crop)
+                    oh, ow = transform.shape
+                    x1, y1 = transform.origin
+                    roi = ((x1 + ow * 0.1, y1 + oh * 0.1), (x1 + ow * 0.9, y1 + oh * 0.9))
+                    state = ViewState(transform=transform, roi=roi, zoom_selection=None, results=())
+                    bare = ViewState(transform=transform, roi=(None, None), zoom_selection=None, results=())
+
+                    self._record('CameraApp.getImage', resolution, view,
+                                 measure(lambda: np.ascontiguousarray(widget.getImage(frame, bare)),
+                                         self.iterations))
+                    image = widget.getImage(frame, bare)
+                    self._record('drawROIRectange', resolution, view,
+                                 measure(lambda: CameraApp.drawROIRectange(image, roi[0], roi[1]),
+                                         self.iterations))
+                    self._record('opencv2qimage', resolution, view,
+                                 measure(lambda: opencv2qimage(image), self.iterations))
+                    qimage = opencv2qimage(image)
+                    self._record('QPixmap.scaled', resolution, view,
+                                 measure(lambda: QPixmap.fromImage(qimage).scaled(preview_w, preview_h,
+                                                                                  Qt.KeepAspectRatio),
+                                         self.iterations))
+                    self._record('legacy preview total', resolution, view,
+                                 measure(lambda: QPixmap.fromImage(opencv2qimage(legacy_get_image(
+                                     frame, rotate, flipud, fliplr, crop, roi))).scaled(
+                                     preview_w, preview_h, Qt.KeepAspectRatio), self.iterations))
+                    self._record('opencv2qimage_scaled', resolution, view,
+                                 measure(lambda: opencv2qimage_scaled(image, preview_w, preview_h),
+                                         self.iterations))
+                    self._record('render worker total', resolution, view,
+                                 measure(lambda: QPixmap.fromImage(widget._renderImage(frame, state, preview_w,
+                                                                                       preview_h)),
+                                         self.iterations))
+
+                for name in self.formats:
+                    ext, params = WRITE_FORMATS[name]
+                    filename = os.path.join(tmpdir, 'frame' + ext)
+                    if ext == '.npy':
+                        def write():
+                            np.save(filename, frame)
+                    else:
+                        def write():
+                            cv2.imwrite(filename, frame, list(params))
+                    stats = measure(write, max(self.iterations // 5, 3), warmup=1)
+                    stats['file_mb'] = os.path.getsize(filename) / 1e6
+                    self._record('cv2.imwrite ' + name, resolution, None, stats)
+
+                widget.close()
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        return self.results
+
+    def report(self):
+        """
+        :return: JSON-serialisable results with enough context to compare runs
+        """
+        return {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'opencv_threads': cv2.getNumThreads(),
+            'numpy': np.__version__,
+            'iterations': self.iterations,
+            'preview_size': list(self.preview_size),
+            'results': self.results,
+        }
+
+
+def compare(baseline, results, threshold=1.1):
+    """
+    Print the p50 ratio for every stage present in both runs, flagging slowdowns beyond ``threshold``
+
+    :return: number of regressions
+    """
+    def key(r):
+        return r['stage'], r['resolution'], r['view']
+
+    old = {key(r): r for r in baseline['results']}
+    regressions = 0
+    print('\nCompared with %s (%s):' % (baseline.get('created', '?'), baseline.get('platform', '?')))
+    for r in results:
+        if key(r) not in old:
+            continue
+        ratio = r['p50_ms'] / max(old[key(r)]['p50_ms'], 1e-9)
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('%-22s %-5s %-16s %8.2f -> %8.2f ms  x%.2f%s' %
+              (r['stage'], r['resolution'], r['view'] or '', old[key(r)]['p50_ms'], r['p50_ms'], ratio, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resolutions', default=','.join(RESOLUTIONS),
+                        help='Comma separated subset of %s (default: all)' % ', '.join(RESOLUTIONS))
+    parser.add_argument('--views', default=','.join(VIEWS),
+                        help='Comma separated subset of %s (default: all)' % ', '.join(VIEWS))
+    parser.add_argument('--formats', default=','.join(WRITE_FORMATS),
+                        help='Comma separated subset of %s (default: all)' % ', '.join(WRITE_FORMATS))
+    parser.add_argument('-n', '--iterations', type=int, default=30, help='Timed calls per stage (default: %(default)s)')
+    parser.add_argument('-o', '--output', help='Save results as JSON')
+    parser.add_argument('--compare', metavar='JSON', help='Compare with results saved by an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.1,
+                        help='p50 ratio counted as a regression by --compare (default: %(default)s)')
+    args = parser.parse_args()
+
+    def choices(value, allowed):
+        items = [v for v in value.split(',') if v]
+        unknown = set(items) - set(allowed)
+        if unknown:
+            parser.error('unknown choice(s): %s' % ', '.join(sorted(unknown)))
+        return items
+
+    benchmark = Benchmark(choices(args.resolutions, RESOLUTIONS), choices(args.views, VIEWS),
+                          choices(args.formats, WRITE_FORMATS), args.iterations)
+    benchmark.run()
+    report = benchmark.report()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Results saved to %s' % args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report['results'], args.threshold)
+        sys.exit(1 if regressions else 0)
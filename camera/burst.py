@@ -0,0 +1,170 @@
+"""
+Burst and time-lapse capture to numbered image files
+"""
+import os
+import time
+import logging
+
+import cv2
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from .image_writer import ImageWriter, increment_filename
+
+_logger = logging.getLogger(__name__)
+
+
+class EncoderSettings(object):
+    """
+    Output format and quality for recorded frames
+    """
+    FORMATS = {'png': '.png', 'jpg': '.jpg', 'npy': '.npy'}
+
+    def __init__(self, format='png', png_compression=3, jpeg_quality=95):
+        """
+
+        :param format: 'png', 'jpg' or 'npy' (raw arrays, no encoding)
+        :param png_compression: zlib level 0-9; lower is faster and larger
+        :param jpeg_quality: 0-100
+        """
+        if format not in self.FORMATS:
+            raise ValueError('Unknown format %r, expected one of %s' % (format, ', '.join(self.FORMATS)))
+        self.format = format
+        self.png_compression = png_compression
+        self.jpeg_quality = jpeg_quality
+
+    @property
+    def extension(self):
+        return self.FORMATS[self.format]
+
+    @property
+    def params(self):
+        """
+        Encoder parameters for ``cv2.imwrite``
+        """
+        if self.format == 'png':
+            return (cv2.IMWRITE_PNG_COMPRESSION, self.png_compression)
+        if self.format == 'jpg':
+            return (cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality)
+        return ()
+
+    def filename(self, filename):
+        """
+        :return: ``filename`` with its extension replaced by the one for this format
+        """
+        return os.path.splitext(filename)[0] + self.extension
+
+
+class BurstRecorder(QThread):
+    """
+    Streams frames from the ring to numbered files through an :class:`ImageWriter`.
+
+    With no interval every captured frame is written ("N frames at full rate"); frames the writers could
+    not keep up with are counted in :attr:`missed`. With an interval, the newest frame is taken every
+    ``interval`` seconds, or as soon as one arrives if the camera is slower than that. Recording stops after
+    ``count`` frames or ``duration`` seconds, whichever comes first, or when :meth:`stop` is called; 0 means
+    no limit.
+    """
+    # Emitted with frames written, frames/s and MB/s while recording and once more when done
+    progress = pyqtSignal(int, float, float)
+
+    def __init__(self, ring, filename, settings=None, count=0, interval=0.0, duration=0.0, prepare=None,
+                 workers=None, parent=None):
+        """
+
+        :type ring: camera.frame_buffer.FrameRing
+        :param ring: frames to record
+        :param filename: name of the first file; later ones are numbered like :func:`increment_filename`
+        :type settings: EncoderSettings
+        :param count: number of frames to record, 0 for no limit
+        :param interval: seconds between frames, 0 to record every frame
+        :param duration: seconds to record for, 0 for no limit
+        :param prepare: optional callable(image) -> image run on the writer threads, e.g. a transform
+        :param workers: number of encoder threads, defaults to the number of CPUs up to 4
+        """
+        super(BurstRecorder, self).__init__(parent=parent)
+        self._ring = ring
+        self.settings = settings or EncoderSettings()
+        self.filename = self.settings.filename(filename)
+        self.lastFilename = None
+        self._count = count
+        self._interval = interval
+        self._duration = duration
+        self._prepare = prepare
+        workers = workers or min(4, os.cpu_count() or 1)
+        # Every queued frame is pinned in the pool, so keep the queue just deep enough to feed the workers
+        self._writer = ImageWriter(workers=workers, max_pending=workers + 1)
+        self._stop = False
+        self.queued = 0
+        self.missed = 0
+
+    def stop(self):
+        self._stop = True
+
+    def _done(self, start):
+        if self._count and self.queued >= self._count:
+            return True
+        return self._duration and time.monotonic() - start >= self._duration
+
+    def _nextFrame(self, seq, next_time):
+        """
+        :return: the next frame to record, pinned, or None if there is nothing yet
+        """
+        if self._interval:
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(min(delay, 0.1))
+                return None
+            # The newest frame, but never the one already recorded when the interval is shorter than a frame
+            if not self._ring.wait(seq, timeout=0.1):
+                return None
+            return self._ring.hold(self._ring.seq)
+
+        frame, missed = self._ring.next(seq, timeout=0.1)
+        if frame is None:
+            return None
+        self.missed += missed
+        held = self._ring.hold(frame.seq)
+        if held is None:
+            # Recycled between lookup and pinning
+            self.missed += 1
+        return held
+
+    def _report(self, start):
+        elapsed = max(time.monotonic() - start, 1e-6)
+        self.progress.emit(self._writer.written, self._writer.written / elapsed,
+                           self._writer.bytesWritten / elapsed / 1e6)
+
+    def run(self):
+        start = time.monotonic()
+        next_time = start
+        reported = start
+        seq = self._ring.seq
+        filename = self.filename
+        params = self.settings.params
+
+        while not self._stop and not self._done(start):
+            frame = self._nextFrame(seq, next_time)
+            if frame is None:
+                continue
+            seq = frame.seq
+            if self._interval:
+                # Waiting for a slow camera must not leave a backlog of intervals to catch up on
+                next_time = max(next_time + self._interval, time.monotonic())
+
+            while self._writer.isPending(filename):
+                filename = increment_filename(filename)
+            if not self._writer.submit(filename, frame.image, params, prepare=self._prepare,
+                                       done=lambda frame=frame: self._ring.release(frame), block=True):
+                self._ring.release(frame)
+                continue
+            self.lastFilename = filename
+            filename = increment_filename(filename)
+            self.queued += 1
+
+            if time.monotonic() - reported > 0.5:
+                reported = time.monotonic()
+                self._report(start)
+
+        self._writer.shutdown()
+        self._report(start)
+        _logger.info('Burst finished: %d frames written, %d missed', self._writer.written, self.missed)
@@ -1,23 +1,47 @@
-from . import opencv2qimage, camera_gui
-
-from PyQt5.QtGui import QPixmap
-from PyQt5.QtWidgets import QWidget, QFileDialog, QMessageBox
-from PyQt5.QtCore import pyqtSlot, QTimer, Qt
+from . import bgr2qimage, resize_to_fit, camera_gui
+from .burst import BurstRecorder, EncoderSettings
+from .image_writer import ImageWriter, increment_filename
+from .journal import JournalRecorder
+from .negotiation import Policy, mode_str
+from .processing import ProcessingStage
+from .render_worker import LivePreview
+from .roi_stats import RoiCsvWriter, RoiSeries, RoiStatsProcessor, channel_names, sensor_region
+from .stats_overlay import StatsOverlay
+from .transform import FrameTransform
+from .video_recorder import VideoRecorder
+from .zoom_export import ZoomExporter, export_size
+
+from PyQt5.QtGui import QKeySequence
+from PyQt5.QtWidgets import QWidget, QFileDialog, QMessageBox, QShortcut
+from PyQt5.QtCore import pyqtSlot, QTimer
 
 import cv2
 import numpy as np
 
-import re
 import os
+import time
 import logging
+from collections import namedtuple
 _logger = logging.getLogger(__name__)
 
+# Snapshot of everything getImage needs from the widgets, so frames can be processed off the GUI thread
+ViewState = namedtuple('ViewState', ['transform', 'roi', 'zoom_selection', 'results'])
+
+# Mode choices offered before the camera's own modes are known
+MODE_POLICIES = (
+    ('Max resolution at 15+ fps', 'max-res:15'),
+    ('Max resolution at 30+ fps', 'max-res:30'),
+    ('Max fps at 1080p+', 'max-fps:1080p'),
+    ('Max fps at 720p+', 'max-fps:720p'),
+)
+
 class CameraApp(QWidget):
-    def __init__(self, camera, *args, **kwargs):
+    def __init__(self, camera, *args, processors=(), **kwargs):
         """
 
         :type camera: camera.camera_thread.CameraThread
         :param camera:
+        :param processors: :class:`camera.processing.Processor` instances whose results are drawn over the preview
         :param args:
         :param kwargs:
         """
@@ -27,65 +51,265 @@ class CameraApp(QWidget):
         self._ui.setupUi(self)
         self.show()
 
+        self._camera = camera
+        self._stats = camera.stats
+        # Redraw when the camera publishes a new frame or the view settings change. Transform, convert and
+        # scale in a worker; the GUI thread only blits the result
+        self._preview = LivePreview(self._camera, self._ui.previewLabel, self._renderImage, view=self._renderView,
+                                    parent=self)
+        self._preview.ratesChanged.connect(self.updateFps)
+
         self._roi_start = None
         self._roi_end = None
-        self.zoomReset()
-
         self._rotate_count = 0
+        self._transform = None
+        # Selections are kept in pixels of this sensor shape, whatever resolution frames arrive at
+        self._referenceShape = camera.frame.shape[:2]
+        self._awaitingStill = False
+        self._previewModeTimer = QTimer(self)
+        self._previewModeTimer.setSingleShot(True)
+        self._previewModeTimer.setInterval(300)
+        self._previewModeTimer.timeout.connect(self._updatePreviewMode)
+        self.zoomReset()
 
-        self._camera = camera
         self._camera.start()
 
-        self._setupConnections()
+        # Frame analysis runs on its own pools and is drawn from whatever results are newest
+        self._roiStats = RoiStatsProcessor()
+        self._roiSeries = RoiSeries()
+        self._roiCsv = None
+        self._roiUpdated = 0.0
+        self._processing = ProcessingStage(self._camera, list(processors) + [self._roiStats], parent=self)
+        self._processing.resultReady.connect(self.roiResult)
+        self._processing.start()
+
+        # Encode and write saves on background threads
+        self._writer = ImageWriter(parent=self)
+        self._stats.gauge('save queue', lambda: self._writer.pending)
+        self._burst = None
+        self._video = None
+        self.videoFilename = os.path.join(os.path.expanduser('~'), 'video_001.avi')
+        self._raw = None
+        self.rawFilename = os.path.join(os.path.expanduser('~'), 'raw_001.frames')
+        self.roiCsvFilename = os.path.join(os.path.expanduser('~'), 'roi_001.csv')
+        self._zoomExport = None
+        self.zoomExportFilename = os.path.join(os.path.expanduser('~'), 'zoom_001.png')
 
-        self._timer = QTimer()
-        self._timer.singleShot(0, self.renderPreview)
+        self._setupConnections()
 
         self.filename = os.path.join(os.path.expanduser('~'), 'image_001.png')
-        self._ui.saveButton.setText('Save ' + self.filename)
+        self._updateSaveButton()
 
         self._ui.previewLabel.mousePressEvent = self.labelMousePressEvent
         self._ui.previewLabel.mouseReleaseEvent = self.labelMouseReleaseEvent
         self._ui.previewLabel.mouseMoveEvent = self.labelMouseMoveEvent
 
+        self._statsOverlay = StatsOverlay(self._stats, self._ui.previewLabel)
+        QShortcut(QKeySequence('F3'), self, self._statsOverlay.toggle)
+        self._ui.fpsLabel.setToolTip('Press F3 to show detailed pipeline statistics over the preview')
+
 
     def _setupConnections(self):
         self._ui.rotatePushButton.clicked.connect(self.incrementRotateCount)
         self._ui.saveAsButton.clicked.connect(self.saveImageAs)
         self._ui.saveButton.clicked.connect(self.saveImage)
         self._ui.zoomResetButton.clicked.connect(self.zoomReset)
+        self._ui.flipUDCheckBox.toggled.connect(self.invalidateTransform)
+        self._ui.flipLRCheckBox.toggled.connect(self.invalidateTransform)
+        self._writer.pendingChanged.connect(self._updateSaveButton)
+        self._writer.failed.connect(self.saveFailed)
+        self._ui.burstButton.clicked.connect(self.toggleBurst)
+        self._ui.videoButton.clicked.connect(self.toggleVideo)
+        self._ui.rawButton.clicked.connect(self.toggleRaw)
+        self._updateModeComboBox()
+        self._ui.modeComboBox.activated.connect(self.selectMode)
+        self._camera.modeChanged.connect(self.modeChanged)
+        self._ui.previewResCheckBox.toggled.connect(self.setPreviewResolution)
+        self._camera.previewModeChanged.connect(self.previewModeChanged)
+        self._camera.stillReady.connect(self.stillReady)
+        self._ui.lowLatencyCheckBox.setChecked(self._camera.lowLatency)
+        self._ui.lowLatencyCheckBox.toggled.connect(self._camera.setLowLatency)
+        self._ui.roiPlot.setSeries(self._roiSeries)
+        self._ui.roiCsvButton.clicked.connect(self.toggleRoiCsv)
+        self._ui.zoomExportButton.clicked.connect(self.exportZoom)
+
+        # Property values come from the camera's cache and changes are queued to the capture thread
+        if self._camera.get(cv2.CAP_PROP_EXPOSURE) <= 0:
+            # Exposure as log2 seconds (DirectShow and others) rather than V4L2's units of 100 us
+            self._ui.exposureSlider.setRange(-13, 0)
+            self._ui.exposureSlider.setSingleStep(1)
+        self._propertySliders = {
+            cv2.CAP_PROP_BRIGHTNESS: (self._ui.brightnessSlider, self._ui.brightnessLabel, self._camera.setBrightness),
+            cv2.CAP_PROP_CONTRAST: (self._ui.contrastSlider, self._ui.contrastLabel, self._camera.setContrast),
+            cv2.CAP_PROP_GAIN: (self._ui.gainSlider, self._ui.gainLabel, self._camera.setGain),
+            cv2.CAP_PROP_EXPOSURE: (self._ui.exposureSlider, self._ui.exposureLabel, self._camera.setExposure),
+            cv2.CAP_PROP_WB_TEMPERATURE: (self._ui.whiteBalanceSlider, self._ui.whiteBalanceLabel,
+                                          self._camera.setWhiteBalance),
+            cv2.CAP_PROP_FOCUS: (self._ui.focusSlider, self._ui.focusLabel, self._camera.setFocus),
+        }
+        for prop_id, (slider, _, setter) in self._propertySliders.items():
+            slider.setValue(int(self._camera.get(prop_id)))
+            slider.valueChanged.connect(setter)
+
+        self._propertyCheckBoxes = {
+            cv2.CAP_PROP_AUTO_EXPOSURE: (self._ui.autoExposureCheckBox, self._ui.exposureSlider,
+                                         self._camera.setAutoExposure, self._camera.isAutoExposure),
+            cv2.CAP_PROP_AUTO_WB: (self._ui.autoWhiteBalanceCheckBox, self._ui.whiteBalanceSlider,
+                                   self._camera.setAutoWhiteBalance,
+                                   lambda: bool(self._camera.get(cv2.CAP_PROP_AUTO_WB))),
+            cv2.CAP_PROP_AUTOFOCUS: (self._ui.autoFocusCheckBox, self._ui.focusSlider, self._camera.setAutofocus,
+                                     lambda: bool(self._camera.get(cv2.CAP_PROP_AUTOFOCUS))),
+        }
+        for checkBox, slider, setter, isAuto in self._propertyCheckBoxes.values():
+            checkBox.setChecked(isAuto())
+            slider.setEnabled(not checkBox.isChecked())
+            checkBox.toggled.connect(setter)
+            checkBox.toggled.connect(lambda checked, slider=slider: slider.setEnabled(not checked))
+        self._camera.propertyChanged.connect(self.propertyChanged)
+
+    @pyqtSlot(int, float)
+    def propertyChanged(self, prop_id, value):
+        """
+        Show what the device actually settled on, unless the user is still adjusting the control
+        """
+        if self._camera.isPropertyPending(prop_id):
+            return
+        if prop_id in self._propertySliders:
+            slider, label, _ = self._propertySliders[prop_id]
+            if not slider.isSliderDown() and slider.value() != int(value):
+                slider.blockSignals(True)
+                slider.setValue(int(value))
+                slider.blockSignals(False)
+                label.setNum(int(value))
+        elif prop_id in self._propertyCheckBoxes:
+            checkBox, slider, _, isAuto = self._propertyCheckBoxes[prop_id]
+            checkBox.blockSignals(True)
+            checkBox.setChecked(isAuto())
+            checkBox.blockSignals(False)
+            slider.setEnabled(not checkBox.isChecked())
+
+    def invalidateTransform(self, *args):
+        """
+        Call when the rotation, flips or zoom box change; the transform is rebuilt on next use
+        """
+        self._transform = None
+        self._preview.requestRender()
+        if self._ui.previewResCheckBox.isChecked():
+            self._previewModeTimer.start()
 
-        self._ui.brightnessSlider.setValue(self._camera.get(cv2.CAP_PROP_BRIGHTNESS))
-        self._ui.brightnessSlider.valueChanged.connect(self._camera.setBrightness)
-
-        self._ui.contrastSlider.setValue(self._camera.get(cv2.CAP_PROP_CONTRAST))
-        self._ui.contrastSlider.valueChanged.connect(self._camera.setContrast)
-
-        self._ui.gainSlider.setValue(self._camera.get(cv2.CAP_PROP_GAIN))
-        self._ui.gainSlider.valueChanged.connect(self._camera.setGain)
+    def _coordScale(self, shape):
+        """
+        :return: factor from the reference resolution selections are kept in to pixels of frames of ``shape``
+        """
+        return shape[1] * 1.0 / self._referenceShape[1] if self._referenceShape[1] else 1.0
 
-    def getImage(self):
-        image = self._camera.frame
+    def getTransform(self, shape=None):
+        """
+        :param shape: shape of the frames to transform, defaults to the newest frame's
+        :rtype: FrameTransform
+        :return: the current rotate/flip/zoom mapping between sensor and view coordinates. Must be called
+            on the GUI thread.
+        """
+        if shape is None:
+            shape = self._camera.frame.shape
+        if self._transform is None or self._transform.sensor_shape != shape[:2]:
+            f = self._coordScale(shape)
+            crop = tuple(None if v is None else v * f for v in (self.x1, self.y1, self.x2, self.y2))
+            self._transform = FrameTransform(shape, self._rotate_count, self._isFlipud(), self._isFliplr(), crop)
+        return self._transform
+
+    def _viewState(self, shape=None):
+        """
+        Capture the current view settings, in pixels of frames of ``shape``. Must be called on the GUI thread.
+        """
+        transform = self.getTransform(shape)
+        f = self._coordScale(transform.sensor_shape)
 
-        for _ in range(self._rotate_count % 4):
-            image = np.rot90(image)
-        if self._isFlipud():
-            image = np.flipud(image)
-        if self._isFliplr():
-            image = np.fliplr(image)
+        def scaled(pt):
+            return None if pt is None else (pt[0] * f, pt[1] * f)
 
-        image = self.drawROIRectange(image, self._roi_start, self._roi_end, (0, 255, 0))
+        return ViewState(transform=transform,
+                         roi=(scaled(self._roi_start), scaled(self._roi_end)),
+                         zoom_selection=None if self._zoom_released else (scaled(self._zoom_start),
+                                                                           scaled(self._zoom_end)),
+                         results=self._processing.latest())
 
-        if not self._zoom_released:
-            image = self.drawROIRectange(image, self._zoom_start, self._zoom_end, (0, 0, 255))
-        if self._zoom_released and self._zoom_start is not None and self._zoom_end is not None:
+    def _applyZoomSelection(self):
+        if self._zoom_start is not None and self._zoom_end is not None:
             (x1, y1), (x2, y2) = (tuple(round(i) for i in pt) for pt in (self._zoom_start, self._zoom_end))
             if x1 != x2 and y1 != y2:
                 self.x1, self.x2 = sorted([x1, x2])
                 self.y1, self.y2 = sorted([y1, y2])
-        if self.x1 is not None and self.x2 is not None and self.y1 is not None and self.y2 is not None:
-            image = image[self.y1:self.y2, self.x1:self.x2]
+                # The preview crop snaps to whole pixels; exports use the selection as drawn
+                (fx1, fx2), (fy1, fy2) = (sorted(pair) for pair in zip(self._zoom_start, self._zoom_end))
+                self._zoomRect = (fx1, fy1, fx2, fy2)
+                self.invalidateTransform()
+
+    def getImage(self, image=None, state=None, overlays=True):
+        """
+
+        :param image: frame to transform, defaults to the newest camera frame
+        :type state: ViewState
+        :param state: view settings, defaults to the current ones; required when called off the GUI thread
+        :param overlays: draw the ROI and zoom selection rectangles at full resolution
+        """
+        if image is None:
+            image = self._camera.frame
+        if state is None:
+            state = self._viewState()
+        start = time.monotonic()
+
+        # Crop and orientation are a single view; only the visible region is copied if anything is drawn
+        image = state.transform.apply(image)
+
+        if overlays:
+            x1, y1 = state.transform.origin
+
+            def toView(pt):
+                return None if pt is None else (pt[0] - x1, pt[1] - y1)
+
+            image = self.drawROIRectange(image, toView(state.roi[0]), toView(state.roi[1]), (0, 255, 0))
+
+            if state.zoom_selection is not None:
+                image = self.drawROIRectange(image, toView(state.zoom_selection[0]),
+                                             toView(state.zoom_selection[1]), (0, 0, 255))
 
+        self._stats.record('transform', time.monotonic() - start)
+        return image
+
+    def _renderImage(self, image, state, width, height):
+        """
+        Runs on the render worker thread. Shrinks the view to the label size first and draws the
+        rectangles on the small image, mapping image coordinates the same way :meth:`getPos` does.
+        """
+        if image.shape[:2] != state.transform.sensor_shape:
+            # Captured just as the resolution changed; the next frame will match the view again
+            return None
+        start = time.monotonic()
+        image, scale = resize_to_fit(self.getImage(image, state, overlays=False), width, height)
+        resized = time.monotonic()
+        self._stats.record('resize', resized - start)
+        x1, y1 = state.transform.origin
+
+        def toPreview(pt):
+            return None if pt is None else ((pt[0] - x1) * scale, (pt[1] - y1) * scale)
+
+        image = self.drawROIRectange(image, toPreview(state.roi[0]), toPreview(state.roi[1]), (0, 255, 0))
+        if state.zoom_selection is not None:
+            image = self.drawROIRectange(image, toPreview(state.zoom_selection[0]),
+                                         toPreview(state.zoom_selection[1]), (0, 0, 255))
+        if state.results:
+            # The preview may still be a view of the captured frame
+            image = image.copy()
+            for processor, result in state.results:
+                f = state.transform.sensor_shape[1] * 1.0 / result.shape[1]
+
+                def mapPoint(x, y):
+                    return toPreview(state.transform.fromSensor(x * f, y * f))
+
+                processor.draw(image, result, mapPoint)
+        image = bgr2qimage(image)
+        self._stats.record('convert', time.monotonic() - resized)
         return image
 
     @staticmethod
@@ -104,12 +328,14 @@ class CameraApp(QWidget):
         if self._ui.roiButton.isChecked():
             self._roi_start = (image_x, image_y)
             self._roi_end = None
+            self._roiSeries.clear()
         elif self._ui.zoomButton.isChecked():
             self._zoom_start = (image_x, image_y)
             self._zoom_end = None
             self._zoom_released = False
         else:
             _logger.error('Invalid selection mode')
+        self._preview.requestRender()
 
     def labelMouseReleaseEvent(self, event):
         image_x, image_y = self.getPos(event)
@@ -118,8 +344,10 @@ class CameraApp(QWidget):
         elif self._ui.zoomButton.isChecked():
             self._zoom_end = (image_x, image_y)
             self._zoom_released = True
+            self._applyZoomSelection()
         else:
             _logger.error('Invalid selection mode')
+        self._preview.requestRender()
 
     def labelMouseMoveEvent(self, event):
         image_x, image_y = self.getPos(event)
@@ -130,25 +358,21 @@ class CameraApp(QWidget):
             self._zoom_released = False
         else:
             _logger.error('Invalid selection mode')
+        self._preview.requestRender()
 
     def getPos(self, event):
         x = event.pos().x()
         y = event.pos().y()
-        if self.x1 is None or self.x2 is None or self.y1 is None or self.y2 is None:
-            height_in, width_in = self.getImage().shape[:2]
-        else:
-            height_in, width_in = self.y2 - self.y1, self.x2 - self.x1
+        transform = self.getTransform()
+        height_in, width_in = transform.shape
         width_out = self._ui.previewLabel.width()
         height_out = self._ui.previewLabel.height()
         scale = min(height_out * 1.0 / height_in, width_out * 1.0 / width_in)
         width_offset = width_out - scale * width_in
         height_offset = height_out - scale * height_in
-        image_x = (x - 0.5 * width_offset) * 1.0 / scale
-        image_y = (y - 0.5 * height_offset) * 1.0 / scale
-        if self.x1 is not None:
-            image_x += self.x1
-        if self.x2 is not None:
-            image_y += self.y1
+        f = self._coordScale(transform.sensor_shape)
+        image_x = ((x - 0.5 * width_offset) * 1.0 / scale + transform.origin[0]) / f
+        image_y = ((y - 0.5 * height_offset) * 1.0 / scale + transform.origin[1]) / f
 
         _logger.debug('GUI coord: %g,%g; Image coord: %g,%g; Input: %g,%g', x, y,
               image_x,
@@ -157,21 +381,106 @@ class CameraApp(QWidget):
 
         return image_x, image_y
 
-    @pyqtSlot()
-    def renderPreview(self):
-        image = self.getImage()
-        image = opencv2qimage(image)
-        pixmap = QPixmap.fromImage(image).scaled(self._ui.previewLabel.width(), self._ui.previewLabel.height(), Qt.KeepAspectRatio)
-        self._ui.previewLabel.setPixmap(pixmap)
+    def _renderView(self):
+        """
+        View settings for the next preview render; also points the ROI statistics at the current ROI
+        """
+        state = self._viewState()
+        region = sensor_region(state.transform, *state.roi)
+        if region != self._roiStats.region:
+            self._roiStats.setRegion(region, state.transform.sensor_shape)
+        return (state,)
+
+    @pyqtSlot(int, str, object)
+    def roiResult(self, seq, name, result):
+        if name != self._roiStats.name or result.value is None:
+            return
+        sample = result.value
+        self._roiSeries.append(seq, result.timestamp, sample)
+        if self._roiCsv is not None:
+            self._roiCsv.write(seq, result.timestamp, sample)
+        now = time.monotonic()
+        if now - self._roiUpdated < 0.1:
+            return
+        self._roiUpdated = now
+        x1, y1, x2, y2 = self._roiStats.region
+        names = [c.upper() for c in channel_names(len(sample.mean))]
+
+        def row(label, values, fmt):
+            return label + ' ' + ' '.join('%s %s' % (c, fmt % v) for c, v in zip(names, values))
+
+        text = '\n'.join(['%d x %d sensor px' % (x2 - x1, y2 - y1),
+                          row('mean', sample.mean, '%.1f'), row('std', sample.std, '%.1f'),
+                          row('min', sample.min, '%g'), row('max', sample.max, '%g')])
+        if self._roiCsv is not None:
+            text += '\n%d rows to %s' % (self._roiCsv.rows, os.path.basename(self._roiCsv.filename))
+        self._ui.roiStatsLabel.setText(text)
+        self._ui.roiPlot.update()
 
-        self._timer.singleShot(1000 // 30, self.renderPreview)
+    @pyqtSlot(bool)
+    def toggleRoiCsv(self, checked=False):
+        if self._roiCsv is not None:
+            self._roiCsv.close()
+            _logger.info('Wrote %d ROI samples to %s', self._roiCsv.rows, self._roiCsv.filename)
+            self._roiCsv = None
+            self._ui.roiCsvButton.setText('Export CSV...')
+            return
+        filename, _ = QFileDialog.getSaveFileName(
+            parent=self, caption='Export ROI Statistics', directory=self.roiCsvFilename,
+            filter='CSV files (*.csv);;All files (*.*)'
+        )
+        if not filename:
+            return
+        try:
+            self._roiCsv = RoiCsvWriter(filename)
+        except (IOError, OSError) as e:
+            QMessageBox.warning(self, 'Export Failed', 'Could not create %s: %s' % (filename, e))
+            return
+        self.roiCsvFilename = increment_filename(filename)
+        self._ui.roiCsvButton.setText('Stop CSV')
+
+    @pyqtSlot(float, float)
+    def updateFps(self, capture_fps, render_fps):
+        text = 'Capture %.1f fps, render %.1f fps' % (capture_fps, render_fps)
+        latency = self._stats.histogram('latency').percentiles((50,))
+        if latency is not None:
+            text += ', latency %.0f ms' % (latency[0] * 1000)
+        self._ui.fpsLabel.setText(text)
+
+    def resizeEvent(self, event):
+        super(CameraApp, self).resizeEvent(event)
+        if self._ui.previewResCheckBox.isChecked():
+            self._previewModeTimer.start()
+
+    def closeEvent(self, a0):
+        self._preview.stop()
+        if self._burst is not None:
+            self._burst.stop()
+            self._burst.wait()
+        if self._video is not None:
+            self._video.stop()
+            self._video.wait()
+        if self._raw is not None:
+            self._raw.stop()
+            self._raw.wait()
+        if self._zoomExport is not None:
+            self._zoomExport.stop()
+            self._zoomExport.wait()
+        _logger.info('Waiting for %d pending saves...', self._writer.pending)
+        self._writer.shutdown()
+        self._processing.stop()
+        if self._roiCsv is not None:
+            self._roiCsv.close()
+        self._camera.stop_flag = True
+        _logger.info('Waiting for camera to finish...')
+        self._camera.wait()
 
     @pyqtSlot(bool)
     def saveImageAs(self, checked=False):
         _logger.info('saveImageAs:')
         filename, _ = QFileDialog.getSaveFileName(
             parent=self, caption='Save As', directory=self.filename,
-            filter="Images (*.bmp *.jpg *.jpeg *.png);;All files (*.*)"
+            filter="Images (*.bmp *.jpg *.jpeg *.png);;NumPy arrays (*.npy);;All files (*.*)"
         )
         if filename:
             self.filename = filename
@@ -182,23 +491,305 @@ class CameraApp(QWidget):
     @pyqtSlot(bool)
     def saveImage(self, checked=False):
         _logger.info('saveImage:')
-        cv2.imwrite(self.filename, self.getImage())
+        if self._ui.previewResCheckBox.isChecked():
+            # The preview is reduced; save a full resolution frame grabbed for the purpose instead
+            if not self._awaitingStill:
+                self._awaitingStill = True
+                self._ui.saveButton.setEnabled(False)
+                self._camera.requestStill()
+            return
+        # Save exactly the frame on screen; it stays pinned in the ring until the writer is done with it
+        ring = self._camera.ring
+        frame = ring.hold(self._preview.displayedSeq)
+        if frame is None:
+            frame = ring.hold(ring.seq)
+            if frame is not None and self._preview.displayedSeq >= 0:
+                _logger.warning('Frame %d on screen was already recycled; saving frame %d, captured %d frames later',
+                                self._preview.displayedSeq, frame.seq, frame.seq - self._preview.displayedSeq)
+        self._saveFrame(frame)
+
+    @pyqtSlot(int)
+    def stillReady(self, seq):
+        if not self._awaitingStill:
+            return
+        self._awaitingStill = False
+        self._ui.saveButton.setEnabled(True)
+        frame = self._camera.ring.hold(seq)
+        if frame is None:
+            QMessageBox.warning(self, 'No Image', 'Could not grab a full resolution frame.')
+            return
+        self._saveFrame(frame)
+
+    def _saveFrame(self, frame):
+        """
+        Queue a pinned frame for saving under :attr:`filename` with the current view settings
+        """
+        ring = self._camera.ring
+        if frame is None:
+            QMessageBox.warning(self, 'No Image', 'No frame has been captured yet.')
+            return
+        state = self._viewState(frame.image.shape)
+        if not self._writer.submit(self.filename, frame.image,
+                                   prepare=lambda image: self.getImage(image, state),
+                                   done=lambda: ring.release(frame)):
+            ring.release(frame)
+            QMessageBox.warning(self, 'Save Busy', 'Could not queue %s: %d saves are still being written.' %
+                                (self.filename, self._writer.pending))
+            return
+        _logger.debug('Queued frame %d as %s', frame.seq, self.filename)
         self.incrementFilename()
 
+    @pyqtSlot(str, str)
+    def saveFailed(self, filename, message):
+        QMessageBox.warning(self, 'Save Failed', 'Could not save %s: %s' % (filename, message))
+
     def incrementFilename(self):
-        match_list = tuple(re.finditer(r'(\d+)', self.filename))
-        if match_list:
-            # Get last match of digits
-            match = match_list[-1]
-            index = int(self.filename[slice(*match.span())])
-            index += 1
-            index = str(index)
-            index = index.zfill(match.span()[1] - match.span()[0])
-            self.filename = self.filename[:match.span()[0]] + index + self.filename[match.span()[1]:]
+        # Skip names still reserved by queued saves so they never collide
+        self.filename = increment_filename(self.filename)
+        while self._writer.isPending(self.filename):
+            self.filename = increment_filename(self.filename)
+        self._updateSaveButton()
+
+    def _updateSaveButton(self, *args):
+        text = 'Save ' + self.filename
+        if self._writer.pending:
+            text += ' (%d pending)' % self._writer.pending
+        self._ui.saveButton.setText(text)
+
+    def encoderSettings(self):
+        """
+        :rtype: EncoderSettings
+        """
+        return EncoderSettings(format=('png', 'jpg', 'npy')[self._ui.formatComboBox.currentIndex()],
+                               png_compression=self._ui.pngCompressionSpinBox.value(),
+                               jpeg_quality=self._ui.jpegQualitySpinBox.value())
+
+    @pyqtSlot(bool)
+    def toggleBurst(self, checked=False):
+        if self._burst is not None:
+            self._burst.stop()
+            return
+
+        transform = self.getTransform()
+        self._burst = BurstRecorder(self._camera.ring, self.filename, self.encoderSettings(),
+                                    count=self._ui.burstCountSpinBox.value(),
+                                    interval=self._ui.intervalSpinBox.value(),
+                                    duration=self._ui.durationSpinBox.value(),
+                                    prepare=transform.apply, parent=self)
+        self._burst.progress.connect(self.burstProgress)
+        self._burst.finished.connect(self.burstFinished)
+        self._ui.burstButton.setText('Stop Burst')
+        # The burst numbers its files from the save filename, so a save meanwhile could overwrite one
+        self._ui.saveButton.setEnabled(False)
+        self._ui.saveAsButton.setEnabled(False)
+        self._burst.start()
+
+    @pyqtSlot(int, float, float)
+    def burstProgress(self, written, fps, mbps):
+        self._ui.burstStatusLabel.setText('%d frames, %.1f fps, %.1f MB/s' % (written, fps, mbps))
+
+    @pyqtSlot()
+    def burstFinished(self):
+        if self._burst.missed:
+            self._ui.burstStatusLabel.setText(self._ui.burstStatusLabel.text() + ', %d missed' % self._burst.missed)
+        if self._burst.lastFilename is not None:
+            self.filename = self._burst.lastFilename
+            self.incrementFilename()
+        self._burst = None
+        self._ui.burstButton.setText('Start Burst')
+        self._ui.saveButton.setEnabled(True)
+        self._ui.saveAsButton.setEnabled(True)
+
+    @pyqtSlot(bool)
+    def exportZoom(self, checked=False):
+        """
+        Save the zoomed region resampled from full resolution frames, averaging as many as asked for
+        """
+        if self._zoomExport is not None:
+            self._zoomExport.stop()
+            return
+        if self._ui.previewResCheckBox.isChecked():
+            QMessageBox.warning(self, 'Preview Resolution',
+                                'Turn off capturing at preview resolution to export at full resolution.')
+            return
+        transform = self.getTransform()
+        f = self._coordScale(transform.sensor_shape)
+        rect = transform.crop if self._zoomRect is None else tuple(v * f for v in self._zoomRect)
+        # A selection can start in the letterbox around the frame; only the part over the frame is exported
+        h, w = transform.oriented_shape
+        x1, y1, x2, y2 = rect
+        rect = (min(max(x1, 0), w), min(max(y1, 0), h), min(max(x2, 0), w), min(max(y2, 0), h))
+        if rect[0] >= rect[2] or rect[1] >= rect[3]:
+            QMessageBox.warning(self, 'Export Zoom', 'The zoom selection does not cover any of the frame.')
+            return
+        filename, _ = QFileDialog.getSaveFileName(
+            parent=self, caption='Export Zoom', directory=self.zoomExportFilename,
+            filter="Images (*.bmp *.jpg *.jpeg *.png);;NumPy arrays (*.npy);;All files (*.*)"
+        )
+        if not filename:
+            return
+        scale = self._ui.exportScaleSpinBox.value()
+        # Quality settings are shared with recording
+        fmt = os.path.splitext(filename)[1].lower().lstrip('.').replace('jpeg', 'jpg')
+        params = EncoderSettings(fmt, self._ui.pngCompressionSpinBox.value(),
+                                 self._ui.jpegQualitySpinBox.value()).params if fmt in EncoderSettings.FORMATS else ()
+        self._zoomExport = ZoomExporter(self._camera.ring, transform, rect, filename, self._writer,
+                                        frames=self._ui.exportFramesSpinBox.value(), size=export_size(rect, scale),
+                                        interpolation=cv2.INTER_LANCZOS4 if scale > 1 else cv2.INTER_CUBIC,
+                                        params=params, parent=self)
+        self._zoomExport.progress.connect(self.zoomExportProgress)
+        self._zoomExport.exported.connect(self.zoomExported)
+        self._ui.zoomExportButton.setText('Cancel Export')
+        self._zoomExport.start()
+
+    @pyqtSlot(int, int)
+    def zoomExportProgress(self, added, frames):
+        self._ui.zoomExportButton.setText('Cancel Export (%d/%d)' % (added, frames))
+
+    @pyqtSlot(str)
+    def zoomExported(self, filename):
+        if self._zoomExport.missed:
+            _logger.warning('Zoom export skipped %d frames that were recycled first', self._zoomExport.missed)
+        self._zoomExport.wait()
+        self._zoomExport = None
+        self._ui.zoomExportButton.setText('Export Zoom...')
+        if filename:
+            self.zoomExportFilename = increment_filename(filename)
+
+    @pyqtSlot(bool)
+    def toggleVideo(self, checked=False):
+        if self._video is not None:
+            self._video.stop()
+            return
+
+        fps = self._camera.captureFps or self._camera.get(cv2.CAP_PROP_FPS) or 30.0
+        self._video = VideoRecorder(self._camera, self.videoFilename, fps=fps,
+                                    transform=self.getTransform(), parent=self)
+        self._video.progress.connect(self.videoProgress)
+        self._video.finished.connect(self.videoFinished)
+        self._ui.videoButton.setText('Stop Recording')
+        self._ui.videoStatusLabel.setText('Recording %s at %.1f fps' % (self.videoFilename, fps))
+        self._video.start()
+
+    @pyqtSlot(int, int)
+    def videoProgress(self, written, dropped):
+        self._ui.videoStatusLabel.setText('%s: %d frames, %d dropped' %
+                                          (os.path.basename(self.videoFilename), written, dropped))
+
+    @pyqtSlot()
+    def videoFinished(self):
+        self._video = None
+        self.videoFilename = increment_filename(self.videoFilename)
+        self._ui.videoButton.setText('Record Video')
+
+    @pyqtSlot(bool)
+    def toggleRaw(self, checked=False):
+        if self._raw is not None:
+            self._raw.stop()
+            return
+
+        capacity = self._ui.burstCountSpinBox.value()
+        if not capacity:
+            fps = self._camera.captureFps or 30.0
+            capacity = int(self._ui.durationSpinBox.value() * fps) or 300
+        try:
+            self._raw = JournalRecorder(self._camera, self.rawFilename, capacity, parent=self)
+        except (IOError, OSError) as e:
+            QMessageBox.warning(self, 'Record Failed', 'Could not create %s: %s' % (self.rawFilename, e))
+            return
+        self._raw.progress.connect(self.rawProgress)
+        self._raw.finished.connect(self.rawFinished)
+        self._ui.rawButton.setText('Stop Raw')
+        self._ui.rawStatusLabel.setText('Recording up to %d frames to %s' % (capacity, self.rawFilename))
+        self._raw.start()
+
+    @pyqtSlot(int, int)
+    def rawProgress(self, written, missed):
+        self._ui.rawStatusLabel.setText('%s: %d frames, %d missed' %
+                                        (os.path.basename(self.rawFilename), written, missed))
+
+    @pyqtSlot()
+    def rawFinished(self):
+        self._raw = None
+        self.rawFilename = increment_filename(self.rawFilename)
+        self._ui.rawButton.setText('Record Raw')
+
+    def _updateModeComboBox(self):
+        """
+        List the current mode first, then the policies and any modes the camera is known to offer
+        """
+        combo = self._ui.modeComboBox
+        combo.clear()
+        combo.addItem('Mode: %s' % mode_str(self._camera.mode), None)
+        for text, spec in MODE_POLICIES:
+            combo.addItem(text, spec)
+        negotiation = self._camera.negotiation
+        for mode in (negotiation.modes if negotiation is not None else ()):
+            combo.addItem(mode_str(mode), '%dx%d@%g:%s' % (mode.width, mode.height, mode.fps, mode.fourcc or ''))
+
+    @pyqtSlot(int)
+    def selectMode(self, index):
+        spec = self._ui.modeComboBox.itemData(index)
+        if spec is None:
+            return
+        self._ui.modeComboBox.setEnabled(False)
+        self._ui.modeComboBox.setItemText(0, 'Negotiating...')
+        self._ui.modeComboBox.setCurrentIndex(0)
+        self._camera.requestMode(Policy.parse(spec))
+
+    @pyqtSlot(str)
+    def modeChanged(self, description):
+        _logger.info('Camera mode changed to %s', description)
+        # Selections are in sensor pixels, which no longer mean the same thing
+        mode = self._camera.negotiation.mode
+        self._referenceShape = (mode.height, mode.width)
+        self._ui.previewResCheckBox.setChecked(False)
+        self._roi_start = None
+        self._roi_end = None
+        self.zoomReset()
+        self._updateModeComboBox()
+        self._ui.modeComboBox.setEnabled(True)
+
+    @pyqtSlot(bool)
+    def setPreviewResolution(self, enabled):
+        """
+        Capture only as many pixels as the preview needs. Recording needs every pixel, so it is unavailable
+        meanwhile.
+        """
+        if enabled and (self._burst or self._video or self._raw):
+            QMessageBox.warning(self, 'Recording', 'Stop recording before capturing at preview resolution.')
+            self._ui.previewResCheckBox.setChecked(False)
+            return
+        for button in (self._ui.burstButton, self._ui.videoButton, self._ui.rawButton):
+            button.setEnabled(not enabled)
+        if enabled:
+            self._updatePreviewMode()
         else:
-            file, ext = os.path.splitext(self.filename)
-            self.filename = file + '_001' + ext
-        self._ui.saveButton.setText('Save ' + self.filename)
+            self._previewModeTimer.stop()
+            self._camera.requestFullMode()
+
+    @pyqtSlot()
+    def _updatePreviewMode(self):
+        """
+        Ask for the smallest capture resolution that still fills the preview at the current zoom
+        """
+        if not self._ui.previewResCheckBox.isChecked():
+            return
+        ref_h, ref_w = self._referenceShape
+        view_w, view_h = (ref_w, ref_h) if self._rotate_count % 2 == 0 else (ref_h, ref_w)
+        if None not in (self.x1, self.y1, self.x2, self.y2):
+            view_w, view_h = abs(self.x2 - self.x1), abs(self.y2 - self.y1)
+        scale = min(self._ui.previewLabel.width() * 1.0 / max(view_w, 1),
+                    self._ui.previewLabel.height() * 1.0 / max(view_h, 1), 1.0)
+        self._camera.requestPreviewMode(int(np.ceil(ref_w * scale)), int(np.ceil(ref_h * scale)))
+
+    @pyqtSlot(str, float, float, float)
+    def previewModeChanged(self, description, seconds, fps_before, fps_after):
+        _logger.info('Capturing at %s; switched in %.0f ms, %.1f -> %.1f fps', description, seconds * 1000,
+                     fps_before, fps_after)
+        self._ui.modeComboBox.setItemText(0, 'Mode: %s (switched in %.0f ms, %.1f -> %.1f fps)' %
+                                          (description, seconds * 1000, fps_before, fps_after))
+        self._preview.requestRender()
 
     def _isFlipud(self):
         return self._ui.flipUDCheckBox.isChecked()
@@ -209,6 +800,7 @@ class CameraApp(QWidget):
     @pyqtSlot(bool)
     def incrementRotateCount(self, checked=False):
         self._rotate_count += 1
+        self.invalidateTransform()
 
     @pyqtSlot(bool)
     def zoomReset(self, checked=False):
@@ -220,4 +812,6 @@ class CameraApp(QWidget):
         self.x2 = None
         self.y1 = None
         self.y2 = None
+        self._zoomRect = None
         _logger.debug('Zoom variables reset')
+        self.invalidateTransform()
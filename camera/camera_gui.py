@@ -106,6 +106,63 @@ class Ui_Camera(object):
         self.gainSlider.setOrientation(QtCore.Qt.Horizontal)
         self.gainSlider.setObjectName("gainSlider")
         self.verticalLayout_3.addWidget(self.gainSlider)
+        self.exposureTitleLayout = QtWidgets.QHBoxLayout()
+        self.exposureTitleLayout.setObjectName("exposureTitleLayout")
+        self.label_5 = QtWidgets.QLabel(self.formWidget)
+        self.label_5.setObjectName("label_5")
+        self.exposureTitleLayout.addWidget(self.label_5)
+        self.autoExposureCheckBox = QtWidgets.QCheckBox(self.formWidget)
+        self.autoExposureCheckBox.setObjectName("autoExposureCheckBox")
+        self.exposureTitleLayout.addWidget(self.autoExposureCheckBox)
+        self.verticalLayout_3.addLayout(self.exposureTitleLayout)
+        self.exposureLabel = QtWidgets.QLabel(self.formWidget)
+        self.exposureLabel.setObjectName("exposureLabel")
+        self.verticalLayout_3.addWidget(self.exposureLabel)
+        self.exposureSlider = QtWidgets.QSlider(self.formWidget)
+        self.exposureSlider.setMinimum(1)
+        self.exposureSlider.setMaximum(5000)
+        self.exposureSlider.setSingleStep(10)
+        self.exposureSlider.setOrientation(QtCore.Qt.Horizontal)
+        self.exposureSlider.setObjectName("exposureSlider")
+        self.verticalLayout_3.addWidget(self.exposureSlider)
+        self.whiteBalanceTitleLayout = QtWidgets.QHBoxLayout()
+        self.whiteBalanceTitleLayout.setObjectName("whiteBalanceTitleLayout")
+        self.label_6 = QtWidgets.QLabel(self.formWidget)
+        self.label_6.setObjectName("label_6")
+        self.whiteBalanceTitleLayout.addWidget(self.label_6)
+        self.autoWhiteBalanceCheckBox = QtWidgets.QCheckBox(self.formWidget)
+        self.autoWhiteBalanceCheckBox.setObjectName("autoWhiteBalanceCheckBox")
+        self.whiteBalanceTitleLayout.addWidget(self.autoWhiteBalanceCheckBox)
+        self.verticalLayout_3.addLayout(self.whiteBalanceTitleLayout)
+        self.whiteBalanceLabel = QtWidgets.QLabel(self.formWidget)
+        self.whiteBalanceLabel.setObjectName("whiteBalanceLabel")
+        self.verticalLayout_3.addWidget(self.whiteBalanceLabel)
+        self.whiteBalanceSlider = QtWidgets.QSlider(self.formWidget)
+        self.whiteBalanceSlider.setMinimum(2800)
+        self.whiteBalanceSlider.setMaximum(6500)
+        self.whiteBalanceSlider.setSingleStep(50)
+        self.whiteBalanceSlider.setOrientation(QtCore.Qt.Horizontal)
+        self.whiteBalanceSlider.setObjectName("whiteBalanceSlider")
+        self.verticalLayout_3.addWidget(self.whiteBalanceSlider)
+        self.focusTitleLayout = QtWidgets.QHBoxLayout()
+        self.focusTitleLayout.setObjectName("focusTitleLayout")
+        self.label_7 = QtWidgets.QLabel(self.formWidget)
+        self.label_7.setObjectName("label_7")
+        self.focusTitleLayout.addWidget(self.label_7)
+        self.autoFocusCheckBox = QtWidgets.QCheckBox(self.formWidget)
+        self.autoFocusCheckBox.setObjectName("autoFocusCheckBox")
+        self.focusTitleLayout.addWidget(self.autoFocusCheckBox)
+        self.verticalLayout_3.addLayout(self.focusTitleLayout)
+        self.focusLabel = QtWidgets.QLabel(self.formWidget)
+        self.focusLabel.setObjectName("focusLabel")
+        self.verticalLayout_3.addWidget(self.focusLabel)
+        self.focusSlider = QtWidgets.QSlider(self.formWidget)
+        self.focusSlider.setMinimum(0)
+        self.focusSlider.setMaximum(255)
+        self.focusSlider.setSingleStep(1)
+        self.focusSlider.setOrientation(QtCore.Qt.Horizontal)
+        self.focusSlider.setObjectName("focusSlider")
+        self.verticalLayout_3.addWidget(self.focusSlider)
         self.rotatePushButton = QtWidgets.QPushButton(self.formWidget)
         self.rotatePushButton.setObjectName("rotatePushButton")
         self.verticalLayout_3.addWidget(self.rotatePushButton)
@@ -124,6 +181,129 @@ class Ui_Camera(object):
         self.flipLRCheckBox.setObjectName("flipLRCheckBox")
         self.formLayout_2.setWidget(1, QtWidgets.QFormLayout.FieldRole, self.flipLRCheckBox)
         self.verticalLayout_3.addLayout(self.formLayout_2)
+        self.recordGroupBox = QtWidgets.QGroupBox(self.formWidget)
+        self.recordGroupBox.setObjectName("recordGroupBox")
+        self.formLayout_3 = QtWidgets.QFormLayout(self.recordGroupBox)
+        self.formLayout_3.setObjectName("formLayout_3")
+        self.formatLabel = QtWidgets.QLabel(self.recordGroupBox)
+        self.formatLabel.setObjectName("formatLabel")
+        self.formLayout_3.setWidget(0, QtWidgets.QFormLayout.LabelRole, self.formatLabel)
+        self.formatComboBox = QtWidgets.QComboBox(self.recordGroupBox)
+        self.formatComboBox.setObjectName("formatComboBox")
+        self.formatComboBox.addItem("")
+        self.formatComboBox.addItem("")
+        self.formatComboBox.addItem("")
+        self.formLayout_3.setWidget(0, QtWidgets.QFormLayout.FieldRole, self.formatComboBox)
+        self.pngCompressionLabel = QtWidgets.QLabel(self.recordGroupBox)
+        self.pngCompressionLabel.setObjectName("pngCompressionLabel")
+        self.formLayout_3.setWidget(1, QtWidgets.QFormLayout.LabelRole, self.pngCompressionLabel)
+        self.pngCompressionSpinBox = QtWidgets.QSpinBox(self.recordGroupBox)
+        self.pngCompressionSpinBox.setMinimum(0)
+        self.pngCompressionSpinBox.setMaximum(9)
+        self.pngCompressionSpinBox.setProperty("value", 3)
+        self.pngCompressionSpinBox.setObjectName("pngCompressionSpinBox")
+        self.formLayout_3.setWidget(1, QtWidgets.QFormLayout.FieldRole, self.pngCompressionSpinBox)
+        self.jpegQualityLabel = QtWidgets.QLabel(self.recordGroupBox)
+        self.jpegQualityLabel.setObjectName("jpegQualityLabel")
+        self.formLayout_3.setWidget(2, QtWidgets.QFormLayout.LabelRole, self.jpegQualityLabel)
+        self.jpegQualitySpinBox = QtWidgets.QSpinBox(self.recordGroupBox)
+        self.jpegQualitySpinBox.setMinimum(0)
+        self.jpegQualitySpinBox.setMaximum(100)
+        self.jpegQualitySpinBox.setProperty("value", 95)
+        self.jpegQualitySpinBox.setObjectName("jpegQualitySpinBox")
+        self.formLayout_3.setWidget(2, QtWidgets.QFormLayout.FieldRole, self.jpegQualitySpinBox)
+        self.burstCountLabel = QtWidgets.QLabel(self.recordGroupBox)
+        self.burstCountLabel.setObjectName("burstCountLabel")
+        self.formLayout_3.setWidget(3, QtWidgets.QFormLayout.LabelRole, self.burstCountLabel)
+        self.burstCountSpinBox = QtWidgets.QSpinBox(self.recordGroupBox)
+        self.burstCountSpinBox.setMinimum(0)
+        self.burstCountSpinBox.setMaximum(1000000)
+        self.burstCountSpinBox.setProperty("value", 10)
+        self.burstCountSpinBox.setObjectName("burstCountSpinBox")
+        self.formLayout_3.setWidget(3, QtWidgets.QFormLayout.FieldRole, self.burstCountSpinBox)
+        self.intervalLabel = QtWidgets.QLabel(self.recordGroupBox)
+        self.intervalLabel.setObjectName("intervalLabel")
+        self.formLayout_3.setWidget(4, QtWidgets.QFormLayout.LabelRole, self.intervalLabel)
+        self.intervalSpinBox = QtWidgets.QDoubleSpinBox(self.recordGroupBox)
+        self.intervalSpinBox.setDecimals(3)
+        self.intervalSpinBox.setMinimum(0.0)
+        self.intervalSpinBox.setMaximum(86400.0)
+        self.intervalSpinBox.setProperty("value", 0.0)
+        self.intervalSpinBox.setObjectName("intervalSpinBox")
+        self.formLayout_3.setWidget(4, QtWidgets.QFormLayout.FieldRole, self.intervalSpinBox)
+        self.durationLabel = QtWidgets.QLabel(self.recordGroupBox)
+        self.durationLabel.setObjectName("durationLabel")
+        self.formLayout_3.setWidget(5, QtWidgets.QFormLayout.LabelRole, self.durationLabel)
+        self.durationSpinBox = QtWidgets.QDoubleSpinBox(self.recordGroupBox)
+        self.durationSpinBox.setDecimals(1)
+        self.durationSpinBox.setMinimum(0.0)
+        self.durationSpinBox.setMaximum(604800.0)
+        self.durationSpinBox.setProperty("value", 0.0)
+        self.durationSpinBox.setObjectName("durationSpinBox")
+        self.formLayout_3.setWidget(5, QtWidgets.QFormLayout.FieldRole, self.durationSpinBox)
+        self.burstButton = QtWidgets.QPushButton(self.recordGroupBox)
+        self.burstButton.setObjectName("burstButton")
+        self.formLayout_3.setWidget(6, QtWidgets.QFormLayout.SpanningRole, self.burstButton)
+        self.burstStatusLabel = QtWidgets.QLabel(self.recordGroupBox)
+        self.burstStatusLabel.setText("")
+        self.burstStatusLabel.setObjectName("burstStatusLabel")
+        self.formLayout_3.setWidget(7, QtWidgets.QFormLayout.SpanningRole, self.burstStatusLabel)
+        self.videoButton = QtWidgets.QPushButton(self.recordGroupBox)
+        self.videoButton.setObjectName("videoButton")
+        self.formLayout_3.setWidget(8, QtWidgets.QFormLayout.SpanningRole, self.videoButton)
+        self.videoStatusLabel = QtWidgets.QLabel(self.recordGroupBox)
+        self.videoStatusLabel.setText("")
+        self.videoStatusLabel.setObjectName("videoStatusLabel")
+        self.formLayout_3.setWidget(9, QtWidgets.QFormLayout.SpanningRole, self.videoStatusLabel)
+        self.rawButton = QtWidgets.QPushButton(self.recordGroupBox)
+        self.rawButton.setObjectName("rawButton")
+        self.formLayout_3.setWidget(10, QtWidgets.QFormLayout.SpanningRole, self.rawButton)
+        self.rawStatusLabel = QtWidgets.QLabel(self.recordGroupBox)
+        self.rawStatusLabel.setText("")
+        self.rawStatusLabel.setObjectName("rawStatusLabel")
+        self.formLayout_3.setWidget(11, QtWidgets.QFormLayout.SpanningRole, self.rawStatusLabel)
+        self.verticalLayout_3.addWidget(self.recordGroupBox)
+        self.roiGroupBox = QtWidgets.QGroupBox(self.formWidget)
+        self.roiGroupBox.setObjectName("roiGroupBox")
+        self.verticalLayout_6 = QtWidgets.QVBoxLayout(self.roiGroupBox)
+        self.verticalLayout_6.setObjectName("verticalLayout_6")
+        self.roiStatsLabel = QtWidgets.QLabel(self.roiGroupBox)
+        self.roiStatsLabel.setObjectName("roiStatsLabel")
+        self.verticalLayout_6.addWidget(self.roiStatsLabel)
+        self.roiPlot = RoiPlot(self.roiGroupBox)
+        self.roiPlot.setObjectName("roiPlot")
+        self.verticalLayout_6.addWidget(self.roiPlot)
+        self.roiCsvButton = QtWidgets.QPushButton(self.roiGroupBox)
+        self.roiCsvButton.setObjectName("roiCsvButton")
+        self.verticalLayout_6.addWidget(self.roiCsvButton)
+        self.verticalLayout_3.addWidget(self.roiGroupBox)
+        self.zoomExportGroupBox = QtWidgets.QGroupBox(self.formWidget)
+        self.zoomExportGroupBox.setObjectName("zoomExportGroupBox")
+        self.formLayout_4 = QtWidgets.QFormLayout(self.zoomExportGroupBox)
+        self.formLayout_4.setObjectName("formLayout_4")
+        self.exportFramesLabel = QtWidgets.QLabel(self.zoomExportGroupBox)
+        self.exportFramesLabel.setObjectName("exportFramesLabel")
+        self.formLayout_4.setWidget(0, QtWidgets.QFormLayout.LabelRole, self.exportFramesLabel)
+        self.exportFramesSpinBox = QtWidgets.QSpinBox(self.zoomExportGroupBox)
+        self.exportFramesSpinBox.setMinimum(1)
+        self.exportFramesSpinBox.setMaximum(256)
+        self.exportFramesSpinBox.setProperty("value", 1)
+        self.exportFramesSpinBox.setObjectName("exportFramesSpinBox")
+        self.formLayout_4.setWidget(0, QtWidgets.QFormLayout.FieldRole, self.exportFramesSpinBox)
+        self.exportScaleLabel = QtWidgets.QLabel(self.zoomExportGroupBox)
+        self.exportScaleLabel.setObjectName("exportScaleLabel")
+        self.formLayout_4.setWidget(1, QtWidgets.QFormLayout.LabelRole, self.exportScaleLabel)
+        self.exportScaleSpinBox = QtWidgets.QDoubleSpinBox(self.zoomExportGroupBox)
+        self.exportScaleSpinBox.setMinimum(0.25)
+        self.exportScaleSpinBox.setMaximum(16.0)
+        self.exportScaleSpinBox.setSingleStep(0.5)
+        self.exportScaleSpinBox.setProperty("value", 1.0)
+        self.exportScaleSpinBox.setObjectName("exportScaleSpinBox")
+        self.formLayout_4.setWidget(1, QtWidgets.QFormLayout.FieldRole, self.exportScaleSpinBox)
+        self.zoomExportButton = QtWidgets.QPushButton(self.zoomExportGroupBox)
+        self.zoomExportButton.setObjectName("zoomExportButton")
+        self.formLayout_4.setWidget(2, QtWidgets.QFormLayout.SpanningRole, self.zoomExportButton)
+        self.verticalLayout_3.addWidget(self.zoomExportGroupBox)
         spacerItem1 = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
         self.verticalLayout_3.addItem(spacerItem1)
         self.horizontalLayout.addWidget(self.formWidget)
@@ -133,6 +313,18 @@ class Ui_Camera(object):
         self.verticalLayout_5 = QtWidgets.QVBoxLayout(self.horizontalWidget_2)
         self.verticalLayout_5.setContentsMargins(0, 0, 0, 0)
         self.verticalLayout_5.setObjectName("verticalLayout_5")
+        self.fpsLabel = QtWidgets.QLabel(self.horizontalWidget_2)
+        self.fpsLabel.setObjectName("fpsLabel")
+        self.verticalLayout_5.addWidget(self.fpsLabel)
+        self.modeComboBox = QtWidgets.QComboBox(self.horizontalWidget_2)
+        self.modeComboBox.setObjectName("modeComboBox")
+        self.verticalLayout_5.addWidget(self.modeComboBox)
+        self.previewResCheckBox = QtWidgets.QCheckBox(self.horizontalWidget_2)
+        self.previewResCheckBox.setObjectName("previewResCheckBox")
+        self.verticalLayout_5.addWidget(self.previewResCheckBox)
+        self.lowLatencyCheckBox = QtWidgets.QCheckBox(self.horizontalWidget_2)
+        self.lowLatencyCheckBox.setObjectName("lowLatencyCheckBox")
+        self.verticalLayout_5.addWidget(self.lowLatencyCheckBox)
         self.saveAsButton = QtWidgets.QPushButton(self.horizontalWidget_2)
         self.saveAsButton.setObjectName("saveAsButton")
         self.verticalLayout_5.addWidget(self.saveAsButton)
@@ -146,6 +338,9 @@ class Ui_Camera(object):
         self.brightnessSlider.valueChanged['int'].connect(self.brightnessLabel.setNum)
         self.contrastSlider.valueChanged['int'].connect(self.contrastLabel.setNum)
         self.gainSlider.valueChanged['int'].connect(self.gainLabel.setNum)
+        self.exposureSlider.valueChanged['int'].connect(self.exposureLabel.setNum)
+        self.whiteBalanceSlider.valueChanged['int'].connect(self.whiteBalanceLabel.setNum)
+        self.focusSlider.valueChanged['int'].connect(self.focusLabel.setNum)
         QtCore.QMetaObject.connectSlotsByName(Camera)
 
     def retranslateUi(self, Camera):
@@ -162,9 +357,60 @@ class Ui_Camera(object):
         self.contrastLabel.setText(_translate("Camera", "TextLabel"))
         self.label_4.setText(_translate("Camera", "Gain"))
         self.gainLabel.setText(_translate("Camera", "TextLabel"))
+        self.label_5.setText(_translate("Camera", "Exposure"))
+        self.autoExposureCheckBox.setToolTip(_translate("Camera", "Let the camera choose the exposure"))
+        self.autoExposureCheckBox.setText(_translate("Camera", "Auto"))
+        self.exposureLabel.setText(_translate("Camera", "TextLabel"))
+        self.label_6.setText(_translate("Camera", "White Balance"))
+        self.autoWhiteBalanceCheckBox.setToolTip(_translate("Camera", "Let the camera choose the white balance"))
+        self.autoWhiteBalanceCheckBox.setText(_translate("Camera", "Auto"))
+        self.whiteBalanceLabel.setText(_translate("Camera", "TextLabel"))
+        self.label_7.setText(_translate("Camera", "Focus"))
+        self.autoFocusCheckBox.setToolTip(_translate("Camera", "Let the camera focus automatically"))
+        self.autoFocusCheckBox.setText(_translate("Camera", "Auto"))
+        self.focusLabel.setText(_translate("Camera", "TextLabel"))
         self.rotatePushButton.setText(_translate("Camera", "Rotate 90°"))
         self.flipUDLabel.setText(_translate("Camera", "Flip UD"))
         self.flipLRLabel.setText(_translate("Camera", "Flip LR"))
+        self.recordGroupBox.setTitle(_translate("Camera", "Recording"))
+        self.formatLabel.setText(_translate("Camera", "Format"))
+        self.formatComboBox.setItemText(0, _translate("Camera", "PNG"))
+        self.formatComboBox.setItemText(1, _translate("Camera", "JPEG"))
+        self.formatComboBox.setItemText(2, _translate("Camera", "NPY"))
+        self.pngCompressionLabel.setText(_translate("Camera", "PNG level"))
+        self.jpegQualityLabel.setText(_translate("Camera", "JPEG quality"))
+        self.burstCountLabel.setText(_translate("Camera", "Frames"))
+        self.burstCountSpinBox.setSpecialValueText(_translate("Camera", "Unlimited"))
+        self.intervalLabel.setText(_translate("Camera", "Interval"))
+        self.intervalSpinBox.setSpecialValueText(_translate("Camera", "Full rate"))
+        self.intervalSpinBox.setSuffix(_translate("Camera", " s"))
+        self.durationLabel.setText(_translate("Camera", "Duration"))
+        self.durationSpinBox.setSpecialValueText(_translate("Camera", "Unlimited"))
+        self.durationSpinBox.setSuffix(_translate("Camera", " s"))
+        self.burstButton.setText(_translate("Camera", "Start Burst"))
+        self.videoButton.setText(_translate("Camera", "Record Video"))
+        self.rawButton.setToolTip(_translate("Camera", "Record unencoded frames to a memory-mapped journal, up to the number of frames set above"))
+        self.rawButton.setText(_translate("Camera", "Record Raw"))
+        self.roiGroupBox.setTitle(_translate("Camera", "ROI Statistics"))
+        self.roiStatsLabel.setText(_translate("Camera", "No ROI selected"))
+        self.roiCsvButton.setToolTip(_translate("Camera", "Write every frame\'s ROI statistics to a CSV file as they are measured"))
+        self.roiCsvButton.setText(_translate("Camera", "Export CSV..."))
+        self.zoomExportGroupBox.setTitle(_translate("Camera", "Zoom Export"))
+        self.exportFramesLabel.setText(_translate("Camera", "Average"))
+        self.exportFramesSpinBox.setToolTip(_translate("Camera", "Number of consecutive frames to average to reduce noise"))
+        self.exportFramesSpinBox.setSuffix(_translate("Camera", " frames"))
+        self.exportScaleLabel.setText(_translate("Camera", "Scale"))
+        self.exportScaleSpinBox.setToolTip(_translate("Camera", "Output size relative to the zoomed region\'s size in sensor pixels"))
+        self.exportScaleSpinBox.setSuffix(_translate("Camera", "x"))
+        self.zoomExportButton.setToolTip(_translate("Camera", "Save the zoomed region resampled from full resolution frames, with its exact bounds"))
+        self.zoomExportButton.setText(_translate("Camera", "Export Zoom..."))
+        self.fpsLabel.setText(_translate("Camera", "Capture - fps, render - fps"))
+        self.modeComboBox.setToolTip(_translate("Camera", "Resolution, pixel format and frame rate to capture at"))
+        self.previewResCheckBox.setToolTip(_translate("Camera", "Capture only as many pixels as the preview shows; saving grabs one full resolution frame"))
+        self.previewResCheckBox.setText(_translate("Camera", "Capture at preview resolution"))
+        self.lowLatencyCheckBox.setToolTip(_translate("Camera", "Always show the freshest frame, skipping frames the driver has queued"))
+        self.lowLatencyCheckBox.setText(_translate("Camera", "Low latency"))
         self.saveAsButton.setText(_translate("Camera", "Save As..."))
         self.saveButton.setText(_translate("Camera", "Save"))
+from camera.roi_stats import RoiPlot
 
@@ -1,41 +1,178 @@
+import collections
+import threading
+import time
+
 import cv2
 import numpy as np
-from PyQt5.QtCore import QThread, pyqtSlot
+from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot
+
+from .frame_buffer import FrameRing
+from .discovery import probe_modes
+from .negotiation import Policy, apply_mode, current_mode, measure_fps, mode_str, negotiate, preview_mode
+from .sources import CameraSource
+from .stats import PipelineStats
+
+# Properties behind the GUI controls; their values are cached so reading them never waits on the device
+CONTROL_PROPERTIES = (cv2.CAP_PROP_BRIGHTNESS, cv2.CAP_PROP_CONTRAST, cv2.CAP_PROP_GAIN, cv2.CAP_PROP_EXPOSURE,
+                      cv2.CAP_PROP_AUTO_EXPOSURE, cv2.CAP_PROP_WB_TEMPERATURE, cv2.CAP_PROP_AUTO_WB,
+                      cv2.CAP_PROP_FOCUS, cv2.CAP_PROP_AUTOFOCUS)
+# Cached as well since recorders stamp them on every frame, see :mod:`camera.journal`
+RECORDED_PROPERTIES = CONTROL_PROPERTIES + (cv2.CAP_PROP_SATURATION, cv2.CAP_PROP_FPS)
+
+# CAP_PROP_AUTO_EXPOSURE values for (manual, auto) by backend: V4L2 takes the driver's menu values, the others
+# the 0.25/0.75 convention inherited from DirectShow
+AUTO_EXPOSURE_VALUES = {'V4L2': (1, 3)}
+DEFAULT_AUTO_EXPOSURE_VALUES = (0.25, 0.75)
 
 
 class CameraThread(QThread):
     """
     See: https://docs.opencv.org/3.4.2/dd/d43/tutorial_py_video_display.html
     """
-    def __init__(self, camera_id=0, gui=False, parent=None):
+    # Emitted with the sequence number of every frame published to the ring
+    frameReady = pyqtSignal(int)
+    # Emitted from the capture thread with a description of the mode after :meth:`requestMode`
+    modeChanged = pyqtSignal(str)
+    # Emitted after entering or leaving preview resolution with the mode, seconds the switch took, and the
+    # capture rate before and after
+    previewModeChanged = pyqtSignal(str, float, float, float)
+    # Emitted with the sequence number of the full resolution frame asked for with requestStill, or -1
+    stillReady = pyqtSignal(int)
+    # Emitted from the capture thread with a property id and the value read back after setting it
+    propertyChanged = pyqtSignal(int, float)
+
+    def __init__(self, camera_id=0, gui=False, parent=None, ring_size=8, pool_size=None, source=None,
+                 stats_interval=0.0, policy=None, low_latency=False, modes=None, defer_negotiation=False):
         """
 
         :param camera_id:
         :param gui:
+        :param ring_size: number of recent frames kept for consumers
+        :param pool_size: number of preallocated buffers frames are decoded into, see :class:`BufferPool`
+        :param source: where to capture from instead of camera ``camera_id``, see :mod:`camera.sources`;
+            a CameraSource may wrap a handle that is already open, see :mod:`camera.discovery`
+        :param stats_interval: seconds between printing a :attr:`stats` summary, 0 to not print
+        :param policy: :class:`camera.negotiation.Policy` (or its string form) for choosing a physical
+            camera's mode; by default the largest resolution is requested and whatever comes back is used
+        :param low_latency: always publish the freshest frame, see :meth:`setLowLatency`
+        :param modes: modes the camera is known to offer, e.g. from :meth:`camera.discovery.DeviceDiscovery.modes`,
+            so negotiating does not have to list them again
+        :param defer_negotiation: negotiate on the capture thread once started, as if by :meth:`requestMode`,
+            rather than blocking here; frames arrive in the device's current mode until then
         """
         super(CameraThread, self).__init__(parent=parent)
 
-        self._cap = cv2.VideoCapture(camera_id)
+        if source is None:
+            source = CameraSource(camera_id)
+        self._cap = source
 
-        # Trick to get full _camera resolution with OpenCV: Set a very large resolution
-        self._cap.set(cv2.CAP_PROP_FPS, 0)
-        self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, 3840)
-        self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 2160)
+        self.negotiation = None
+        self._mode_request = None
+        self.fullMode = None
+        self._preview_request = None
+        self._still_requested = False
+        self._modes = None
+        self._known_modes = list(modes) if modes else None
+        self._low_latency = False
+        self._low_latency_request = low_latency or None
+        self._buffer_size = None
+        if isinstance(policy, str):
+            policy = Policy.parse(policy)
+        if isinstance(source, CameraSource) and policy is not None and defer_negotiation:
+            self._mode_request = policy
+        elif isinstance(source, CameraSource) and policy is not None:
+            self.negotiation = negotiate(self._cap, policy, modes=self._known_modes)
+            print('Camera mode %s, measured %.1f fps' % (mode_str(self.negotiation.mode),
+                                                         self.negotiation.measured_fps))
+        elif isinstance(source, CameraSource):
+            # Trick to get full _camera resolution with OpenCV: Set a very large resolution
+            self._cap.set(cv2.CAP_PROP_FPS, 0)
+            self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, 3840)
+            self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 2160)
 
         self._gui = gui
         self.stop_flag = False
+        # Kept up to date by the capture thread, so the GUI can show it without calling into the driver
+        self._mode = current_mode(self._cap)
 
-        self.frame = np.zeros((int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
-                               int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
-                               3), dtype=np.uint8)
+        shape = (max(int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), 0),
+                 max(int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 0),
+                 3)
+        self._placeholder = np.zeros(shape, dtype=np.uint8)
+        self.ring = FrameRing(shape, dtype=np.uint8, size=ring_size, pool_size=pool_size, seed=self._placeholder)
+
+        # Shared by every stage downstream of the capture as well
+        self.stats = PipelineStats()
+        self.captureRate = self.stats.rate('capture')
+        self.stats.gauge('pool in use', self.ring.pool.inUse)
+        self.stats.gauge('pool exhausted', lambda: self.ring.pool.exhausted)
+        self._stats_interval = stats_interval
+
+        # Property changes wait here for the capture thread; values read back are kept in _properties
+        self._property_lock = threading.Lock()
+        self._property_requests = collections.OrderedDict()
+        self._properties = {}
+        self._readProperties(RECORDED_PROPERTIES)
+        try:
+            backend = self._cap.getBackendName()
+        except (AttributeError, cv2.error):
+            backend = None
+        self.autoExposureValues = AUTO_EXPOSURE_VALUES.get(backend, DEFAULT_AUTO_EXPOSURE_VALUES)
+
+    @property
+    def frame(self):
+        """
+        Newest captured image, or a black placeholder until the first frame arrives
+        """
+        frame = self.ring.latest()
+        return self._placeholder if frame is None else frame.image
 
     def run(self):
+        read_time = self.stats.histogram('read')
+        reported = time.monotonic()
+        # Gaps of more than 1.5 frame periods are counted as frames the device or bus dropped
+        fps = self._cap.get(cv2.CAP_PROP_FPS)
+        period = 1.0 / fps if fps and fps > 0 else 0.0
+        self.stats.count('capture dropped', 0)
+        last = None
         while not self.stop_flag:
-            # Capture frame-by-frame
-            ret, frame = self._cap.read()
+            if (self._mode_request is not None or self._preview_request is not None or self._still_requested or
+                    self._low_latency_request is not None or self._property_requests):
+                if self._property_requests:
+                    self._applyPropertyRequests()
+                if self._low_latency_request is not None:
+                    self._applyLowLatency()
+                if self._mode_request is not None:
+                    self._applyModeRequest()
+                if self._preview_request is not None:
+                    self._applyPreviewRequest()
+                if self._still_requested:
+                    self._captureStill()
+                fps = self._cap.get(cv2.CAP_PROP_FPS)
+                period = 1.0 / fps if fps and fps > 0 else 0.0
+                last = None
+
+            # Capture frame-by-frame, decoding straight into the ring
+            start = time.monotonic()
+            if self._low_latency:
+                ret, frame = self._readFreshest(period)
+            else:
+                ret, frame = self._cap.read(self.ring.writeBuffer())
 
             if ret:
-                self.frame = frame
+                now = time.monotonic()
+                read_time.add(now - start)
+                if period and last is not None and now - last > 1.5 * period:
+                    self.stats.count('capture dropped', int(round((now - last) / period)) - 1)
+                last = now
+                timestamp = self._frameTimestamp(now)
+                seq = self.ring.commit(timestamp, frame)
+                self.captureRate.tick(now)
+                self.frameReady.emit(seq)
+
+                if self._stats_interval and now - reported >= self._stats_interval:
+                    reported = now
+                    print(self.stats.summary())
 
                 if self._gui:
                     pass
@@ -44,25 +181,288 @@ class CameraThread(QThread):
                     key = cv2.waitKey(1)
                     if key == ord('q'):
                         break
+            elif not self._cap.isOpened():
+                break
+            else:
+                self.stats.count('read failed')
 
         # When everything done, release the capture
         self._cap.release()
         print('CameraThread released')
+        if self.ring.pool.exhausted:
+            print('Frame buffer pool of %d was exhausted %d times' % (self.ring.pool.count, self.ring.pool.exhausted))
+
+    def requestMode(self, policy):
+        """
+        Switch mode between frames on the capture thread; :attr:`modeChanged` is emitted when done.
+        Frames of the new size replace the pooled buffers as they arrive.
+
+        :type policy: camera.negotiation.Policy
+        """
+        self._mode_request = policy
+
+    def _applyModeRequest(self):
+        policy, self._mode_request = self._mode_request, None
+        modes = (self.negotiation.modes if self.negotiation is not None and self.negotiation.modes
+                 else self._known_modes)
+        self.negotiation = negotiate(self._cap, policy, modes=modes)
+        print('Camera mode %s, measured %.1f fps' % (mode_str(self.negotiation.mode), self.negotiation.measured_fps))
+        self._mode = current_mode(self._cap)
+        self.fullMode = None
+        self._modes = None
+        # Some drivers reset their controls when the format changes
+        self._readProperties(list(self._properties))
+        self.modeChanged.emit(mode_str(self.negotiation.mode))
+
+    @property
+    def lowLatency(self):
+        """
+        Whether low latency mode is on, or will be once a pending :meth:`setLowLatency` is applied
+        """
+        return self._low_latency if self._low_latency_request is None else self._low_latency_request
+
+    def setLowLatency(self, enabled):
+        """
+        In low latency mode the backend's frame queue is shrunk where the backend allows
+        (``CAP_PROP_BUFFERSIZE``), and frames still queued behind a newer one are grabbed but never
+        decoded, so every published frame is the freshest available. Consumers that need every frame,
+        like recorders, will see the skipped ones as missed. Applied between frames.
+        """
+        self._low_latency_request = bool(enabled)
+
+    def _applyLowLatency(self):
+        enabled, self._low_latency_request = self._low_latency_request, None
+        if enabled == self._low_latency:
+            return
+        if enabled:
+            self._buffer_size = self._cap.get(cv2.CAP_PROP_BUFFERSIZE)
+            if not self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1):
+                print('Capture backend does not allow shrinking its buffer; draining stale frames instead')
+        elif self._buffer_size:
+            self._cap.set(cv2.CAP_PROP_BUFFERSIZE, self._buffer_size)
+        self._low_latency = enabled
 
-    def get(self, *args, **kwargs):
-        return self._cap.get(*args, **kwargs)
+    # Most queued frames drained before decoding one
+    MAX_STALE = 4
 
-    def set(self, *args, **kwargs):
-        return self._cap.set(*args, **kwargs)
+    def _readFreshest(self, period):
+        """
+        Grab until a grab has to wait for the sensor, then decode only that last frame. A grab that returns
+        in a fraction of the frame period came out of the backend's queue, so a newer frame may be behind it.
+        """
+        threshold = min(period / 4, 0.005) if period else 0.002
+        skipped = 0
+        start = time.monotonic()
+        if not self._cap.grab():
+            return False, None
+        while skipped < self.MAX_STALE and time.monotonic() - start < threshold:
+            start = time.monotonic()
+            if not self._cap.grab():
+                break
+            skipped += 1
+        if skipped:
+            self.stats.count('stale skipped', skipped)
+        return self._cap.retrieve(self.ring.writeBuffer())
+
+    def _frameTimestamp(self, now):
+        """
+        When the backend stamps buffers on the same monotonic clock (V4L2 does, through
+        ``CAP_PROP_POS_MSEC``), use the driver's stamp so latency includes the time frames spent queued,
+        and record that queueing time as 'buffer age'.
+        """
+        stamp = self._cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        if 0 <= now - stamp < 2.0:
+            self.stats.record('buffer age', now - stamp)
+            return stamp
+        return now
+
+    def requestPreviewMode(self, min_width, min_height):
+        """
+        Capture at the smallest mode that still covers ``min_width`` x ``min_height`` sensor pixels, so
+        pixels that would only be scaled away are never transferred or decoded. The full resolution mode
+        is remembered in :attr:`fullMode` for :meth:`requestStill` and :meth:`requestFullMode`.
+        """
+        self._preview_request = (min_width, min_height)
+
+    def requestFullMode(self):
+        """
+        Leave preview resolution, see :meth:`requestPreviewMode`
+        """
+        self._preview_request = False
+
+    def requestStill(self):
+        """
+        Publish one frame at full resolution, switching out of preview resolution and back if needed.
+        :attr:`stillReady` is emitted with its sequence number.
+        """
+        self._still_requested = True
+
+    def _applyPreviewRequest(self):
+        size, self._preview_request = self._preview_request, None
+        before = self.captureFps
+        start = time.monotonic()
+        if size is False:
+            if self.fullMode is None:
+                return
+            mode = apply_mode(self._cap, self.fullMode)
+            self.fullMode = None
+        else:
+            if self.fullMode is None:
+                self.fullMode = current_mode(self._cap)
+            if self._modes is None:
+                self._modes = (self.negotiation.modes if self.negotiation is not None and self.negotiation.modes
+                               else self._known_modes or probe_modes(self._cap, fourccs=(self.fullMode.fourcc,)))
+            mode = apply_mode(self._cap, preview_mode(self._modes, self.fullMode, *size))
+        self._mode = mode
+        switch = time.monotonic() - start
+        self.stats.record('mode switch', switch)
+        self._readProperties((cv2.CAP_PROP_FPS,))
+        after = measure_fps(self._cap)
+        print('Capture mode %s: switched in %.0f ms, %.1f -> %.1f fps' %
+              (mode_str(mode), switch * 1000, before, after))
+        self.previewModeChanged.emit(mode_str(mode), switch, before, after)
+
+    def _captureStill(self):
+        self._still_requested = False
+        if self.fullMode is None:
+            self.stillReady.emit(self.ring.seq)
+            return
+        start = time.monotonic()
+        preview = current_mode(self._cap)
+        apply_mode(self._cap, self.fullMode)
+        seq = -1
+        # Frames queued before the switch may still come out at the old size
+        for _ in range(5):
+            ret, frame = self._cap.read(self.ring.writeBuffer())
+            if ret and frame.shape[:2] == (self.fullMode.height, self.fullMode.width):
+                seq = self.ring.commit(time.monotonic(), frame)
+                self.frameReady.emit(seq)
+                break
+        apply_mode(self._cap, preview)
+        self.stats.record('still', time.monotonic() - start)
+        self.stillReady.emit(seq)
+
+    @property
+    def mode(self):
+        """
+        Mode the source reported when it last changed, see :func:`camera.negotiation.current_mode`. Read on
+        the capture thread before :attr:`modeChanged` or :attr:`previewModeChanged` is emitted.
+        """
+        return self._mode
+
+    def hold(self, seq=None):
+        """
+        Pin a frame so it stays valid until :meth:`release`, see :meth:`FrameRing.hold`.
+
+        :param seq: sequence number, defaults to the newest frame
+        """
+        return self.ring.hold(self.ring.seq if seq is None else seq)
+
+    def release(self, frame):
+        self.ring.release(frame)
+
+    @property
+    def captureFps(self):
+        return self.captureRate.rate
+
+    @property
+    def poolExhausted(self):
+        """
+        Number of times a frame could not be decoded into a pooled buffer because consumers held them all
+        """
+        return self.ring.pool.exhausted
+
+    def get(self, prop_id):
+        """
+        Properties in :data:`RECORDED_PROPERTIES`, and any set through :meth:`set`, come from a cache refreshed by
+        the capture thread, so reading them never waits on the device. A pending change reads as its new value.
+        Other properties are read from the source.
+        """
+        value = self._properties.get(prop_id)
+        return self._cap.get(prop_id) if value is None else value
+
+    def set(self, prop_id, value):
+        """
+        Queue a property change, see :meth:`requestProperty`
+
+        :return: True; whether the device accepted it is only known once :attr:`propertyChanged` is emitted
+        """
+        self.requestProperty(prop_id, value)
+        return True
+
+    def requestProperty(self, prop_id, value):
+        """
+        Queue a property change for the capture thread to apply between frames, so setting a property never
+        races a read. Changes to a property that arrive before the previous one was applied replace it, so
+        dragging a slider sends the device only the latest value.
+        """
+        with self._property_lock:
+            if prop_id in self._property_requests:
+                self.stats.count('property coalesced')
+            self._property_requests[prop_id] = value
+            self._properties[prop_id] = float(value)
+
+    def isPropertyPending(self, prop_id):
+        return prop_id in self._property_requests
+
+    def _readProperties(self, prop_ids):
+        for prop_id in prop_ids:
+            self._properties[prop_id] = float(self._cap.get(prop_id))
+
+    def _applyPropertyRequests(self):
+        with self._property_lock:
+            requests, self._property_requests = self._property_requests, collections.OrderedDict()
+        set_time = self.stats.histogram('property set')
+        for prop_id, value in requests.items():
+            start = time.monotonic()
+            if not self._cap.set(prop_id, value):
+                self.stats.count('property rejected')
+            value = float(self._cap.get(prop_id))
+            set_time.add(time.monotonic() - start)
+            with self._property_lock:
+                # A newer request made meanwhile is still what the property will be
+                if prop_id not in self._property_requests:
+                    self._properties[prop_id] = value
+            self.propertyChanged.emit(prop_id, value)
 
     @pyqtSlot(int)
     def setBrightness(self, value):
-        self._cap.set(cv2.CAP_PROP_BRIGHTNESS, value)
+        self.requestProperty(cv2.CAP_PROP_BRIGHTNESS, value)
 
     @pyqtSlot(int)
     def setContrast(self, value):
-        self._cap.set(cv2.CAP_PROP_CONTRAST, value)
+        self.requestProperty(cv2.CAP_PROP_CONTRAST, value)
 
     @pyqtSlot(int)
     def setGain(self, value):
-        self._cap.set(cv2.CAP_PROP_GAIN, value)
+        self.requestProperty(cv2.CAP_PROP_GAIN, value)
+
+    @pyqtSlot(int)
+    def setExposure(self, value):
+        self.requestProperty(cv2.CAP_PROP_EXPOSURE, value)
+
+    @pyqtSlot(bool)
+    def setAutoExposure(self, enabled):
+        manual, auto = self.autoExposureValues
+        self.requestProperty(cv2.CAP_PROP_AUTO_EXPOSURE, auto if enabled else manual)
+
+    def isAutoExposure(self):
+        manual, auto = self.autoExposureValues
+        value = self.get(cv2.CAP_PROP_AUTO_EXPOSURE)
+        return abs(value - auto) < abs(value - manual)
+
+    @pyqtSlot(int)
+    def setWhiteBalance(self, kelvin):
+        self.requestProperty(cv2.CAP_PROP_WB_TEMPERATURE, kelvin)
+
+    @pyqtSlot(bool)
+    def setAutoWhiteBalance(self, enabled):
+        self.requestProperty(cv2.CAP_PROP_AUTO_WB, int(enabled))
+
+    @pyqtSlot(int)
+    def setFocus(self, value):
+        self.requestProperty(cv2.CAP_PROP_FOCUS, value)
+
+    @pyqtSlot(bool)
+    def setAutofocus(self, enabled):
+        self.requestProperty(cv2.CAP_PROP_AUTOFOCUS, int(enabled))
@@ -0,0 +1,267 @@
+"""
+Finding the cameras attached to the machine
+
+Opening a device index that does not exist can take seconds on some backends, so every index is probed on
+its own thread with a deadline, and what was found is cached across launches together with the
+resolutions each device supports. Devices that opened are kept open and handed to CameraThread through
+:meth:`DeviceDiscovery.open` rather than being opened a second time.
+"""
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import logging
+from collections import namedtuple
+
+import cv2
+
+from .sources import CameraSource
+
+_logger = logging.getLogger(__name__)
+
+Mode = namedtuple('Mode', ['width', 'height', 'fourcc', 'fps'])
+
+# index, backend name, supported modes
+DeviceInfo = namedtuple('DeviceInfo', ['index', 'backend', 'modes'])
+
+# Resolutions and pixel formats tried when listing modes; the device reports back the nearest it supports
+PROBE_RESOLUTIONS = ((640, 480), (800, 600), (1280, 720), (1280, 1024), (1600, 1200), (1920, 1080),
+                     (2592, 1944), (3840, 2160))
+FOURCCS = ('MJPG', 'YUYV')
+
+CACHE_VERSION = 2
+
+
+def default_cache_file():
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'pyqt_webcam', 'devices.json')
+
+
+def device_fingerprint():
+    """
+    Cheap summary of the attached video devices that changes when one is plugged in or removed.
+
+    :return: list of (device node, device number, change time), or None where devices cannot be listed
+        without opening them
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    fingerprint = []
+    for node in sorted(glob.glob('/dev/video*')):
+        try:
+            st = os.stat(node)
+        except OSError:
+            continue
+        fingerprint.append([node, st.st_rdev, st.st_ctime])
+    return fingerprint
+
+
+def decode_fourcc(value):
+    value = int(value)
+    if value <= 0:
+        return None
+    return ''.join(chr((value >> (8 * i)) & 0xFF) for i in range(4)).strip('\0') or None
+
+
+def probe_modes(capture, resolutions=PROBE_RESOLUTIONS, fourccs=FOURCCS, fps=120):
+    """
+    List the distinct modes an open capture accepts without streaming from it, by requesting each
+    resolution x FOURCC combination and reading back what it settled on. Each is requested at a high frame
+    rate so the device reports the fastest it can do at that size. A falsy FOURCC, e.g. the None of a
+    device that does not report one, probes in whatever format the capture is already in. Leaves the
+    capture in the last mode tried.
+
+    :return: list of :data:`Mode`, largest first
+    """
+    modes = set()
+    for fourcc in fourccs:
+        for width, height in resolutions:
+            if fourcc:
+                capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+            capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            capture.set(cv2.CAP_PROP_FPS, fps)
+            mode = Mode(int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                        decode_fourcc(capture.get(cv2.CAP_PROP_FOURCC)), round(capture.get(cv2.CAP_PROP_FPS), 2))
+            if mode.width > 0 and mode.height > 0:
+                modes.add(mode)
+    return sorted(modes, key=lambda m: (m.width * m.height, m.fps), reverse=True)
+
+
+class _OpenProbe(threading.Thread):
+    """
+    Opens one device index. If the caller stops waiting first, the capture is released whenever the open
+    finally returns.
+    """
+    def __init__(self, index):
+        super(_OpenProbe, self).__init__(name='probe-%d' % index, daemon=True)
+        self.index = index
+        self.capture = None
+        self.backend = None
+        self._lock = threading.Lock()
+        self._abandoned = False
+
+    def run(self):
+        capture = cv2.VideoCapture(self.index)
+        if not capture.isOpened():
+            capture.release()
+            return
+        try:
+            backend = capture.getBackendName()
+        except (AttributeError, cv2.error):
+            backend = None
+        with self._lock:
+            if self._abandoned:
+                capture.release()
+                _logger.debug('Device %d opened after the probe timed out; released', self.index)
+                return
+            self.capture = capture
+            self.backend = backend
+
+    def abandon(self):
+        with self._lock:
+            self._abandoned = True
+
+
+class DeviceDiscovery(object):
+    """
+    Probes device indices concurrently and keeps the ones that opened until they are claimed with
+    :meth:`open` or released with :meth:`close`.
+
+    The cache is trusted while the device fingerprint and OpenCV version match. Only cached indices are
+    opened then, and their modes are not probed again. Where devices cannot be fingerprinted, every index
+    is still probed and only the modes are taken from the cache.
+    """
+    def __init__(self, max_index=10, timeout=3.0, cache_file=None, probe_modes=True):
+        """
+
+        :param max_index: probe indices 0 to ``max_index - 1``
+        :param timeout: seconds to wait for all the opens, together
+        :param cache_file: JSON cache location, see :func:`default_cache_file`; '' disables the cache
+        :param probe_modes: list the supported modes of devices not in the cache
+        """
+        self.max_index = max_index
+        self.timeout = timeout
+        self.cache_file = default_cache_file() if cache_file is None else cache_file
+        self.probe_modes = probe_modes
+        self._captures = {}
+        self.devices = []
+
+    def _loadCache(self):
+        if not self.cache_file:
+            return None
+        try:
+            with open(self.cache_file) as f:
+                cache = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if cache.get('version') != CACHE_VERSION or cache.get('opencv') != cv2.__version__:
+            return None
+        return cache
+
+    def _saveCache(self, fingerprint):
+        if not self.cache_file:
+            return
+        cache = {
+            'version': CACHE_VERSION,
+            'opencv': cv2.__version__,
+            'created': time.time(),
+            'fingerprint': fingerprint,
+            'devices': [{'index': d.index, 'backend': d.backend, 'modes': [list(m) for m in d.modes]}
+                        for d in self.devices],
+        }
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp = self.cache_file + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(cache, f, indent=2)
+            os.replace(tmp, self.cache_file)
+        except (IOError, OSError) as e:
+            _logger.warning('Could not write device cache %s: %s', self.cache_file, e)
+
+    def discover(self, refresh=False):
+        """
+        Find the attached devices, leaving each open for :meth:`open`.
+
+        :param refresh: ignore the cache and probe everything again
+        :return: list of :data:`DeviceInfo`, by index
+        """
+        start = time.monotonic()
+        self.close()
+        fingerprint = device_fingerprint()
+        cache = None if refresh else self._loadCache()
+        cached = {}
+        if cache is not None:
+            cached = {d['index']: d for d in cache.get('devices', [])}
+        trusted = cache is not None and fingerprint is not None and cache.get('fingerprint') == fingerprint
+        indices = sorted(cached) if trusted else range(self.max_index)
+
+        probes = [_OpenProbe(i) for i in indices]
+        for probe in probes:
+            probe.start()
+        deadline = time.monotonic() + self.timeout
+        for probe in probes:
+            probe.join(max(deadline - time.monotonic(), 0))
+            probe.abandon()
+            if probe.capture is None and probe.is_alive():
+                _logger.warning('Device %d did not open within %.1f s', probe.index, self.timeout)
+
+        opened = [probe for probe in probes if probe.capture is not None]
+        for probe in opened:
+            self._captures[probe.index] = probe.capture
+
+        # Listing modes reconfigures the device a few times, so do all devices at once and only when needed
+        modes = {}
+        threads = []
+        for probe in opened:
+            if probe.index in cached and cached[probe.index].get('modes'):
+                modes[probe.index] = [Mode(*m) for m in cached[probe.index]['modes']]
+            elif self.probe_modes:
+                def run(probe=probe):
+                    modes[probe.index] = probe_modes(probe.capture)
+                threads.append(threading.Thread(target=run, daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.devices = [DeviceInfo(probe.index, probe.backend, modes.get(probe.index, [])) for probe in opened]
+        self._saveCache(fingerprint)
+        _logger.info('Found %d camera(s) in %.2f s%s', len(self.devices), time.monotonic() - start,
+                     ' (cached)' if trusted else '')
+        return self.devices
+
+    def modes(self, index):
+        """
+        :return: the modes found for device ``index`` by :meth:`discover`, or taken from the cache if it
+            still describes the attached devices; None if they are not known
+        """
+        for device in self.devices:
+            if device.index == index:
+                return device.modes or None
+        cache = self._loadCache()
+        fingerprint = device_fingerprint()
+        if cache is None or fingerprint is None or cache.get('fingerprint') != fingerprint:
+            return None
+        for device in cache.get('devices', []):
+            if device['index'] == index and device.get('modes'):
+                return [Mode(*m) for m in device['modes']]
+        return None
+
+    def open(self, index):
+        """
+        :return: a CameraSource for ``index``, reusing the handle opened by :meth:`discover` if there is one
+        :rtype: CameraSource
+        """
+        capture = self._captures.pop(index, None)
+        return CameraSource(index, capture=capture)
+
+    def close(self):
+        """
+        Release every handle that was not claimed with :meth:`open`
+        """
+        for capture in self._captures.values():
+            capture.release()
+        self._captures.clear()
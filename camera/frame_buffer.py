@@ -0,0 +1,314 @@
+"""
+Preallocated frame storage shared between the capture thread and its consumers
+"""
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+Frame = namedtuple('Frame', ['seq', 'timestamp', 'image', 'buffer'])
+
+
+class BufferPool(object):
+    """
+    Fixed set of preallocated frame buffers with reference counts.
+
+    The capture thread takes a free buffer with :meth:`acquire`, decodes into it and hands its reference
+    over to the ring. Consumers that need a frame to outlive its slot in the ring take an extra reference;
+    a buffer only goes back into circulation once every reference has been released. When every buffer
+    is referenced the pool hands out a one-off array instead and counts an exhaustion event, which is the
+    number to watch when sizing the pool.
+    """
+    def __init__(self, shape, dtype=np.uint8, count=12, seed=None):
+        """
+
+        :param shape: shape of a single frame
+        :param dtype: pixel type
+        :param count: number of buffers in the pool
+        :param seed: optional existing array to use as the first buffer
+        """
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+        self._buffers = [np.zeros(self._shape, dtype=self._dtype) for _ in range(count - (seed is not None))]
+        if seed is not None:
+            self._buffers.insert(0, seed)
+        self._refs = [0] * count
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    @property
+    def count(self):
+        return len(self._buffers)
+
+    @property
+    def lock(self):
+        return self._lock
+
+    def inUse(self):
+        """
+        :return: number of buffers currently referenced
+        """
+        return sum(1 for r in self._refs if r > 0)
+
+    def acquire(self):
+        """
+        Take a free buffer. Must be called with :attr:`lock` held.
+
+        :return: (index, buffer); index is None if the pool was exhausted and a one-off array was allocated
+        """
+        for index, refs in enumerate(self._refs):
+            if refs == 0:
+                self._refs[index] = 1
+                return index, self._buffers[index]
+        self.exhausted += 1
+        return None, np.empty(self._shape, dtype=self._dtype)
+
+    def retain(self, index):
+        """
+        Must be called with :attr:`lock` held.
+        """
+        if index is not None:
+            self._refs[index] += 1
+
+    def release(self, index):
+        """
+        Must be called with :attr:`lock` held.
+        """
+        if index is not None:
+            self._refs[index] -= 1
+
+    def adopt(self, index, image):
+        """
+        Replace a buffer the backend could not decode into (e.g. after a resolution change).
+        """
+        self._shape = image.shape
+        self._dtype = image.dtype
+        if index is not None:
+            self._buffers[index] = image
+
+
+class FrameRing(object):
+    """
+    Bounded ring of frames, indexed by a monotonically increasing sequence number.
+
+    There is a single producer (the capture thread), which decodes directly into :meth:`writeBuffer`
+    and publishes the slot with :meth:`commit`. Slots are backed by buffers from a :class:`BufferPool`,
+    so capturing does not allocate. Readers never take a lock to look up a frame and are handed views
+    rather than copies. A slot is recycled once ``size - 1`` newer frames have been captured, so a reader
+    that keeps a frame around should either check :meth:`isValid` after using its pixels, or pin the
+    buffer with :meth:`hold` and give it back with :meth:`release`.
+    """
+    def __init__(self, shape, dtype=np.uint8, size=8, pool_size=None, seed=None):
+        """
+
+        :param shape: shape of a single frame, e.g. (height, width, 3)
+        :param dtype: pixel type
+        :param size: number of slots in the ring
+        :param pool_size: number of preallocated buffers; defaults to ``size + 4`` so a few frames can be
+            held by consumers without exhausting the pool
+        :param seed: optional existing array to use as the first pooled buffer
+        """
+        if size < 2:
+            raise ValueError('FrameRing needs at least 2 slots, got %d' % size)
+        if pool_size is None:
+            pool_size = size + 4
+        if pool_size < size + 1:
+            raise ValueError('Buffer pool must be larger than the ring, got %d for %d slots' % (pool_size, size))
+        self._size = size
+        self.pool = BufferPool(shape, dtype=dtype, count=pool_size, seed=seed)
+        self._images = [None] * size
+        self._buffers = [None] * size
+        self._seqs = [-1] * size
+        self._timestamps = [0.0] * size
+        self._head = -1
+        self._cond = threading.Condition()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def seq(self):
+        """
+        Sequence number of the newest published frame, or -1 if nothing has been captured yet
+        """
+        return self._head
+
+    def writeBuffer(self):
+        """
+        Return the buffer the next frame should be decoded into. The slot is invalidated until :meth:`commit`.
+        """
+        index = (self._head + 1) % self._size
+        self._seqs[index] = -1
+        with self.pool.lock:
+            self.pool.release(self._buffers[index])
+            self._buffers[index], self._images[index] = self.pool.acquire()
+        return self._images[index]
+
+    def commit(self, timestamp, image=None):
+        """
+        Publish the slot handed out by the last :meth:`writeBuffer` call.
+
+        :param timestamp: capture time of the frame
+        :param image: the array the frame was actually decoded into, if the backend could not reuse the
+            write buffer (e.g. because the resolution changed)
+        :return: sequence number assigned to the frame
+        """
+        seq = self._head + 1
+        index = seq % self._size
+        if image is not None and image is not self._images[index]:
+            self.pool.adopt(self._buffers[index], image)
+            self._images[index] = image
+        self._timestamps[index] = timestamp
+        self._seqs[index] = seq
+        self._head = seq
+        with self._cond:
+            self._cond.notify_all()
+        return seq
+
+    def get(self, seq):
+        """
+        :return: the frame with sequence number ``seq``, or None if it is not (or no longer) in the ring
+        """
+        if seq < 0:
+            return None
+        index = seq % self._size
+        if self._seqs[index] != seq:
+            return None
+        image = self._images[index]
+        buffer = self._buffers[index]
+        timestamp = self._timestamps[index]
+        # The producer invalidates a slot before touching it, so a second look catches a concurrent rewrite
+        if self._seqs[index] != seq:
+            return None
+        return Frame(seq, timestamp, image, buffer)
+
+    def hold(self, seq):
+        """
+        Like :meth:`get`, but pins the frame's buffer so it is not recycled until :meth:`release`.
+        """
+        with self.pool.lock:
+            frame = self.get(seq)
+            if frame is not None:
+                self.pool.retain(frame.buffer)
+        return frame
+
+    def release(self, frame):
+        """
+        Give back a frame obtained from :meth:`hold`.
+        """
+        with self.pool.lock:
+            self.pool.release(frame.buffer)
+
+    def latest(self):
+        """
+        :return: the newest frame, or None if nothing has been captured yet
+        """
+        return self.get(self._head)
+
+    def nearest(self, timestamp):
+        """
+        :return: the frame still in the ring captured closest to ``timestamp``, or None if the ring is empty
+        """
+        best = None
+        head = self._head
+        for seq in range(head, max(head - self._size, -1), -1):
+            frame = self.get(seq)
+            if frame is None:
+                continue
+            if best is None or abs(frame.timestamp - timestamp) < abs(best.timestamp - timestamp):
+                best = frame
+            elif frame.timestamp < timestamp:
+                # Older frames only get further away
+                break
+        return best
+
+    def isValid(self, frame):
+        """
+        :return: True if the slot backing ``frame`` has not been recycled since it was read; always true
+            for frames pinned with :meth:`hold`
+        """
+        return self._seqs[frame.seq % self._size] == frame.seq
+
+    def wait(self, seq, timeout=None):
+        """
+        Block until a frame newer than ``seq`` has been published.
+
+        :return: True if such a frame is available, False on timeout
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._head > seq, timeout)
+
+    def next(self, seq, timeout=None):
+        """
+        Oldest frame still in the ring that was captured after ``seq``.
+
+        :param seq: last sequence number seen by the caller, -1 to start from the oldest frame available
+        :param timeout: seconds to wait for a new frame; 0 does not block, None waits forever
+        :return: (frame, missed) where frame is None on timeout and missed is the number of frames
+            between ``seq`` and ``frame`` that were recycled before the caller got to them
+        """
+        if self._head <= seq and (timeout == 0 or not self.wait(seq, timeout)):
+            return None, 0
+        head = self._head
+        for s in range(max(seq + 1, head - self._size + 1), head + 1):
+            frame = self.get(s)
+            if frame is not None:
+                return frame, (s - seq - 1 if seq >= 0 else 0)
+        # The producer lapped us while scanning; fall back to the newest frame
+        frame = self.get(head)
+        return frame, (head - seq - 1 if frame is not None and seq >= 0 else 0)
+
+    def since(self, seq):
+        """
+        All frames still in the ring that were captured after ``seq``, oldest first. Does not block.
+
+        :return: (frames, missed)
+        """
+        head = self._head
+        frames = []
+        for s in range(max(seq + 1, head - self._size + 1), head + 1):
+            frame = self.get(s)
+            if frame is not None:
+                frames.append(frame)
+        if seq < 0:
+            missed = 0
+        elif frames:
+            missed = frames[0].seq - seq - 1
+        else:
+            missed = max(head - seq, 0)
+        return frames, missed
+
+
+def hold_synchronized(rings, attempts=3):
+    """
+    Pin one frame from each ring, choosing the frames captured closest together.
+
+    The reference time is the newest frame of the ring that is furthest behind, so every ring has a frame
+    at or just after it. Timestamps must come from the same clock, as they do for CameraThreads in one
+    process.
+
+    :param rings: FrameRings to take frames from
+    :param attempts: lookups per ring before giving up when frames are recycled while being pinned
+    :return: (frames, skew) with the pinned frames in ring order and the spread of their timestamps in
+        seconds, or (None, None) if a ring has no frames; release each frame with its ring
+    """
+    latest = [ring.latest() for ring in rings]
+    if any(frame is None for frame in latest):
+        return None, None
+    reference = min(frame.timestamp for frame in latest)
+    frames = []
+    for ring in rings:
+        frame = None
+        for _ in range(attempts):
+            nearest = ring.nearest(reference)
+            frame = None if nearest is None else ring.hold(nearest.seq)
+            if frame is not None:
+                break
+        if frame is None:
+            for held, owner in zip(frames, rings):
+                owner.release(held)
+            return None, None
+        frames.append(frame)
+    timestamps = [frame.timestamp for frame in frames]
+    return frames, max(timestamps) - min(timestamps)
@@ -0,0 +1,142 @@
+"""
+Encoding and writing frames to disk off the GUI thread
+"""
+import os
+import re
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QObject, pyqtSignal
+
+_logger = logging.getLogger(__name__)
+
+
+def increment_filename(filename):
+    """
+    Bump the last run of digits in a filename, keeping its width, or append _001 if there is none
+    """
+    match_list = tuple(re.finditer(r'(\d+)', filename))
+    if match_list:
+        # Get last match of digits
+        match = match_list[-1]
+        index = int(filename[slice(*match.span())])
+        index += 1
+        index = str(index)
+        index = index.zfill(match.span()[1] - match.span()[0])
+        return filename[:match.span()[0]] + index + filename[match.span()[1]:]
+    else:
+        file, ext = os.path.splitext(filename)
+        return file + '_001' + ext
+
+
+class ImageWriter(QObject):
+    """
+    Bounded pool of worker threads that encode and write images. ``cv2.imwrite`` releases the GIL, so
+    several saves encode in parallel without stalling the GUI. Files ending in ``.npy`` are written raw
+    with ``np.save``.
+
+    At most ``max_pending`` saves can be queued or in progress; :meth:`submit` refuses more (or waits for
+    room, if asked to) instead of letting them pile up, and :attr:`pendingChanged` reports the queue depth
+    so the UI can show it.
+    """
+    # Emitted with the filename once an image has been written
+    saved = pyqtSignal(str)
+    # Emitted with the filename and a message if writing failed
+    failed = pyqtSignal(str, str)
+    # Emitted with the number of saves queued or in progress whenever it changes
+    pendingChanged = pyqtSignal(int)
+
+    def __init__(self, workers=2, max_pending=4, parent=None):
+        super(ImageWriter, self).__init__(parent=parent)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ImageWriter')
+        self._max_pending = max_pending
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = set()
+        self.written = 0
+        self.bytesWritten = 0
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    @property
+    def maxPending(self):
+        return self._max_pending
+
+    def isPending(self, filename):
+        """
+        :return: True if ``filename`` is reserved by a save that has not finished yet
+        """
+        return os.path.abspath(filename) in self._pending
+
+    def submit(self, filename, image, params=(), prepare=None, done=None, block=False):
+        """
+        Queue an image to be written.
+
+        :param filename: destination; the extension selects the encoder
+        :param image: the pixels to write, or whatever ``prepare`` needs to produce them
+        :param params: encoder parameters for ``cv2.imwrite``
+        :param prepare: optional callable(image) -> image run on the worker thread before encoding,
+            e.g. to orient and crop a frame that is still in the ring buffer
+        :param done: optional callable run on the worker thread once the image is no longer needed,
+            whether writing succeeded or not
+        :param block: wait for room in the queue instead of refusing the save
+        :return: True if queued, False if the queue is full or ``filename`` is already being written
+        """
+        key = os.path.abspath(filename)
+        with self._lock:
+            if block:
+                self._idle.wait_for(lambda: len(self._pending) < self._max_pending)
+            if len(self._pending) >= self._max_pending or key in self._pending:
+                return False
+            self._pending.add(key)
+            pending = len(self._pending)
+        self.pendingChanged.emit(pending)
+        self._executor.submit(self._write, key, filename, image, params, prepare, done)
+        return True
+
+    def _write(self, key, filename, image, params, prepare, done):
+        try:
+            if prepare is not None:
+                image = prepare(image)
+            if filename.lower().endswith('.npy'):
+                np.save(filename, image)
+                ok = True
+            else:
+                ok = cv2.imwrite(filename, image, list(params))
+            if ok:
+                _logger.debug('Saved %s', filename)
+                with self._lock:
+                    self.written += 1
+                    self.bytesWritten += os.path.getsize(filename)
+                self.saved.emit(filename)
+            else:
+                self.failed.emit(filename, 'No encoder could write this file')
+        except Exception as e:
+            _logger.exception('Saving %s failed', filename)
+            self.failed.emit(filename, str(e))
+        finally:
+            if done is not None:
+                done()
+            with self._lock:
+                self._pending.discard(key)
+                pending = len(self._pending)
+                self._idle.notify_all()
+            self.pendingChanged.emit(pending)
+
+    def flush(self, timeout=None):
+        """
+        Wait for every queued save to finish
+
+        :return: True if the queue drained, False on timeout
+        """
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._pending, timeout)
+
+    def shutdown(self):
+        self.flush()
+        self._executor.shutdown()
@@ -0,0 +1,314 @@
+"""
+Lossless raw frame journal backed by a memory-mapped file
+
+Frames are copied unencoded into a preallocated file, each behind a fixed-size header, so recording costs
+one memcpy per frame and the OS page cache absorbs the writes. :class:`JournalReader` maps the file back
+and returns any frame as a numpy view without copying.
+
+Usage::
+
+    python -m camera.journal info capture.frames
+    python -m camera.journal convert capture.frames frame_0001.png
+    python -m camera.journal convert capture.frames clip.avi
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import logging
+from collections import namedtuple
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from .image_writer import increment_filename
+
+_logger = logging.getLogger(__name__)
+
+MAGIC = b'PQWJRNL1'
+PAGE = 4096
+# magic, frame count, capacity, slot size, wall clock start, JSON metadata length
+FILE_HEADER = struct.Struct('<8sQQQdQ')
+FILE_HEADER_SIZE = PAGE
+# seq, capture timestamp, height, width, channels, dtype, camera properties
+PROPERTIES = ('brightness', 'contrast', 'gain', 'exposure', 'fps', 'wb_temperature', 'focus', 'saturation')
+FRAME_HEADER = struct.Struct('<qdIII16s%dd' % len(PROPERTIES))
+FRAME_HEADER_SIZE = 128
+
+CAP_PROPERTIES = {
+    'brightness': cv2.CAP_PROP_BRIGHTNESS,
+    'contrast': cv2.CAP_PROP_CONTRAST,
+    'gain': cv2.CAP_PROP_GAIN,
+    'exposure': cv2.CAP_PROP_EXPOSURE,
+    'fps': cv2.CAP_PROP_FPS,
+    'wb_temperature': cv2.CAP_PROP_WB_TEMPERATURE,
+    'focus': cv2.CAP_PROP_FOCUS,
+    'saturation': cv2.CAP_PROP_SATURATION,
+}
+
+JournalFrame = namedtuple('JournalFrame', ['seq', 'timestamp', 'image', 'properties'])
+
+
+def camera_properties(camera):
+    """
+    :param camera: anything with a ``get(prop_id)`` method, e.g. a CameraThread
+    :return: dict of the properties stored with each frame
+    """
+    return {name: float(camera.get(prop)) for name, prop in CAP_PROPERTIES.items()}
+
+
+class FrameJournal(object):
+    """
+    Writer side of the journal. The file is sized for ``capacity`` frames up front; :meth:`append` refuses
+    frames once it is full.
+    """
+    def __init__(self, filename, capacity, shape, dtype=np.uint8, metadata=None):
+        """
+
+        :param filename: file to create; an existing file is overwritten
+        :param capacity: number of frames to make room for
+        :param shape: largest frame shape that will be appended
+        :param dtype: pixel type
+        :param metadata: optional JSON-serialisable dict stored in the file header
+        """
+        self.filename = filename
+        self.capacity = capacity
+        frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        # Keep every slot page aligned so frames map cleanly
+        self.slot_size = -(-(FRAME_HEADER_SIZE + frame_bytes) // PAGE) * PAGE
+        meta = json.dumps(metadata or {}).encode('utf-8')
+        if FILE_HEADER.size + len(meta) > FILE_HEADER_SIZE:
+            raise ValueError('Journal metadata too large (%d bytes)' % len(meta))
+        self._meta = meta
+        self.count = 0
+        self._start = time.time()
+
+        size = FILE_HEADER_SIZE + capacity * self.slot_size
+        self._file = open(filename, 'w+b')
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(self._file.fileno(), 0, size)
+        else:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._writeHeader()
+
+    def _writeHeader(self):
+        FILE_HEADER.pack_into(self._map, 0, MAGIC, self.count, self.capacity, self.slot_size, self._start,
+                              len(self._meta))
+        self._map[FILE_HEADER.size:FILE_HEADER.size + len(self._meta)] = self._meta
+
+    def isFull(self):
+        return self.count >= self.capacity
+
+    def append(self, seq, timestamp, image, properties=None):
+        """
+        Copy a frame into the next slot.
+
+        :param properties: dict of camera properties, see :data:`PROPERTIES`
+        :return: index of the frame in the journal, or None if the journal is full
+        """
+        if self.isFull():
+            return None
+        if FRAME_HEADER_SIZE + image.nbytes > self.slot_size:
+            raise ValueError('Frame of %d bytes does not fit a %d byte slot' % (image.nbytes, self.slot_size))
+        index = self.count
+        offset = FILE_HEADER_SIZE + index * self.slot_size
+        properties = properties or {}
+        shape = image.shape + (1,) * (3 - image.ndim)
+        FRAME_HEADER.pack_into(self._map, offset, seq, timestamp, shape[0], shape[1], shape[2],
+                               image.dtype.str.encode('ascii'),
+                               *(properties.get(name, float('nan')) for name in PROPERTIES))
+        view = np.ndarray(image.shape, dtype=image.dtype, buffer=self._map, offset=offset + FRAME_HEADER_SIZE)
+        np.copyto(view, image)
+        del view
+        self.count += 1
+        FILE_HEADER.pack_into(self._map, 0, MAGIC, self.count, self.capacity, self.slot_size, self._start,
+                              len(self._meta))
+        return index
+
+    def close(self):
+        """
+        Flush and trim the file to the frames actually written
+        """
+        if self._map is None:
+            return
+        self._map.flush()
+        self._map.close()
+        self._map = None
+        self._file.truncate(FILE_HEADER_SIZE + self.count * self.slot_size)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class JournalReader(object):
+    """
+    Random access to the frames in a journal. Frames are views into the mapped file, so reading one does
+    not copy its pixels; drop them before calling :meth:`close`.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, self.capacity, self.slot_size, self.start_time, meta_len = \
+            FILE_HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a frame journal' % filename)
+        self.metadata = json.loads(self._map[FILE_HEADER.size:FILE_HEADER.size + meta_len].decode('utf-8'))
+        # A recording that was cut short may claim more frames than made it to disk
+        self._count = min(self._count, (len(self._map) - FILE_HEADER_SIZE) // self.slot_size)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        """
+        :rtype: JournalFrame
+        """
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('Frame %d out of range for a journal of %d frames' % (index, self._count))
+        offset = FILE_HEADER_SIZE + index * self.slot_size
+        values = FRAME_HEADER.unpack_from(self._map, offset)
+        seq, timestamp, height, width, channels, dtype = values[:6]
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        image = np.ndarray(shape, dtype=np.dtype(dtype.rstrip(b'\0').decode('ascii')), buffer=self._map,
+                           offset=offset + FRAME_HEADER_SIZE)
+        return JournalFrame(seq, timestamp, image, dict(zip(PROPERTIES, values[6:])))
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    def fps(self):
+        """
+        :return: average capture rate over the whole journal, 0 for fewer than two frames
+        """
+        if self._count < 2:
+            return 0.0
+        span = self[-1].timestamp - self[0].timestamp
+        return (self._count - 1) / span if span > 0 else 0.0
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class JournalRecorder(QThread):
+    """
+    Appends frames from the ring to a :class:`FrameJournal` on its own thread until the journal is full
+    or :meth:`stop` is called. Frames the recorder could not copy before they were recycled are counted
+    in :attr:`missed`.
+    """
+    # Emitted with the number of frames recorded and missed so far
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, camera, filename, capacity, parent=None):
+        """
+
+        :type camera: camera.camera_thread.CameraThread
+        :param filename: journal file to create
+        :param capacity: maximum number of frames to record
+        """
+        super(JournalRecorder, self).__init__(parent=parent)
+        self._camera = camera
+        self._ring = camera.ring
+        shape = camera.frame.shape
+        self.journal = FrameJournal(filename, capacity, shape, camera.frame.dtype,
+                                    metadata={'shape': list(shape), 'properties': camera_properties(camera)})
+        self._stop = False
+        self.missed = 0
+
+    def stop(self):
+        self._stop = True
+
+    def run(self):
+        seq = self._ring.seq
+        try:
+            while not self._stop and not self.journal.isFull():
+                frame, missed = self._ring.next(seq, timeout=0.1)
+                if frame is None:
+                    continue
+                seq = frame.seq
+                frame = self._ring.hold(seq)
+                if frame is None:
+                    self.missed += missed + 1
+                    continue
+                try:
+                    # Read per frame so changes made while recording are journaled; CameraThread serves
+                    # these from its cache
+                    self.journal.append(frame.seq, frame.timestamp, frame.image, camera_properties(self._camera))
+                finally:
+                    self._ring.release(frame)
+                self.missed += missed
+                self.progress.emit(self.journal.count, self.missed)
+        finally:
+            self.journal.close()
+        _logger.info('Journaled %d frames to %s, %d missed', self.journal.count, self.journal.filename, self.missed)
+
+
+def convert(reader, output):
+    """
+    Convert a journal to numbered images or, for video extensions, a clip at the recorded frame rate
+
+    :type reader: JournalReader
+    :param output: first image filename (numbered like :func:`increment_filename`) or a video file
+    :return: number of frames converted; nothing is written for an empty journal
+    """
+    if not len(reader):
+        _logger.warning('%s has no frames to convert', reader.filename)
+        return 0
+    if os.path.splitext(output)[1].lower() in ('.avi', '.mp4', '.mkv'):
+        from .video_recorder import VideoRecorder
+        fourcc = VideoRecorder.FOURCC[os.path.splitext(output)[1].lower()]
+        first = reader[0].image
+        writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*fourcc), reader.fps() or 30.0,
+                                 (first.shape[1], first.shape[0]))
+        if not writer.isOpened():
+            raise IOError('Could not open %s for writing' % output)
+        for frame in reader:
+            writer.write(frame.image)
+        writer.release()
+    else:
+        for frame in reader:
+            if not cv2.imwrite(output, frame.image):
+                raise IOError('Could not write %s' % output)
+            output = increment_filename(output)
+    return len(reader)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or convert a raw frame journal')
+    subparsers = parser.add_subparsers(dest='command')
+    info = subparsers.add_parser('info', help='Print the journal header and frame timing')
+    info.add_argument('journal')
+    conv = subparsers.add_parser('convert', help='Convert to numbered images or a video file')
+    conv.add_argument('journal')
+    conv.add_argument('output', help='First image file (e.g. frame_0001.png) or a .avi/.mp4/.mkv file')
+    args = parser.parse_args()
+
+    if args.command is None:
+        parser.print_help()
+        sys.exit(1)
+
+    with JournalReader(args.journal) as reader:
+        if args.command == 'info':
+            print('%d frames, %.2f fps, started %s' % (len(reader), reader.fps(), time.ctime(reader.start_time)))
+            print(json.dumps(reader.metadata, indent=2))
+        else:
+            print('%d frames converted' % convert(reader, args.output))
@@ -0,0 +1,180 @@
+import math
+import os
+import logging
+
+from PyQt5.QtCore import Qt, pyqtSlot
+from PyQt5.QtGui import QKeySequence
+from PyQt5.QtWidgets import (QWidget, QLabel, QSizePolicy, QGridLayout, QVBoxLayout, QHBoxLayout, QPushButton,
+                             QFileDialog, QMessageBox, QShortcut)
+
+from . import opencv2qimage_scaled
+from .frame_buffer import hold_synchronized
+from .image_writer import ImageWriter, increment_filename
+from .render_worker import LivePreview
+from .stats_overlay import StatsOverlay
+
+_logger = logging.getLogger(__name__)
+
+
+class CameraTile(QWidget):
+    """
+    One camera in a :class:`MultiPreview`: the live image scaled to the tile on its own render worker,
+    with the camera's capture/render rates and drop counters underneath.
+    """
+    def __init__(self, camera, name, parent=None):
+        """
+
+        :type camera: camera.camera_thread.CameraThread
+        :param name: label shown with the statistics, e.g. the device index
+        """
+        super(CameraTile, self).__init__(parent)
+        self.name = name
+
+        self._label = QLabel(self)
+        self._label.setAlignment(Qt.AlignCenter)
+        self._label.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        self._label.setText('Camera %s initializing or not available' % name)
+        self._caption = QLabel(self)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self._label, 1)
+        layout.addWidget(self._caption)
+        self.setLayout(layout)
+
+        self.camera = camera
+        self._stats = camera.stats
+        self._preview = LivePreview(camera, self._label, opencv2qimage_scaled, parent=self)
+        self._preview.ratesChanged.connect(self.updateCaption)
+
+        self.statsOverlay = StatsOverlay(self._stats, self._label)
+
+    @pyqtSlot(float, float)
+    def updateCaption(self, capture_fps, render_fps):
+        counters = self._stats.counters
+        self._caption.setText('Camera %s: capture %.1f fps, render %.1f fps, dropped %d, not shown %d' %
+                              (self.name, capture_fps, render_fps,
+                               counters.get('capture dropped', 0), counters.get('not displayed', 0)))
+
+    def stop(self):
+        self._preview.stop()
+
+
+class MultiPreview(QWidget):
+    """
+    Tiled live view of several cameras, each captured by its own CameraThread and buffer pool.
+
+    "Save all" writes one image per camera, taking the frames captured closest together
+    (see :func:`camera.frame_buffer.hold_synchronized`). F3 toggles per-camera statistics.
+    """
+    def __init__(self, cameras, names=None):
+        """
+
+        :param cameras: CameraThreads to show; they are started here
+        :param names: label for each camera, defaults to its position
+        """
+        super(MultiPreview, self).__init__()
+        self.setWindowTitle('CameraThread Feeds')
+        self.setGeometry(100, 100, 1280, 800)
+
+        self._cameras = list(cameras)
+        if names is None:
+            names = [str(i) for i in range(len(self._cameras))]
+        self._names = list(names)
+
+        columns = int(math.ceil(math.sqrt(len(self._cameras))))
+        grid = QGridLayout()
+        self._tiles = []
+        for i, (camera, name) in enumerate(zip(self._cameras, self._names)):
+            tile = CameraTile(camera, name, parent=self)
+            grid.addWidget(tile, i // columns, i % columns)
+            self._tiles.append(tile)
+
+        self._saveAsButton = QPushButton('Save All As...', self)
+        self._saveButton = QPushButton(self)
+        self._status = QLabel(self)
+        buttons = QHBoxLayout()
+        buttons.addWidget(self._saveAsButton)
+        buttons.addWidget(self._saveButton)
+        buttons.addWidget(self._status, 1)
+
+        layout = QVBoxLayout()
+        layout.addLayout(grid, 1)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+
+        self._writer = ImageWriter(max_pending=4 * len(self._cameras), parent=self)
+        self._writer.failed.connect(self.saveFailed)
+        self._saveAsButton.clicked.connect(self.saveAllAs)
+        self._saveButton.clicked.connect(self.saveAll)
+        QShortcut(QKeySequence('F3'), self, self.toggleStats)
+
+        self.filename = os.path.join(os.path.expanduser('~'), 'image_001.png')
+        self._updateSaveButton()
+
+        self.show()
+        for camera in self._cameras:
+            camera.start()
+
+    def filenames(self, filename=None):
+        """
+        :return: one file name per camera for the set saved under ``filename``
+        """
+        root, ext = os.path.splitext(filename or self.filename)
+        return ['%s_cam%s%s' % (root, name, ext) for name in self._names]
+
+    def _updateSaveButton(self):
+        self._saveButton.setText('Save All (%s)' % os.path.basename(self.filename))
+
+    @pyqtSlot()
+    def toggleStats(self):
+        for tile in self._tiles:
+            tile.statsOverlay.toggle()
+
+    @pyqtSlot(bool)
+    def saveAllAs(self, checked=False):
+        filename, _ = QFileDialog.getSaveFileName(
+            parent=self, caption='Save All As', directory=self.filename,
+            filter="Images (*.bmp *.jpg *.jpeg *.png);;NumPy arrays (*.npy);;All files (*.*)"
+        )
+        if filename:
+            self.filename = filename
+            self.saveAll()
+
+    @pyqtSlot(bool)
+    def saveAll(self, checked=False):
+        rings = [camera.ring for camera in self._cameras]
+        frames, skew = hold_synchronized(rings)
+        if frames is None:
+            QMessageBox.warning(self, 'Save All', 'Not every camera has captured a frame yet')
+            return
+        filenames = self.filenames()
+        if self._writer.pending + len(frames) > self._writer.maxPending:
+            for ring, frame in zip(rings, frames):
+                ring.release(frame)
+            QMessageBox.warning(self, 'Save Busy', 'Still writing earlier images, please try again')
+            return
+        for ring, frame, filename in zip(rings, frames, filenames):
+            if not self._writer.submit(filename, frame.image, done=lambda ring=ring, frame=frame: ring.release(frame)):
+                ring.release(frame)
+        self._status.setText('Saved %d images, %.1f ms apart' % (len(frames), skew * 1000))
+        _logger.info('Saved %s with timestamps %.1f ms apart', ', '.join(filenames), skew * 1000)
+
+        self.filename = increment_filename(self.filename)
+        while any(os.path.exists(f) or self._writer.isPending(f) for f in self.filenames()):
+            self.filename = increment_filename(self.filename)
+        self._updateSaveButton()
+
+    @pyqtSlot(str, str)
+    def saveFailed(self, filename, message):
+        QMessageBox.critical(self, 'Save Failed', 'Could not save %s: %s' % (filename, message))
+
+    def closeEvent(self, a0):
+        for tile in self._tiles:
+            tile.stop()
+        self._writer.shutdown()
+        for camera in self._cameras:
+            camera.stop_flag = True
+        _logger.info('Waiting for cameras to finish...')
+        for camera in self._cameras:
+            camera.wait()
@@ -0,0 +1,196 @@
+"""
+Choosing the camera's resolution, pixel format and frame rate
+
+Asking for a huge resolution and taking whatever comes back often lands a UVC camera in uncompressed YUYV
+at a few frames per second when MJPG would deliver 30. Instead, the modes a camera accepts (listed by
+:func:`camera.discovery.probe_modes`, and cached there per device) are ranked by a :class:`Policy`, and the
+best candidates are tried until one actually delivers the frame rate it reports.
+"""
+import time
+import logging
+from collections import namedtuple
+
+import cv2
+
+from .discovery import Mode, decode_fourcc, probe_modes
+
+_logger = logging.getLogger(__name__)
+
+# Outcome of :func:`negotiate`: the mode the camera is left in, the frame rate measured in it, every mode
+# the camera offered and the (mode, measured fps) trials made to get there
+Negotiation = namedtuple('Negotiation', ['mode', 'measured_fps', 'modes', 'trials'])
+
+RESOLUTION_NAMES = {'480p': (640, 480), '720p': (1280, 720), '1080p': (1920, 1080), '1440p': (2560, 1440),
+                    '4k': (3840, 2160), '2160p': (3840, 2160)}
+
+
+def mode_str(mode):
+    return '%dx%d %s @ %g fps' % (mode.width, mode.height, mode.fourcc or '?', mode.fps)
+
+
+def current_mode(capture):
+    """
+    :return: the :data:`Mode` the capture reports it is in
+    """
+    return Mode(int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                decode_fourcc(capture.get(cv2.CAP_PROP_FOURCC)), round(capture.get(cv2.CAP_PROP_FPS), 2))
+
+
+def apply_mode(capture, mode):
+    """
+    Request ``mode``. The FOURCC is set first, since it decides which sizes and rates are available; a
+    None FOURCC or zero fps leaves that setting alone.
+
+    :return: the mode the capture settled on
+    """
+    if mode.fourcc:
+        capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*mode.fourcc))
+    capture.set(cv2.CAP_PROP_FRAME_WIDTH, mode.width)
+    capture.set(cv2.CAP_PROP_FRAME_HEIGHT, mode.height)
+    if mode.fps:
+        capture.set(cv2.CAP_PROP_FPS, mode.fps)
+    return current_mode(capture)
+
+
+def measure_fps(capture, frames=8, warmup=2, timeout=3.0):
+    """
+    :return: frames per second actually delivered, over at most ``timeout`` seconds
+    """
+    for _ in range(warmup):
+        if not capture.grab():
+            return 0.0
+    start = time.monotonic()
+    count = 0
+    while count < frames and time.monotonic() - start < timeout:
+        if not capture.grab():
+            break
+        count += 1
+    elapsed = time.monotonic() - start
+    return count / elapsed if count and elapsed > 0 else 0.0
+
+
+class Policy(object):
+    """
+    How to rank modes: ``prefer`` is 'fps' (highest frame rate at or above a minimum resolution),
+    'resolution' (largest frame at or above a minimum frame rate) or 'mode' (exactly the given mode).
+
+    Parsed from strings with :meth:`parse`:
+
+    - ``max-fps[:RES]``, e.g. ``max-fps:1080p`` or ``max-fps:1280x720``
+    - ``max-res[:FPS]``, e.g. ``max-res:15``
+    - ``WxH[@FPS][:FOURCC]``, e.g. ``1920x1080@30:MJPG``
+    """
+    def __init__(self, prefer='resolution', min_width=0, min_height=0, min_fps=0.0, mode=None):
+        if prefer not in ('fps', 'resolution', 'mode'):
+            raise ValueError('Unknown preference %r' % prefer)
+        self.prefer = prefer
+        self.min_width = min_width
+        self.min_height = min_height
+        self.min_fps = min_fps
+        self.mode = mode
+
+    @classmethod
+    def parse(cls, spec):
+        kind, _, arg = spec.strip().lower().partition(':')
+        if kind == 'max-fps':
+            width, height = RESOLUTION_NAMES.get(arg) or (tuple(int(v) for v in arg.split('x')) if arg else (0, 0))
+            return cls('fps', min_width=width, min_height=height)
+        if kind == 'max-res':
+            return cls('resolution', min_fps=float(arg.rstrip('fps')) if arg else 0.0)
+        size, _, fps = kind.partition('@')
+        try:
+            width, height = (int(v) for v in size.split('x'))
+        except ValueError:
+            raise ValueError('Unknown mode policy %r, expected max-fps[:RES], max-res[:FPS] or '
+                             'WxH[@FPS][:FOURCC]' % spec)
+        return cls('mode', mode=Mode(width, height, arg.upper() or None, float(fps) if fps else 0.0))
+
+    def __str__(self):
+        if self.prefer == 'mode':
+            return 'exactly %s' % mode_str(self.mode)
+        if self.prefer == 'fps':
+            return 'max fps at >= %dx%d' % (self.min_width, self.min_height)
+        return 'max resolution at >= %g fps' % self.min_fps
+
+    def accepts(self, mode, fps=None):
+        """
+        :param fps: measured frame rate, defaults to what the mode reports
+        """
+        fps = mode.fps if fps is None else fps
+        # Sizes are compared by area as well so a rotated or differently shaped sensor still qualifies
+        big_enough = ((mode.width >= self.min_width and mode.height >= self.min_height) or
+                      mode.width * mode.height >= self.min_width * self.min_height > 0)
+        return big_enough and (fps <= 0 or fps >= self.min_fps * 0.9)
+
+    def rank(self, mode, fps=None):
+        """
+        :return: sort key, larger is better
+        """
+        fps = mode.fps if fps is None else fps
+        compressed = mode.fourcc == 'MJPG'
+        if self.prefer == 'fps':
+            return fps, mode.width * mode.height, compressed
+        return mode.width * mode.height, fps, compressed
+
+
+def negotiate(capture, policy, modes=None, max_trials=4):
+    """
+    Put the capture in the best mode for ``policy``, checking the frame rate it actually delivers.
+
+    Candidates are tried best first; the first whose measured rate satisfies the policy (and is at least
+    80% of what it reports) is kept. If none does, the best trial by measured rate is restored.
+
+    :type policy: Policy
+    :param modes: modes to choose from, e.g. cached by :class:`camera.discovery.DeviceDiscovery`; probed
+        with :func:`camera.discovery.probe_modes` if not given
+    :param max_trials: most candidates to stream from
+    :rtype: Negotiation
+    """
+    if policy.prefer == 'mode':
+        mode = apply_mode(capture, policy.mode)
+        fps = measure_fps(capture)
+        _logger.info('Requested %s, got %s delivering %.1f fps', mode_str(policy.mode), mode_str(mode), fps)
+        return Negotiation(mode, fps, modes or [], [(mode, fps)])
+
+    if modes is None:
+        modes = probe_modes(capture)
+    candidates = sorted((m for m in modes if policy.accepts(m)), key=policy.rank, reverse=True)
+    if not candidates:
+        _logger.warning('No mode satisfies %s; considering all %d', policy, len(modes))
+        candidates = sorted(modes, key=policy.rank, reverse=True)
+
+    trials = []
+    for candidate in candidates[:max_trials]:
+        mode = apply_mode(capture, candidate)
+        fps = measure_fps(capture)
+        trials.append((mode, fps))
+        _logger.debug('Tried %s: %.1f fps measured', mode_str(mode), fps)
+        if policy.accepts(mode, fps) and (mode.fps <= 0 or fps >= 0.8 * mode.fps):
+            break
+    else:
+        if not trials:
+            return Negotiation(current_mode(capture), 0.0, modes, trials)
+        mode, fps = max(trials, key=lambda t: (policy.accepts(*t), policy.rank(*t)))
+        if mode != trials[-1][0]:
+            mode = apply_mode(capture, mode)
+
+    _logger.info('Negotiated %s (%s), measured %.1f fps', mode_str(mode), policy, fps)
+    return Negotiation(mode, fps, modes, trials)
+
+
+def preview_mode(modes, full, min_width, min_height):
+    """
+    Smallest mode with the same aspect ratio as ``full`` that still covers ``min_width`` x ``min_height``,
+    for when only a preview of that size is needed. Same-size modes are ranked by frame rate.
+
+    :param modes: modes the camera offers
+    :param full: the full resolution mode being stood in for
+    :return: the chosen mode, or ``full`` if nothing smaller will do
+    """
+    aspect = full.width * 1.0 / max(full.height, 1)
+    candidates = [m for m in modes
+                  if min_width <= m.width <= full.width and min_height <= m.height <= full.height and
+                  abs(m.width * 1.0 / max(m.height, 1) - aspect) < 0.05 * aspect]
+    if not candidates:
+        return full
+    return min(candidates, key=lambda m: (m.width * m.height, -m.fps, m.fourcc != full.fourcc))
@@ -1,10 +1,12 @@
 import time
 
-from PyQt5.QtCore import Qt, QTimer, pyqtSlot
-from PyQt5.QtGui import QPixmap
-from PyQt5.QtWidgets import QWidget, QLabel, QSizePolicy, QHBoxLayout
+from PyQt5.QtCore import Qt, pyqtSlot
+from PyQt5.QtGui import QKeySequence
+from PyQt5.QtWidgets import QWidget, QLabel, QSizePolicy, QHBoxLayout, QShortcut
 
-from . import opencv2qimage
+from . import opencv2qimage_scaled
+from .render_worker import LivePreview
+from .stats_overlay import StatsOverlay
 
 
 class Preview(QWidget):
@@ -31,23 +33,23 @@ class Preview(QWidget):
 
         self.show()
 
-        # Use "singleShot"s to render
-        self._timer = QTimer()
-        self._timer.singleShot(0, self.renderPreview)
-
         self._camera = camera
+        self._stats = camera.stats
+        # Redraw only when the camera publishes a new frame
+        self._preview = LivePreview(self._camera, self._label, opencv2qimage_scaled, parent=self)
+        self._preview.ratesChanged.connect(self.updateTitle)
         self._camera.start()
 
-    @pyqtSlot()
-    def renderPreview(self):
-        image = opencv2qimage(self._camera.frame)
-        pixmap = QPixmap.fromImage(image).scaled(self._label.width(), self._label.height(), Qt.KeepAspectRatio)
-        self._label.setPixmap(pixmap)
+        self._statsOverlay = StatsOverlay(self._stats, self._label)
+        QShortcut(QKeySequence('F3'), self, self._statsOverlay.toggle)
 
-        self._timer.singleShot(1000 // 30, self.renderPreview)
+    @pyqtSlot(float, float)
+    def updateTitle(self, capture_fps, render_fps):
+        self.setWindowTitle('CameraThread Feed - capture %.1f fps, render %.1f fps (F3: stats)' %
+                            (capture_fps, render_fps))
 
     def closeEvent(self, a0):
-        self._timer.stop()
+        self._preview.stop()
         self._camera.stop_flag = True
         print('Waiting for _camera to finish...')
         while self._camera.isRunning():
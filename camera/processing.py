@@ -0,0 +1,421 @@
+"""
+Per-frame analysis downstream of the camera
+
+A :class:`Processor` computes something from a frame (a sharpness score, a histogram, motion) and knows how
+to draw its result over the preview. :class:`ProcessingStage` follows the camera's ring and hands frames to
+the processors on a thread pool, for work that releases the GIL like most OpenCV and NumPy calls, or on a
+process pool for pure Python work. Frames go to worker processes through a
+:class:`~camera.server.SharedFrameRing` rather than being pickled.
+
+Each processor has a frame rate budget and a limit on frames in flight; frames arriving while it is busy
+or ahead of its budget are skipped rather than queued, so a slow processor never holds up the camera or
+the preview. Results come back in frame order for each processor, tagged with the frame's sequence number.
+"""
+import abc
+import collections
+import multiprocessing
+import threading
+import time
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from .server import SharedFrameReader, SharedFrameRing
+
+_logger = logging.getLogger(__name__)
+
+# Result of one processor on one frame: the frame's sequence number, capture time and (height, width), and
+# whatever the processor returned
+ProcessorResult = namedtuple('ProcessorResult', ['seq', 'timestamp', 'shape', 'value'])
+
+
+class Processor(abc.ABC):
+    """
+    Base class for per-frame analysis. Subclasses set :attr:`name` and implement :meth:`process`, and
+    usually :meth:`draw`.
+
+    Processors that run in worker processes are pickled for every frame, so they must be defined at module
+    level and keep their state small. A processor that carries state from frame to frame sets
+    :attr:`stateful` and always runs on a thread, one frame at a time.
+    """
+    name = 'processor'
+    stateful = False
+
+    def __init__(self, fps=0.0, executor='thread', max_in_flight=1):
+        """
+
+        :param fps: most frames per second to process, 0 for every frame
+        :param executor: 'thread' or 'process'
+        :param max_in_flight: frames that may be processed concurrently
+        """
+        if executor not in ('thread', 'process'):
+            raise ValueError('Unknown executor %r' % executor)
+        if self.stateful and (executor != 'thread' or max_in_flight != 1):
+            _logger.warning('%s keeps state between frames; running it on a thread, one frame at a time', self.name)
+            executor, max_in_flight = 'thread', 1
+        self.fps = fps
+        self.executor = executor
+        self.maxInFlight = max_in_flight
+
+    @abc.abstractmethod
+    def process(self, image):
+        """
+        Runs on a worker thread or process. ``image`` must not be kept after returning.
+
+        :param image: BGR frame as captured, in sensor orientation
+        :return: anything picklable
+        """
+        raise NotImplementedError
+
+    def draw(self, image, result, mapPoint):
+        """
+        Draw ``result`` over a preview image, in place. Runs on the render worker thread.
+
+        :type result: ProcessorResult
+        :param mapPoint: callable(x, y) mapping frame (sensor) coordinates of the processed frame to
+            ``image`` coordinates
+        """
+        pass
+
+    def __str__(self):
+        return '%s (%s%s)' % (self.name, self.executor, ', %g fps' % self.fps if self.fps else '')
+
+
+def _draw_text(image, row, text):
+    cv2.putText(image, text, (8, 20 + 18 * row), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 3, cv2.LINE_AA)
+    cv2.putText(image, text, (8, 20 + 18 * row), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
+
+
+class SharpnessProcessor(Processor):
+    """
+    Focus measure: variance of the Laplacian of the grey image, higher is sharper
+    """
+    name = 'sharpness'
+
+    def process(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+    def draw(self, image, result, mapPoint):
+        _draw_text(image, 0, 'Sharpness %.1f' % result.value)
+
+
+class HistogramProcessor(Processor):
+    """
+    Per-channel intensity histogram, drawn as a small plot in the bottom left corner
+    """
+    name = 'histogram'
+
+    def __init__(self, fps=0.0, executor='thread', max_in_flight=1, bins=64):
+        super(HistogramProcessor, self).__init__(fps, executor, max_in_flight)
+        self.bins = bins
+
+    def process(self, image):
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        return np.stack([cv2.calcHist([image], [c], None, [self.bins], [0, 256]).ravel() for c in range(channels)])
+
+    def draw(self, image, result, mapPoint):
+        hist = result.value
+        h, w = image.shape[:2]
+        plot_w, plot_h = min(w // 3, 256), min(h // 4, 100)
+        if plot_w < 16 or plot_h < 16:
+            return
+        x0, y0 = 8, h - 8
+        peak = hist.max() or 1.0
+        xs = x0 + np.arange(hist.shape[1]) * plot_w / (hist.shape[1] - 1)
+        colors = ((255, 0, 0), (0, 255, 0), (0, 0, 255)) if len(hist) == 3 else ((255, 255, 255),)
+        for counts, color in zip(hist, colors):
+            pts = np.stack([xs, y0 - counts / peak * plot_h], axis=1).round().astype(np.int32)
+            cv2.polylines(image, [pts], False, color, 1, cv2.LINE_AA)
+
+
+class MotionProcessor(Processor):
+    """
+    Regions that changed since the previous processed frame, found on a reduced grey image
+    """
+    name = 'motion'
+    stateful = True
+
+    def __init__(self, fps=0.0, executor='thread', max_in_flight=1, threshold=25, min_area=0.001, width=320):
+        """
+
+        :param threshold: grey level difference that counts as a change
+        :param min_area: smallest region reported, as a fraction of the frame
+        :param width: width the frames are reduced to before comparing
+        """
+        super(MotionProcessor, self).__init__(fps, executor, max_in_flight)
+        self.threshold = threshold
+        self.minArea = min_area
+        self.width = width
+        self._previous = None
+
+    def process(self, image):
+        """
+        :return: list of (x, y, w, h) boxes in frame coordinates
+        """
+        scale = min(self.width * 1.0 / image.shape[1], 1.0)
+        small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small, (5, 5), 0)
+        previous, self._previous = self._previous, gray
+        if previous is None or previous.shape != gray.shape:
+            return []
+        _, mask = cv2.threshold(cv2.absdiff(gray, previous), self.threshold, 255, cv2.THRESH_BINARY)
+        mask = cv2.dilate(mask, None, iterations=2)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2:]
+        min_area = self.minArea * gray.size
+        return [tuple(v / scale for v in cv2.boundingRect(c)) for c in contours if cv2.contourArea(c) >= min_area]
+
+    def draw(self, image, result, mapPoint):
+        for x, y, w, h in result.value:
+            (x1, y1), (x2, y2) = mapPoint(x, y), mapPoint(x + w, y + h)
+            cv2.rectangle(image, (int(round(x1)), int(round(y1))), (int(round(x2)), int(round(y2))),
+                          (0, 255, 255), 1, cv2.LINE_AA)
+
+
+PROCESSORS = collections.OrderedDict((cls.name, cls) for cls in
+                                     (SharpnessProcessor, HistogramProcessor, MotionProcessor))
+
+
+def create_processor(spec):
+    """
+    Build a processor from ``NAME[:FPS][:thread|process]``, e.g. ``sharpness:10:process``
+
+    :rtype: Processor
+    """
+    name, _, rest = spec.partition(':')
+    cls = PROCESSORS.get(name)
+    if cls is None:
+        raise ValueError('Unknown processor %r, expected one of %s' % (name, ', '.join(PROCESSORS)))
+    fps, executor = 0.0, 'thread'
+    for arg in filter(None, rest.split(':')):
+        if arg in ('thread', 'process'):
+            executor = arg
+        else:
+            try:
+                fps = float(arg)
+            except ValueError:
+                raise ValueError('Processor spec %r: expected NAME[:FPS][:thread|process]' % spec)
+    return cls(fps=fps, executor=executor)
+
+
+# Shared memory rings attached by this worker process, by name
+_readers = {}
+
+
+def _process_shared(processor, name, index):
+    """
+    Runs in a worker process: process frame ``index`` of the shared ring ``name``
+    """
+    reader = _readers.get(name)
+    if reader is None:
+        for stale in _readers.values():
+            stale.close()
+        _readers.clear()
+        reader = _readers[name] = SharedFrameReader(name)
+    frame = reader.get(index)
+    if frame is None:
+        return None
+    image = frame.image
+    del frame
+    return processor.process(image)
+
+
+class _Lane(object):
+    """
+    Bookkeeping for one processor: frames in flight in submission order, and when it last started
+    """
+    def __init__(self, processor):
+        self.processor = processor
+        self.inFlight = collections.deque()
+        self.lastStart = 0.0
+        self.latest = None
+        # Times the process pool was found broken when this lane submitted to it
+        self.poolFailures = 0
+
+
+class ProcessingStage(QThread):
+    """
+    Feeds camera frames to :class:`Processor` instances on worker threads or processes.
+
+    :attr:`resultReady` is emitted with each result, per processor in frame order; :meth:`latest` returns
+    the newest result of every processor for drawing overlays. Time spent processing, frames skipped and
+    failures are recorded in the camera's pipeline stats under the processor's name.
+    """
+    # Emitted with the frame sequence number, the processor name and a ProcessorResult
+    resultReady = pyqtSignal(int, str, object)
+
+    # A lane that finds the process pool broken more often than this is taken to be killing the workers
+    MAX_POOL_FAILURES = 3
+
+    def __init__(self, camera, processors=(), threads=2, processes=2, parent=None):
+        """
+
+        :type camera: camera.camera_thread.CameraThread
+        :param processors: initial :class:`Processor` instances
+        :param threads: size of the thread pool
+        :param processes: size of the process pool, started when the first 'process' processor is added
+        """
+        super(ProcessingStage, self).__init__(parent=parent)
+        self._ring = camera.ring
+        self._stats = camera.stats
+        self._lock = threading.Lock()
+        self._lanes = collections.OrderedDict()
+        self._threads = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='Processor')
+        self._process_count = processes
+        self._processes = None
+        self._shared = None
+        self._shared_index = -1
+        self._stop = False
+        for processor in processors:
+            self.add(processor)
+
+    @property
+    def processors(self):
+        return [lane.processor for lane in list(self._lanes.values())]
+
+    def add(self, processor):
+        """
+        Start running ``processor``, replacing one with the same name
+        """
+        with self._lock:
+            if processor.executor == 'process' and self._processes is None:
+                self._processes = self._createProcessPool()
+            self._lanes[processor.name] = _Lane(processor)
+            self._stats.count('%s skipped' % processor.name, 0)
+        _logger.info('Processing frames with %s', processor)
+
+    def _createProcessPool(self):
+        # Forking a process with Qt and capture threads running is not safe
+        return ProcessPoolExecutor(max_workers=self._process_count, mp_context=multiprocessing.get_context('spawn'))
+
+    def _processPoolBroken(self, lane, error):
+        """
+        A worker process died, which breaks the whole pool. Start a fresh one, unless this lane keeps
+        breaking it, in which case the lane is dropped so the others carry on.
+        """
+        name = lane.processor.name
+        self._stats.count('%s failed' % name)
+        lane.poolFailures += 1
+        with self._lock:
+            broken, self._processes = self._processes, self._createProcessPool()
+            if lane.poolFailures > self.MAX_POOL_FAILURES:
+                self._lanes.pop(name, None)
+        broken.shutdown(wait=False)
+        if lane.poolFailures > self.MAX_POOL_FAILURES:
+            _logger.error('Worker processes keep dying under %s; disabled it: %s', name, error)
+        else:
+            _logger.warning('Worker process died under %s; restarted the process pool: %s', name, error)
+
+    def remove(self, name):
+        with self._lock:
+            self._lanes.pop(name, None)
+
+    def latest(self):
+        """
+        :return: list of (processor, ProcessorResult) with the newest result of each processor
+        """
+        return [(lane.processor, lane.latest) for lane in list(self._lanes.values()) if lane.latest is not None]
+
+    def stop(self):
+        with self._lock:
+            self._stop = True
+        self.wait()
+        self._threads.shutdown(wait=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=True)
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
+    def run(self):
+        seq = self._ring.seq
+        while not self._stop:
+            frame, _ = self._ring.next(seq, timeout=0.1)
+            if frame is None:
+                continue
+            seq = frame.seq
+            now = time.monotonic()
+            with self._lock:
+                lanes = list(self._lanes.values())
+            for lane in lanes:
+                processor = lane.processor
+                if processor.fps and now - lane.lastStart < 0.95 / processor.fps:
+                    continue
+                if len(lane.inFlight) >= processor.maxInFlight:
+                    self._stats.count('%s skipped' % processor.name)
+                    continue
+                if self._submit(lane, frame):
+                    lane.lastStart = now
+
+    def _submit(self, lane, frame):
+        processor = lane.processor
+        held = self._ring.hold(frame.seq)
+        if held is None:
+            return False
+        shape = held.image.shape[:2]
+        start = time.monotonic()
+        if processor.executor == 'process':
+            try:
+                name, index = self._publish(held)
+            finally:
+                self._ring.release(held)
+            try:
+                future = self._processes.submit(_process_shared, processor, name, index)
+            except BrokenProcessPool as e:
+                self._processPoolBroken(lane, e)
+                return False
+        else:
+            future = self._threads.submit(processor.process, held.image)
+            future.add_done_callback(lambda f, held=held: self._ring.release(held))
+        entry = [held.seq, held.timestamp, shape, start, future]
+        with self._lock:
+            lane.inFlight.append(entry)
+        future.add_done_callback(lambda f, lane=lane: self._deliver(lane))
+        return True
+
+    def _publish(self, frame):
+        """
+        Copy a frame into the ring shared with the worker processes, making a new ring if the frame no
+        longer fits
+        """
+        index = self._shared_index + 1
+        if self._shared is None or not self._shared.publish(index, frame.timestamp, frame.image):
+            if self._shared is not None:
+                self._shared.close()
+            # Enough slots that a frame is never overwritten while a worker may still be reading it
+            slots = sum(lane.processor.maxInFlight for lane in list(self._lanes.values())) + 2
+            self._shared = SharedFrameRing(None, frame.image.shape, frame.image.dtype, slots=slots)
+            index = 0
+            self._shared.publish(index, frame.timestamp, frame.image)
+        self._shared_index = index
+        return self._shared.name, index
+
+    def _deliver(self, lane):
+        """
+        Emit the results at the head of the lane that are done, so results leave in submission order
+        """
+        name = lane.processor.name
+        with self._lock:
+            ready = []
+            while lane.inFlight and lane.inFlight[0][-1].done():
+                ready.append(lane.inFlight.popleft())
+            for seq, timestamp, shape, start, future in ready:
+                self._stats.record(name, time.monotonic() - start)
+                try:
+                    value = future.result()
+                except Exception as e:
+                    self._stats.count('%s failed' % name)
+                    _logger.warning('%s failed on frame %d: %s', name, seq, e)
+                    continue
+                if value is None and lane.processor.executor == 'process':
+                    # The frame was overwritten before the worker got to it
+                    self._stats.count('%s skipped' % name)
+                    continue
+                result = ProcessorResult(seq, timestamp, shape, value)
+                lane.latest = result
+                self.resultReady.emit(seq, name, result)
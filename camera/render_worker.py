@@ -0,0 +1,161 @@
+import threading
+import time
+
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal, pyqtSlot
+from PyQt5.QtGui import QImage, QPixmap
+
+
+class RenderWorker(QThread):
+    """
+    Turns the newest camera frame into a display-ready QImage off the GUI thread.
+
+    The owner passes a ``render(image, *args)`` callable returning a QImage already scaled to the preview
+    size, and calls :meth:`submit` with a snapshot of whatever view settings it needs. Only the most
+    recent submission is kept: if the worker is still busy, older requests are dropped and counted in
+    :attr:`dropped`. The GUI thread only has to turn the result into a pixmap.
+    """
+    # Emitted with the rendered image and the sequence number of the frame it was made from
+    imageReady = pyqtSignal(QImage, int)
+
+    def __init__(self, ring, render, parent=None, stats=None):
+        """
+
+        :type ring: camera.frame_buffer.FrameRing
+        :param ring: frames to render
+        :param render: callable(image, *args) -> QImage
+        :type stats: camera.stats.PipelineStats
+        :param stats: optional stats to record render times and dropped requests in
+        """
+        super(RenderWorker, self).__init__(parent=parent)
+        self._ring = ring
+        self._render = render
+        self._cond = threading.Condition()
+        self._job = None
+        self._stop = False
+        self.dropped = 0
+        self._render_time = None
+        if stats is not None:
+            self._render_time = stats.histogram('render')
+            stats.gauge('render queue', lambda: int(self._job is not None))
+            stats.gauge('render dropped', lambda: self.dropped)
+
+    def submit(self, *args):
+        """
+        Ask for the newest frame to be rendered with ``args``, replacing any request not yet started.
+        """
+        with self._cond:
+            if self._job is not None:
+                self.dropped += 1
+            self._job = args
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._job is not None or self._stop)
+                if self._stop:
+                    break
+                args, self._job = self._job, None
+
+            # Pin the frame so the capture thread cannot recycle it mid-render
+            frame = self._ring.hold(self._ring.seq)
+            if frame is None:
+                continue
+            start = time.monotonic()
+            try:
+                image = self._render(frame.image, *args)
+            finally:
+                self._ring.release(frame)
+            if self._render_time is not None:
+                self._render_time.add(time.monotonic() - start)
+            if image is not None:
+                self.imageReady.emit(image, frame.seq)
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self.wait()
+
+
+class LivePreview(QObject):
+    """
+    Keeps a QLabel showing the camera's newest frame, rendered on a :class:`RenderWorker`.
+
+    Redraws are requested for every new frame and coalesced while one is pending, so a slow paint only ever
+    draws the newest frame instead of working through a backlog. Paint time, latency, frames never shown
+    and the render rate go into the camera's stats. The owner supplies only the image-building step:
+    ``render(image, *view(), width, height)`` returning a QImage for a label of that size. Without ``view``
+    a request is skipped if the newest frame is already shown; with it the frame is redrawn, as the view
+    settings may have changed.
+    """
+    # Emitted at most twice a second after a paint with the capture and render rates in frames/s
+    ratesChanged = pyqtSignal(float, float)
+
+    def __init__(self, camera, label, render, view=None, parent=None):
+        """
+
+        :type camera: camera.camera_thread.CameraThread
+        :type label: QLabel
+        :param label: where the frames are shown, and what they are scaled to
+        :param render: callable(image, *view(), width, height) -> QImage, run on the render thread
+        :param view: optional callable() -> tuple of view settings, run on the GUI thread before each render
+        """
+        super(LivePreview, self).__init__(parent)
+        self._camera = camera
+        self._label = label
+        self._view = view
+        self._stats = camera.stats
+        self.renderRate = self._stats.rate('render')
+        self._pending = False
+        self._ratesUpdated = 0.0
+        # Sequence number of the frame on screen, -1 before the first paint
+        self.displayedSeq = -1
+
+        self._worker = RenderWorker(camera.ring, render, parent=self, stats=self._stats)
+        self._worker.imageReady.connect(self.showImage)
+        self._worker.start()
+        self._camera.frameReady.connect(self.requestRender)
+
+    @pyqtSlot(int)
+    def requestRender(self, seq=-1):
+        """
+        Schedule a redraw of the newest frame
+        """
+        if not self._pending:
+            self._pending = True
+            QTimer.singleShot(0, self._submit)
+
+    @pyqtSlot()
+    def _submit(self):
+        self._pending = False
+        if self._view is None:
+            if self._camera.ring.seq == self.displayedSeq:
+                return
+            args = ()
+        else:
+            args = tuple(self._view())
+        self._worker.submit(*(args + (self._label.width(), self._label.height())))
+
+    @pyqtSlot(QImage, int)
+    def showImage(self, image, seq):
+        start = time.monotonic()
+        self._label.setPixmap(QPixmap.fromImage(image))
+        now = time.monotonic()
+        self._stats.record('paint', now - start)
+        # Glass-to-glass as far as software can see: from the frame leaving the driver to its pixmap being set
+        frame = self._camera.ring.get(seq)
+        if frame is not None:
+            self._stats.record('latency', now - frame.timestamp)
+        if 0 <= self.displayedSeq < seq - 1:
+            self._stats.count('not displayed', seq - self.displayedSeq - 1)
+        self.displayedSeq = seq
+
+        self.renderRate.tick(now)
+        if now - self._ratesUpdated > 0.5:
+            self._ratesUpdated = now
+            self.ratesChanged.emit(self._camera.captureFps, self.renderRate.rate)
+
+    def stop(self):
+        self._camera.frameReady.disconnect(self.requestRender)
+        self._worker.stop()
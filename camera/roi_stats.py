@@ -0,0 +1,266 @@
+"""
+Live statistics of the region of interest
+
+The ROI is mapped back to sensor coordinates once, through the inverse of the view's rotate/flip/crop, and
+every frame is measured as a slice of the frame as captured, so nothing is reoriented or copied and the
+cost per frame follows the size of the ROI rather than of the frame. Samples are kept in a fixed-size
+series for plotting, with running totals updated as each one arrives, and can be streamed to CSV.
+"""
+import csv
+import time
+import logging
+from collections import namedtuple
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import Qt, QPointF
+from PyQt5.QtGui import QColor, QPainter, QPen, QPolygonF
+from PyQt5.QtWidgets import QWidget
+
+from .processing import Processor
+
+_logger = logging.getLogger(__name__)
+
+# Statistics of one frame's ROI: pixel count, then per-channel arrays of mean, standard deviation, minimum,
+# maximum and a (channels, bins) histogram, and the (low, high) range of pixel values the histogram spans
+RoiSample = namedtuple('RoiSample', ['count', 'mean', 'std', 'min', 'max', 'histogram', 'range'])
+
+CHANNEL_NAMES = {1: ('gray',), 3: ('b', 'g', 'r'), 4: ('b', 'g', 'r', 'a')}
+# RGB to plot each channel in
+CHANNEL_COLORS = {'gray': (200, 200, 200), 'b': (80, 80, 255), 'g': (80, 200, 80), 'r': (255, 80, 80),
+                  'a': (160, 160, 160)}
+
+
+def channel_names(channels):
+    return CHANNEL_NAMES.get(channels) or tuple(str(c) for c in range(channels))
+
+
+def value_range(dtype):
+    """
+    :return: (low, high) pixel values of ``dtype``, high exclusive for integer types; floating point frames
+        are taken to be in [0, 1]
+    """
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return float(info.min), float(info.max) + 1
+    return 0.0, 1.0
+
+
+def sensor_region(transform, start, end):
+    """
+    Map an ROI given by two corners in oriented, uncropped view coordinates back to the sensor.
+
+    :type transform: camera.transform.FrameTransform
+    :return: (x1, y1, x2, y2) in sensor pixels, clipped to the frame, or None if the ROI is empty
+    """
+    if start is None or end is None:
+        return None
+    corners = [transform.toSensor(*start), transform.toSensor(*end)]
+    h, w = transform.sensor_shape
+    (x1, x2), (y1, y2) = (sorted(int(round(np.clip(v, 0, limit))) for v in values)
+                          for values, limit in zip(zip(*corners), (w, h)))
+    if x2 - x1 < 1 or y2 - y1 < 1:
+        return None
+    return x1, y1, x2, y2
+
+
+class RoiStatsProcessor(Processor):
+    """
+    Mean, standard deviation, range and histogram of each channel over the ROI, measured on a view of the
+    captured frame. Has no result until :meth:`setRegion` is given a region.
+    """
+    name = 'roi'
+
+    def __init__(self, fps=0.0, bins=32):
+        super(RoiStatsProcessor, self).__init__(fps, 'thread', 1)
+        self.bins = bins
+        # (region, shape of the frames it is in), replaced as a whole so the worker always sees a consistent pair
+        self._region = None
+
+    @property
+    def region(self):
+        return None if self._region is None else self._region[0]
+
+    def setRegion(self, region, shape=None):
+        """
+        :param region: (x1, y1, x2, y2) in sensor pixels of frames of ``shape``, or None
+        :param shape: (height, width) the region refers to; frames of another resolution are measured over
+            the same part of the sensor
+        """
+        self._region = None if region is None else (tuple(region), tuple(shape[:2]))
+
+    def process(self, image):
+        """
+        :rtype: RoiSample
+        """
+        region = self._region
+        if region is None:
+            return None
+        (x1, y1, x2, y2), (h, w) = region
+        if (h, w) != image.shape[:2]:
+            fy, fx = image.shape[0] * 1.0 / h, image.shape[1] * 1.0 / w
+            x1, x2 = int(x1 * fx), max(int(round(x2 * fx)), int(x1 * fx) + 1)
+            y1, y2 = int(y1 * fy), max(int(round(y2 * fy)), int(y1 * fy) + 1)
+        roi = image[y1:y2, x1:x2]
+        if roi.size == 0:
+            return None
+        channels = 1 if roi.ndim == 2 else roi.shape[2]
+        mean, std = (v.ravel()[:channels] for v in cv2.meanStdDev(roi))
+        axes = (0, 1)
+        # Raw and 16-bit frames span more than 0-255
+        low, high = value_range(roi.dtype)
+        pixels = roi if roi.dtype in (np.uint8, np.uint16, np.float32) else roi.astype(np.float32)
+        histogram = np.stack([cv2.calcHist([pixels], [c], None, [self.bins], [low, high]).ravel()
+                              for c in range(channels)])
+        return RoiSample(roi.shape[0] * roi.shape[1], mean, std, roi.min(axis=axes).reshape(-1).astype(float),
+                         roi.max(axis=axes).reshape(-1).astype(float), histogram, (low, high))
+
+
+class RoiSeries(object):
+    """
+    The last ``capacity`` ROI samples as arrays for plotting, plus running totals over every sample since
+    the last :meth:`clear`, each updated in constant time per sample.
+    """
+    def __init__(self, capacity=600):
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        self._channels = 0
+        self._times = np.zeros(self.capacity)
+        self._means = None
+        self._next = 0
+        self.count = 0
+        self.latest = None
+        self.latestSeq = -1
+        # Running mean, min and max of the per-frame means
+        self.runningMean = None
+        self.runningMin = None
+        self.runningMax = None
+
+    def append(self, seq, timestamp, sample):
+        """
+        :type sample: RoiSample
+        """
+        channels = len(sample.mean)
+        if channels != self._channels:
+            self._channels = channels
+            self._means = np.zeros((self.capacity, channels))
+            self._next = 0
+            self.count = 0
+        index = self._next % self.capacity
+        self._times[index] = timestamp
+        self._means[index] = sample.mean
+        self._next += 1
+        self.count += 1
+        if self.count == 1:
+            self.runningMean = np.array(sample.mean, dtype=float)
+            self.runningMin = np.array(sample.mean, dtype=float)
+            self.runningMax = np.array(sample.mean, dtype=float)
+        else:
+            self.runningMean += (sample.mean - self.runningMean) / self.count
+            np.minimum(self.runningMin, sample.mean, out=self.runningMin)
+            np.maximum(self.runningMax, sample.mean, out=self.runningMax)
+        self.latest = sample
+        self.latestSeq = seq
+
+    def __len__(self):
+        return min(self._next, self.capacity)
+
+    def arrays(self):
+        """
+        :return: (timestamps, per-channel means) oldest first
+        """
+        n = len(self)
+        if n == 0:
+            return np.zeros(0), np.zeros((0, self._channels))
+        order = np.arange(self._next - n, self._next) % self.capacity
+        return self._times[order], self._means[order]
+
+
+class RoiCsvWriter(object):
+    """
+    Streams ROI samples to a CSV file, one row per frame, flushing about once a second so the file can be
+    followed while it grows
+    """
+    def __init__(self, filename, flush_interval=1.0):
+        self.filename = filename
+        self.rows = 0
+        self._file = open(filename, 'w', newline='')
+        self._csv = csv.writer(self._file)
+        self._channels = None
+        self._flush_interval = flush_interval
+        self._flushed = time.monotonic()
+
+    def write(self, seq, timestamp, sample):
+        """
+        :type sample: RoiSample
+        """
+        names = channel_names(len(sample.mean))
+        if names != self._channels:
+            self._channels = names
+            self._csv.writerow(['seq', 'timestamp', 'pixels'] +
+                               ['%s_%s' % (stat, c) for stat in ('mean', 'std', 'min', 'max') for c in names])
+        self._csv.writerow([seq, '%.6f' % timestamp, sample.count] +
+                           ['%.4f' % v for values in (sample.mean, sample.std, sample.min, sample.max) for v in values])
+        self.rows += 1
+        now = time.monotonic()
+        if now - self._flushed >= self._flush_interval:
+            self._flushed = now
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class RoiPlot(QWidget):
+    """
+    Per-channel ROI mean over time, with the latest histogram alongside
+    """
+    def __init__(self, parent=None):
+        super(RoiPlot, self).__init__(parent)
+        self.series = None
+        self.setMinimumHeight(80)
+
+    def setSeries(self, series):
+        """
+        :type series: RoiSeries
+        """
+        self.series = series
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(20, 20, 20))
+        series = self.series
+        if series is None or not len(series):
+            painter.setPen(QColor(160, 160, 160))
+            painter.drawText(self.rect(), Qt.AlignCenter, 'Draw an ROI to see its statistics')
+            return
+        painter.setRenderHint(QPainter.Antialiasing)
+        width, height = self.width(), self.height()
+        plot_w = width * 2 // 3
+        times, means = series.arrays()
+        span = max(times[-1] - times[0], 1e-6)
+        xs = (times - times[0]) / span * (plot_w - 4) + 2
+        colors = [QColor(*CHANNEL_COLORS.get(name, (200, 200, 200))) for name in channel_names(means.shape[1])]
+        low, high = series.latest.range
+        for c, color in enumerate(colors):
+            ys = height - 2 - (means[:, c] - low) / (high - low) * (height - 4)
+            painter.setPen(QPen(color, 1))
+            painter.drawPolyline(QPolygonF([QPointF(x, y) for x, y in zip(xs, ys)]))
+        painter.setPen(QColor(160, 160, 160))
+        painter.drawText(4, 12, '%.0f s' % span)
+
+        histogram = series.latest.histogram
+        left = plot_w + 4
+        hist_w = width - left - 2
+        peak = histogram.max() or 1.0
+        xs = left + np.arange(histogram.shape[1]) * hist_w / max(histogram.shape[1] - 1, 1)
+        for counts, color in zip(histogram, colors):
+            ys = height - 2 - counts / peak * (height - 4)
+            painter.setPen(QPen(color, 1))
+            painter.drawPolyline(QPolygonF([QPointF(x, y) for x, y in zip(xs, ys)]))
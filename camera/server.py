@@ -0,0 +1,509 @@
+"""
+Serving the camera stream to other processes
+
+:class:`SharedFrameRing` publishes every frame into a ``multiprocessing.shared_memory`` block that local
+processes map with :class:`SharedFrameReader` and read without copying, the same way consumers in this
+process read the :class:`~camera.frame_buffer.FrameRing`. :class:`FrameServer` adds an HTTP endpoint
+streaming MJPEG to browsers; each frame is JPEG encoded once however many clients are watching, and every
+client is throttled to the rate it asked for.
+
+Usage::
+
+    python -m camera --serve 8080 --shm webcam --source synthetic:1280x720@30
+
+    # in another process
+    from camera.server import SharedFrameReader
+    with SharedFrameReader('webcam') as reader:
+        seq = -1
+        while True:
+            frame = reader.next(seq, timeout=1.0)
+            ...
+            seq = frame.seq
+"""
+import json
+import multiprocessing
+import struct
+import threading
+import time
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import resource_tracker, shared_memory
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QThread
+
+from .frame_buffer import Frame
+
+_logger = logging.getLogger(__name__)
+
+SHM_MAGIC = b'PQWSHM01'
+# magic, slot count, slot size, newest sequence number
+SHM_HEADER = struct.Struct('<8sQQq')
+SHM_HEADER_SIZE = 64
+# seq, capture timestamp, height, width, channels, dtype; seq is -1 while the slot is being written
+SLOT_HEADER = struct.Struct('<qdIII16s')
+SLOT_HEADER_SIZE = 64
+SLOT_ALIGN = 4096
+
+BOUNDARY = 'frame'
+
+
+class SharedFrameRing(object):
+    """
+    Writer side of a ring of frames in shared memory, sized for frames up to ``shape``.
+
+    Like :class:`~camera.frame_buffer.FrameRing` there is a single writer and readers never lock: the writer
+    marks a slot invalid before overwriting it and republishes its sequence number afterwards, so a reader
+    that sees the same sequence number before and after using a frame knows it was not torn.
+    """
+    def __init__(self, name, shape, dtype=np.uint8, slots=8):
+        """
+
+        :param name: shared memory block name, None for a generated one (see :attr:`name`)
+        :param shape: largest frame shape that will be published
+        :param slots: number of frames kept
+        """
+        frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self.slot_size = -(-(SLOT_HEADER_SIZE + frame_bytes) // SLOT_ALIGN) * SLOT_ALIGN
+        self.slots = slots
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=SHM_HEADER_SIZE + slots * self.slot_size)
+        self._head = -1
+        self._warned = False
+        for index in range(slots):
+            SLOT_HEADER.pack_into(self._shm.buf, self._offset(index), -1, 0.0, 0, 0, 0, b'')
+        self._writeHeader()
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def seq(self):
+        return self._head
+
+    def _offset(self, index):
+        return SHM_HEADER_SIZE + index * self.slot_size
+
+    def _writeHeader(self):
+        SHM_HEADER.pack_into(self._shm.buf, 0, SHM_MAGIC, self.slots, self.slot_size, self._head)
+
+    def publish(self, seq, timestamp, image):
+        """
+        Copy a frame into the next slot.
+
+        :param seq: sequence number, must increase
+        :return: False if the frame is larger than a slot and was not published
+        """
+        if SLOT_HEADER_SIZE + image.nbytes > self.slot_size:
+            if not self._warned:
+                _logger.warning('Frame of %s does not fit a %d byte shared memory slot; not publishing',
+                                image.shape, self.slot_size)
+                self._warned = True
+            return False
+        offset = self._offset(seq % self.slots)
+        buf = self._shm.buf
+        struct.pack_into('<q', buf, offset, -1)
+        shape = image.shape + (1,) * (3 - image.ndim)
+        view = np.ndarray(image.shape, dtype=image.dtype, buffer=buf, offset=offset + SLOT_HEADER_SIZE)
+        np.copyto(view, image)
+        del view
+        SLOT_HEADER.pack_into(buf, offset, -1, timestamp, shape[0], shape[1], shape[2],
+                              image.dtype.str.encode('ascii'))
+        struct.pack_into('<q', buf, offset, seq)
+        self._head = seq
+        self._writeHeader()
+        return True
+
+    def close(self):
+        """
+        Remove the block; readers that still have it mapped keep their mapping
+        """
+        if self._shm is None:
+            return
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+
+class SharedFrameReader(object):
+    """
+    Reader side of a :class:`SharedFrameRing`, in any process on the machine.
+
+    Frames are views into shared memory, valid until the writer laps them; check :meth:`isValid` after
+    using a frame's pixels, or copy them. Drop every frame before :meth:`close`.
+    """
+    def __init__(self, name):
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the block with the resource tracker, which would
+            # unlink it from under the writer when this process exits. Processes started by the writer's
+            # process share its tracker, where the registration is the writer's own and must stay.
+            self._shm = shared_memory.SharedMemory(name=name)
+            if multiprocessing.parent_process() is None:
+                resource_tracker.unregister(self._shm._name, 'shared_memory')
+        magic, self.slots, self.slot_size, _ = SHM_HEADER.unpack_from(self._shm.buf, 0)
+        if magic != SHM_MAGIC:
+            self._shm.close()
+            raise ValueError('%s is not a shared frame ring' % name)
+
+    @property
+    def seq(self):
+        """
+        Sequence number of the newest published frame, or -1 if nothing has been published yet
+        """
+        return SHM_HEADER.unpack_from(self._shm.buf, 0)[3]
+
+    def _slotSeq(self, seq):
+        return struct.unpack_from('<q', self._shm.buf, SHM_HEADER_SIZE + (seq % self.slots) * self.slot_size)[0]
+
+    def get(self, seq):
+        """
+        :return: the frame with sequence number ``seq`` as a :data:`~camera.frame_buffer.Frame` whose
+            ``buffer`` is the slot index, or None if it is not (or no longer) in the ring
+        """
+        if seq < 0:
+            return None
+        index = seq % self.slots
+        offset = SHM_HEADER_SIZE + index * self.slot_size
+        values = SLOT_HEADER.unpack_from(self._shm.buf, offset)
+        if values[0] != seq:
+            return None
+        _, timestamp, height, width, channels, dtype = values
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        image = np.ndarray(shape, dtype=np.dtype(dtype.rstrip(b'\0').decode('ascii')), buffer=self._shm.buf,
+                           offset=offset + SLOT_HEADER_SIZE)
+        if self._slotSeq(seq) != seq:
+            return None
+        return Frame(seq, timestamp, image, index)
+
+    def latest(self):
+        return self.get(self.seq)
+
+    def isValid(self, frame):
+        """
+        :return: True if the slot backing ``frame`` has not been rewritten since it was read
+        """
+        return self._slotSeq(frame.seq) == frame.seq
+
+    def next(self, seq, timeout=None, poll=0.001):
+        """
+        Newest frame captured after ``seq``, waiting for one if needed. Frames in between are skipped.
+
+        :param timeout: seconds to wait, None to wait forever
+        :return: the frame, or None on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            head = self.seq
+            if head > seq:
+                frame = self.get(head)
+                if frame is not None:
+                    return frame
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll)
+
+    def close(self):
+        self._shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SharedMemoryPublisher(QThread):
+    """
+    Copies every frame the camera publishes into a :class:`SharedFrameRing` on its own thread. Frames that
+    were recycled before they could be copied are counted as 'shm missed'.
+    """
+    def __init__(self, camera, name=None, slots=8, parent=None):
+        """
+
+        :type camera: camera.camera_thread.CameraThread
+        :param name: shared memory block name, None for a generated one
+        """
+        super(SharedMemoryPublisher, self).__init__(parent=parent)
+        self._ring = camera.ring
+        self._stats = camera.stats
+        self.shared = SharedFrameRing(name, camera.frame.shape, camera.frame.dtype, slots=slots)
+        self._stop = False
+
+    @property
+    def name(self):
+        return self.shared.name
+
+    def stop(self):
+        self._stop = True
+
+    def run(self):
+        copy_time = self._stats.histogram('shm publish')
+        seq = self._ring.seq
+        try:
+            while not self._stop:
+                frame, missed = self._ring.next(seq, timeout=0.1)
+                if frame is None:
+                    continue
+                seq = frame.seq
+                frame = self._ring.hold(seq)
+                if frame is None:
+                    self._stats.count('shm missed', missed + 1)
+                    continue
+                start = time.monotonic()
+                try:
+                    self.shared.publish(frame.seq, frame.timestamp, frame.image)
+                finally:
+                    self._ring.release(frame)
+                copy_time.add(time.monotonic() - start)
+                if missed:
+                    self._stats.count('shm missed', missed)
+        finally:
+            self.shared.close()
+
+
+class JpegEncoder(QThread):
+    """
+    Encodes the newest frame once for all HTTP clients, only while someone is watching and no faster than
+    the most demanding client asked for.
+    """
+    def __init__(self, camera, quality=80, max_fps=30.0, parent=None):
+        """
+
+        :type camera: camera.camera_thread.CameraThread
+        :param quality: JPEG quality, 0-100
+        :param max_fps: cap on the encoding rate whatever clients ask for
+        """
+        super(JpegEncoder, self).__init__(parent=parent)
+        self._ring = camera.ring
+        self._stats = camera.stats
+        self.quality = quality
+        self.maxFps = max_fps
+        self._cond = threading.Condition()
+        self._clients = {}
+        self._next_client = 0
+        # (seq, capture timestamp, JPEG bytes) of the newest encoded frame
+        self._jpeg = (-1, 0.0, b'')
+        self._stop = False
+        self._stats.gauge('http clients', lambda: len(self._clients))
+
+    def addClient(self, fps=0.0):
+        """
+        :param fps: rate the client wants, 0 for as fast as frames are encoded
+        :return: token for :meth:`removeClient`
+        """
+        with self._cond:
+            token = self._next_client
+            self._next_client += 1
+            self._clients[token] = min(fps, self.maxFps) if fps > 0 else self.maxFps
+            self._cond.notify_all()
+        return token
+
+    def removeClient(self, token):
+        with self._cond:
+            self._clients.pop(token, None)
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+    def waitFrame(self, seq, timeout=None):
+        """
+        Block until a frame newer than ``seq`` has been encoded.
+
+        :return: (seq, timestamp, JPEG bytes), with seq no newer than the argument on timeout or shutdown
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._jpeg[0] > seq or self._stop, timeout)
+            return self._jpeg
+
+    def snapshot(self, timeout=2.0):
+        """
+        :return: JPEG bytes of the newest frame, encoding one if nobody is streaming, or None on timeout
+        """
+        token = self.addClient()
+        try:
+            _, _, data = self.waitFrame(self._ring.seq - 1, timeout)
+        finally:
+            self.removeClient(token)
+        return data or None
+
+    def run(self):
+        encode_time = self._stats.histogram('encode')
+        encodeRate = self._stats.rate('encode')
+        seq = -1
+        last = 0.0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._clients or self._stop)
+                if self._stop:
+                    break
+                # A little slack so frames arriving at exactly the requested rate are not missed
+                period = 0.9 / max(self._clients.values())
+            delay = last + period - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if not self._ring.wait(seq, timeout=0.1):
+                continue
+            frame = self._ring.hold(self._ring.seq)
+            if frame is None:
+                continue
+            last = time.monotonic()
+            try:
+                ok, data = cv2.imencode('.jpg', frame.image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            finally:
+                self._ring.release(frame)
+            now = time.monotonic()
+            encode_time.add(now - last)
+            if not ok:
+                self._stats.count('encode failed')
+                continue
+            seq = frame.seq
+            encodeRate.tick(now)
+            with self._cond:
+                self._jpeg = (frame.seq, frame.timestamp, data.tobytes())
+                self._cond.notify_all()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'pyqt_webcam'
+
+    def log_message(self, format, *args):
+        _logger.debug('%s %s', self.address_string(), format % args)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        encoder = self.server.encoder
+        if url.path == '/':
+            self._send(200, 'text/html', INDEX_PAGE.encode('utf-8'))
+        elif url.path == '/stream.mjpg':
+            try:
+                fps = float(query.get('fps', ['0'])[0])
+            except ValueError:
+                self.send_error(400, 'fps must be a number')
+                return
+            self._stream(encoder, fps)
+        elif url.path == '/snapshot.jpg':
+            data = encoder.snapshot()
+            if data is None:
+                self.send_error(503, 'No frame captured yet')
+            else:
+                self._send(200, 'image/jpeg', data)
+        elif url.path == '/stats':
+            self._send(200, 'application/json', json.dumps(self.server.stats.snapshot()).encode('utf-8'))
+        else:
+            self.send_error(404)
+
+    def _send(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, encoder, fps):
+        """
+        Send frames as multipart parts until the client goes away. A client that reads slowly only holds up
+        its own thread and simply gets fewer frames.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=%s' % BOUNDARY)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        period = 1.0 / fps if fps > 0 else 0.0
+        token = encoder.addClient(fps)
+        seq = -1
+        due = time.monotonic()
+        try:
+            while not self.server.stopping:
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                new_seq, timestamp, data = encoder.waitFrame(seq, timeout=1.0)
+                if new_seq <= seq:
+                    continue
+                seq = new_seq
+                due = max(due + period, time.monotonic() - period)
+                self.wfile.write(('--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n'
+                                  'X-Frame-Seq: %d\r\nX-Frame-Timestamp: %.6f\r\n\r\n' %
+                                  (BOUNDARY, len(data), seq, timestamp)).encode('ascii'))
+                self.wfile.write(data)
+                self.wfile.write(b'\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            encoder.removeClient(token)
+
+
+INDEX_PAGE = """<!DOCTYPE html>
+<html><head><title>pyqt_webcam</title></head>
+<body style="margin:0;background:#000">
+<img src="/stream.mjpg" style="max-width:100%;max-height:100vh;display:block;margin:auto">
+</body></html>
+"""
+
+
+class FrameServer(object):
+    """
+    Headless frame server: shared memory for local processes and/or MJPEG over HTTP.
+
+    Endpoints: ``/`` (a page showing the stream), ``/stream.mjpg[?fps=N]``, ``/snapshot.jpg`` and ``/stats``
+    (the camera's :class:`~camera.stats.PipelineStats` snapshot as JSON).
+    """
+    def __init__(self, camera, address=None, shm_name=None, shm_slots=8, quality=80, max_fps=30.0):
+        """
+
+        :type camera: camera.camera_thread.CameraThread
+        :param address: (host, port) to serve HTTP on, None for no HTTP
+        :param shm_name: shared memory block to publish to, None for no shared memory
+        :param shm_slots: frames kept in shared memory
+        :param quality: JPEG quality
+        :param max_fps: most frames per second encoded for HTTP clients
+        """
+        self.publisher = None
+        self.encoder = None
+        self.http = None
+        if shm_name is not None:
+            self.publisher = SharedMemoryPublisher(camera, shm_name, slots=shm_slots)
+        if address is not None:
+            self.encoder = JpegEncoder(camera, quality=quality, max_fps=max_fps)
+            self.http = ThreadingHTTPServer(address, _Handler)
+            self.http.daemon_threads = True
+            self.http.encoder = self.encoder
+            self.http.stats = camera.stats
+            self.http.stopping = False
+        self._thread = None
+
+    @property
+    def address(self):
+        """
+        (host, port) actually being served, e.g. when port 0 picked a free one
+        """
+        return self.http.server_address if self.http is not None else None
+
+    def start(self):
+        if self.publisher is not None:
+            self.publisher.start()
+            _logger.info('Publishing frames to shared memory %r', self.publisher.name)
+        if self.http is not None:
+            self.encoder.start()
+            self._thread = threading.Thread(target=self.http.serve_forever, name='http', daemon=True)
+            self._thread.start()
+            _logger.info('Serving MJPEG on http://%s:%d/', *self.address[:2])
+
+    def stop(self):
+        if self.http is not None:
+            self.http.stopping = True
+            self.http.shutdown()
+            self.http.server_close()
+            self.encoder.stop()
+            self.encoder.wait()
+        if self.publisher is not None:
+            self.publisher.stop()
+            self.publisher.wait()
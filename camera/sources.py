@@ -0,0 +1,271 @@
+"""
+Frame sources CameraThread can capture from
+
+Every source has the subset of the ``cv2.VideoCapture`` interface CameraThread uses (``isOpened``, ``read``,
+``grab``, ``retrieve``, ``get``, ``set``, ``release``), so the real camera, a synthetic pattern generator and
+a recording can be swapped without touching the capture loop. This makes it possible to load test the
+pipeline on machines without a camera.
+"""
+import abc
+import glob
+import os
+import time
+import logging
+
+import cv2
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+
+class FrameSource(abc.ABC):
+    """
+    Base class for emulated sources. Properties that are not meaningful for the source are stored and
+    read back, like a camera that accepts every setting.
+    """
+    def __init__(self, width, height, fps):
+        self._props = {
+            cv2.CAP_PROP_FRAME_WIDTH: float(width),
+            cv2.CAP_PROP_FRAME_HEIGHT: float(height),
+            cv2.CAP_PROP_FPS: float(fps),
+        }
+        self._next_time = None
+        self._opened = True
+
+    @property
+    def width(self):
+        return int(self._props[cv2.CAP_PROP_FRAME_WIDTH])
+
+    @property
+    def height(self):
+        return int(self._props[cv2.CAP_PROP_FRAME_HEIGHT])
+
+    @property
+    def fps(self):
+        return self._props[cv2.CAP_PROP_FPS]
+
+    def isOpened(self):
+        return self._opened
+
+    def get(self, prop_id):
+        return self._props.get(prop_id, 0.0)
+
+    def set(self, prop_id, value):
+        self._props[prop_id] = float(value)
+        return True
+
+    def release(self):
+        self._opened = False
+
+    def _pace(self):
+        """
+        Sleep until the next frame is due, like a camera delivering at a fixed rate
+        """
+        if self.fps <= 0:
+            return
+        now = time.monotonic()
+        if self._next_time is None or now - self._next_time > 1.0:
+            self._next_time = now
+        delay = self._next_time - now
+        if delay > 0:
+            time.sleep(delay)
+        self._next_time += 1.0 / self.fps
+
+    def grab(self):
+        if not self._opened:
+            return False
+        self._pace()
+        return True
+
+    @abc.abstractmethod
+    def retrieve(self, image=None):
+        """
+        Produce the grabbed frame, into ``image`` if it has the right shape
+        """
+        raise NotImplementedError
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, image
+        return self.retrieve(image)
+
+    def _buffer(self, image, shape):
+        if image is None or image.shape != shape or image.dtype != np.uint8:
+            image = np.empty(shape, dtype=np.uint8)
+        return image
+
+
+class CameraSource(object):
+    """
+    A physical camera through ``cv2.VideoCapture``. Every call is passed straight through.
+    """
+    def __init__(self, camera_id=0, capture=None):
+        """
+
+        :param camera_id: device index or URL
+        :param capture: an already opened ``cv2.VideoCapture`` to use instead of opening ``camera_id``
+        """
+        self._cap = capture if capture is not None else cv2.VideoCapture(camera_id)
+
+    def __getattr__(self, name):
+        return getattr(self._cap, name)
+
+
+class SyntheticSource(FrameSource):
+    """
+    Generated test pattern at a configurable resolution and frame rate.
+
+    Patterns are rendered once and each frame is a single copy of a shifted window into them plus a
+    frame counter, so the source itself stays cheap even at 4K/60 fps.
+    """
+    PATTERNS = ('bars', 'gradient', 'noise', 'black')
+
+    def __init__(self, width=1920, height=1080, fps=30.0, pattern='bars'):
+        """
+
+        :param pattern: one of :attr:`PATTERNS`
+        """
+        if pattern not in self.PATTERNS:
+            raise ValueError('Unknown pattern %r, expected one of %s' % (pattern, ', '.join(self.PATTERNS)))
+        super(SyntheticSource, self).__init__(width, height, fps)
+        self.pattern = pattern
+        self._count = 0
+        self._base = None
+
+    def set(self, prop_id, value):
+        if prop_id in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT):
+            self._base = None
+        return super(SyntheticSource, self).set(prop_id, value)
+
+    def _render(self):
+        h, w = self.height, self.width
+        # Twice as wide as the frame so any window of it can scroll across
+        x = np.arange(2 * w)
+        if self.pattern == 'bars':
+            colors = np.array([[255, 255, 255], [0, 255, 255], [255, 255, 0], [0, 255, 0],
+                               [255, 0, 255], [0, 0, 255], [255, 0, 0], [0, 0, 0]], dtype=np.uint8)
+            row = colors[(x * 8 // max(w, 1)) % 8]
+            base = np.broadcast_to(row, (h, 2 * w, 3))
+        elif self.pattern == 'gradient':
+            ramp = (x * 255 // max(w, 1) % 256).astype(np.uint8)
+            vertical = (np.arange(h) * 255 // max(h, 1)).astype(np.uint8)
+            base = np.empty((h, 2 * w, 3), dtype=np.uint8)
+            base[..., 0] = ramp
+            base[..., 1] = vertical[:, None]
+            base[..., 2] = 255 - ramp
+        elif self.pattern == 'noise':
+            base = np.random.randint(0, 256, (h, 2 * w, 3), dtype=np.uint8)
+        else:
+            base = np.zeros((h, 2 * w, 3), dtype=np.uint8)
+        self._base = np.ascontiguousarray(base)
+
+    def retrieve(self, image=None):
+        if self._base is None:
+            self._render()
+        h, w = self.height, self.width
+        image = self._buffer(image, (h, w, 3))
+        offset = (self._count * 8) % w if self.pattern != 'black' else 0
+        np.copyto(image, self._base[:, offset:offset + w])
+        cv2.putText(image, str(self._count), (16, max(h // 10, 24)), cv2.FONT_HERSHEY_SIMPLEX,
+                    max(h / 480.0, 0.5), (128, 128, 128), max(h // 240, 1))
+        self._count += 1
+        return True, image
+
+
+class FileSource(FrameSource):
+    """
+    Replays a video file or a directory of images at a controlled rate, looping at the end.
+    """
+    IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+    def __init__(self, path, fps=None, loop=True):
+        """
+
+        :param path: video file, or directory whose images are played in name order
+        :param fps: playback rate; defaults to the video's own rate, or 30 for images; 0 plays as fast as
+            frames can be decoded
+        :param loop: start over at the end instead of reporting end of stream
+        """
+        self.path = path
+        self._loop = loop
+        self._index = 0
+        if os.path.isdir(path):
+            self._video = None
+            self._files = sorted(f for f in glob.glob(os.path.join(path, '*'))
+                                 if os.path.splitext(f)[1].lower() in self.IMAGE_EXTENSIONS)
+            first = cv2.imread(self._files[0]) if self._files else None
+            height, width = first.shape[:2] if first is not None else (0, 0)
+            native_fps = 30.0
+        else:
+            self._files = None
+            self._video = cv2.VideoCapture(path)
+            width = self._video.get(cv2.CAP_PROP_FRAME_WIDTH)
+            height = self._video.get(cv2.CAP_PROP_FRAME_HEIGHT)
+            native_fps = self._video.get(cv2.CAP_PROP_FPS) or 30.0
+        super(FileSource, self).__init__(width, height, native_fps if fps is None else fps)
+        self._opened = bool(self._files) if self._video is None else self._video.isOpened()
+        if not self._opened:
+            _logger.error('No frames to play from %s', path)
+
+    def set(self, prop_id, value):
+        # The size is whatever is stored in the file
+        if prop_id in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT):
+            return False
+        return super(FileSource, self).set(prop_id, value)
+
+    def grab(self):
+        if not super(FileSource, self).grab():
+            return False
+        if self._video is not None:
+            ok = self._video.grab()
+            if not ok and self._loop:
+                self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok = self._video.grab()
+            if not ok:
+                self._opened = False
+            return ok
+        if self._index >= len(self._files):
+            if not self._loop:
+                self._opened = False
+                return False
+            self._index = 0
+        self._index += 1
+        return True
+
+    def retrieve(self, image=None):
+        if self._video is not None:
+            return self._video.retrieve(image)
+        frame = cv2.imread(self._files[self._index - 1])
+        if frame is None:
+            return False, image
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame
+
+    def release(self):
+        super(FileSource, self).release()
+        if self._video is not None:
+            self._video.release()
+
+
+def open_source(spec, camera_id=0):
+    """
+    Create a source from a command line description:
+
+    - ``camera`` or ``camera:N``: physical camera N (default ``camera_id``)
+    - ``synthetic[:WxH[@FPS][:PATTERN]]``, e.g. ``synthetic:3840x2160@60:noise``
+    - ``file:PATH[@FPS]``: a video file or a directory of images
+    """
+    kind, _, rest = (spec or 'camera').partition(':')
+    if kind == 'camera':
+        return CameraSource(int(rest) if rest else camera_id)
+    if kind == 'synthetic':
+        size, _, pattern = rest.partition(':')
+        size, _, fps = size.partition('@')
+        width, height = (int(v) for v in size.split('x')) if size else (1920, 1080)
+        return SyntheticSource(width, height, float(fps) if fps else 30.0, pattern or 'bars')
+    if kind == 'file':
+        path, _, fps = rest.rpartition('@') if '@' in rest else (rest, '', '')
+        return FileSource(path, float(fps) if fps else None)
+    raise ValueError('Unknown source %r, expected camera, synthetic or file' % spec)
@@ -0,0 +1,157 @@
+"""
+Lightweight counters for measuring the capture and display pipeline
+"""
+import collections
+import time
+
+import numpy as np
+
+
+class RateCounter(object):
+    """
+    Events per second over a sliding time window. :meth:`tick` is cheap enough to call on every frame
+    and may be called from a different thread than :attr:`rate` is read from.
+    """
+    def __init__(self, window=1.0):
+        """
+
+        :param window: length of the averaging window in seconds
+        """
+        self._window = window
+        self._times = collections.deque()
+
+    def tick(self, t=None):
+        if t is None:
+            t = time.monotonic()
+        self._times.append(t)
+        while t - self._times[0] > self._window:
+            self._times.popleft()
+
+    @property
+    def rate(self):
+        times = tuple(self._times)
+        if len(times) < 2 or time.monotonic() - times[-1] > self._window:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
+
+
+class LatencyHistogram(object):
+    """
+    Rolling record of the most recent durations. :meth:`add` is a single array store, so it can be called
+    for every frame; percentiles and histograms are only computed when read.
+    """
+    def __init__(self, size=512):
+        """
+
+        :param size: number of most recent samples kept
+        """
+        self._samples = np.zeros(size)
+        self._count = 0
+
+    def add(self, seconds):
+        self._samples[self._count % len(self._samples)] = seconds
+        self._count += 1
+
+    @property
+    def count(self):
+        """
+        Total number of samples added, including those that have rolled out of the window
+        """
+        return self._count
+
+    def samples(self):
+        return self._samples[:min(self._count, len(self._samples))].copy()
+
+    def percentiles(self, q=(50, 90, 99)):
+        """
+        :return: the requested percentiles in seconds, or None if there are no samples yet
+        """
+        samples = self.samples()
+        if not len(samples):
+            return None
+        return np.percentile(samples, q)
+
+    def histogram(self, bins=10):
+        """
+        :return: (counts, bin edges in seconds) as from ``np.histogram``
+        """
+        return np.histogram(self.samples(), bins=bins)
+
+
+class PipelineStats(object):
+    """
+    Named rates, latency histograms, counters and gauges shared by every stage of the pipeline.
+
+    Stages record into it as they run; :meth:`summary` and :meth:`snapshot` read everything at once for
+    an overlay or a log line. Gauges are callables evaluated only when read, for values that are already
+    kept elsewhere such as queue depths.
+    """
+    def __init__(self, samples=512, window=1.0):
+        self._samples = samples
+        self._window = window
+        self.rates = collections.OrderedDict()
+        self.histograms = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        self.gauges = collections.OrderedDict()
+
+    def rate(self, name):
+        """
+        :rtype: RateCounter
+        """
+        counter = self.rates.get(name)
+        if counter is None:
+            counter = self.rates.setdefault(name, RateCounter(self._window))
+        return counter
+
+    def histogram(self, name):
+        """
+        :rtype: LatencyHistogram
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms.setdefault(name, LatencyHistogram(self._samples))
+        return histogram
+
+    def tick(self, name, t=None):
+        self.rate(name).tick(t)
+
+    def record(self, name, seconds):
+        self.histogram(name).add(seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, func):
+        """
+        Report ``func()`` under ``name`` whenever the stats are read
+        """
+        self.gauges[name] = func
+
+    def snapshot(self):
+        """
+        :return: dict of rates (per second), latency percentiles (p50/p90/p99 in milliseconds), counters and
+            gauge values
+        """
+        latencies = {}
+        for name, histogram in list(self.histograms.items()):
+            p = histogram.percentiles()
+            if p is not None:
+                latencies[name] = dict(zip(('p50', 'p90', 'p99'), (float(v) * 1000 for v in p)))
+        return {
+            'rates': {name: counter.rate for name, counter in list(self.rates.items())},
+            'latency_ms': latencies,
+            'counters': dict(self.counters),
+            'gauges': {name: func() for name, func in list(self.gauges.items())},
+        }
+
+    def summary(self, multiline=False):
+        """
+        :return: human readable one-line (or one item per line) summary of :meth:`snapshot`
+        """
+        snapshot = self.snapshot()
+        items = ['%s %.1f fps' % item for item in snapshot['rates'].items()]
+        items += ['%s p50 %.1f p99 %.1f ms' % (name, p['p50'], p['p99'])
+                  for name, p in snapshot['latency_ms'].items()]
+        items += ['%s %d' % item for item in snapshot['counters'].items()]
+        items += ['%s %d' % item for item in snapshot['gauges'].items()]
+        return ('\n' if multiline else ' | ').join(items)
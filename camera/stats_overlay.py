@@ -0,0 +1,47 @@
+from PyQt5.QtCore import Qt, QTimer, pyqtSlot
+from PyQt5.QtGui import QFontDatabase
+from PyQt5.QtWidgets import QLabel
+
+
+class StatsOverlay(QLabel):
+    """
+    Translucent box in the corner of a preview showing a :class:`camera.stats.PipelineStats` summary.
+
+    Hidden by default; while shown it refreshes twice a second, so it costs nothing when off and one
+    snapshot per refresh when on. Mouse events pass through to the preview underneath.
+    """
+    def __init__(self, stats, parent, interval=500):
+        """
+
+        :type stats: camera.stats.PipelineStats
+        :param parent: widget to draw over, usually the preview label
+        :param interval: refresh period in milliseconds
+        """
+        super(StatsOverlay, self).__init__(parent)
+        self._stats = stats
+        self.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.setStyleSheet('background-color: rgba(0, 0, 0, 160); color: white; padding: 4px;')
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.move(8, 8)
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval)
+        self._timer.timeout.connect(self.refresh)
+        self.hide()
+
+    @pyqtSlot()
+    def toggle(self):
+        self.setVisible(not self.isVisible())
+
+    def setVisible(self, visible):
+        if visible:
+            self.refresh()
+            self._timer.start()
+        else:
+            self._timer.stop()
+        super(StatsOverlay, self).setVisible(visible)
+
+    @pyqtSlot()
+    def refresh(self):
+        self.setText(self._stats.summary(multiline=True))
+        self.adjustSize()
+        self.raise_()
@@ -0,0 +1,107 @@
+"""
+Orientation and crop of camera frames as a single precomputed mapping
+"""
+import numpy as np
+
+
+class FrameTransform(object):
+    """
+    Rotation by multiples of 90 degrees, optional up-down and left-right flips (applied in that order, like
+    ``np.rot90``, ``np.flipud`` and ``np.fliplr``) and a crop given in the rotated/flipped coordinates.
+
+    Everything is worked out once when the settings change. :meth:`apply` then crops in sensor coordinates
+    first and reorients only the visible region, returning a strided view of the frame without copying
+    any pixels. Coordinates are continuous, with pixel (i, j) covering [j, j + 1) x [i, i + 1), which is
+    what the mouse mapping in :meth:`camera.camera_app.CameraApp.getPos` produces.
+    """
+    def __init__(self, sensor_shape, rotate_count=0, flipud=False, fliplr=False, crop=None):
+        """
+
+        :param sensor_shape: shape of the frames as captured, (height, width, ...)
+        :param rotate_count: number of 90 degree counter-clockwise rotations
+        :param flipud: flip vertically after rotating
+        :param fliplr: flip horizontally after rotating
+        :param crop: (x1, y1, x2, y2) in output coordinates before cropping, or None for the whole frame
+        """
+        self.sensor_shape = tuple(sensor_shape[:2])
+        self.rotate_count = rotate_count % 4
+        self.flipud = bool(flipud)
+        self.fliplr = bool(fliplr)
+
+        # Affine map from sensor (x, y, 1) to oriented (x, y)
+        h, w = self.sensor_shape
+        matrix = np.eye(3)
+        for _ in range(self.rotate_count):
+            # np.rot90: output (x, y) = input (y, w - x); width and height swap
+            matrix = np.array([[0, 1, 0], [-1, 0, w], [0, 0, 1]]).dot(matrix)
+            h, w = w, h
+        if self.flipud:
+            matrix = np.array([[1, 0, 0], [0, -1, h], [0, 0, 1]]).dot(matrix)
+        if self.fliplr:
+            matrix = np.array([[-1, 0, w], [0, 1, 0], [0, 0, 1]]).dot(matrix)
+        self._forward = matrix
+        self._inverse = np.linalg.inv(matrix)
+        self.oriented_shape = (h, w)
+
+        if crop is not None and None not in crop:
+            x1, y1, x2, y2 = crop
+            x1, x2 = sorted(int(np.clip(x, 0, w)) for x in (x1, x2))
+            y1, y2 = sorted(int(np.clip(y, 0, h)) for y in (y1, y2))
+            if x1 == x2 or y1 == y2:
+                x1, y1, x2, y2 = 0, 0, w, h
+        else:
+            x1, y1, x2, y2 = 0, 0, w, h
+        self.crop = (x1, y1, x2, y2)
+
+        # The same region in sensor coordinates
+        (sx1, sx2), (sy1, sy2) = (sorted(int(round(v)) for v in pair) for pair in
+                                  zip(self.toSensor(x1, y1), self.toSensor(x2, y2)))
+        self._sensor_slice = (slice(sy1, sy2), slice(sx1, sx2))
+        self.sensor_crop = (sx1, sy1, sx2, sy2)
+
+    @property
+    def origin(self):
+        """
+        Top left corner of the crop in oriented coordinates
+        """
+        return self.crop[0], self.crop[1]
+
+    @property
+    def shape(self):
+        """
+        (height, width) of the output of :meth:`apply`
+        """
+        x1, y1, x2, y2 = self.crop
+        return y2 - y1, x2 - x1
+
+    def isCropped(self):
+        return self.shape != self.oriented_shape
+
+    def apply(self, frame):
+        """
+        :return: the oriented, cropped region of ``frame`` as a view
+        """
+        if frame.shape[:2] != self.sensor_shape:
+            return FrameTransform(frame.shape, self.rotate_count, self.flipud, self.fliplr).apply(frame)
+        image = frame[self._sensor_slice]
+        if self.rotate_count:
+            image = np.rot90(image, self.rotate_count)
+        if self.flipud:
+            image = image[::-1]
+        if self.fliplr:
+            image = image[:, ::-1]
+        return image
+
+    def toSensor(self, x, y):
+        """
+        Map oriented (uncropped) coordinates to sensor coordinates
+        """
+        sx, sy, _ = self._inverse.dot((x, y, 1))
+        return sx, sy
+
+    def fromSensor(self, x, y):
+        """
+        Map sensor coordinates to oriented (uncropped) coordinates
+        """
+        ox, oy, _ = self._forward.dot((x, y, 1))
+        return ox, oy
@@ -0,0 +1,149 @@
+"""
+Recording the camera stream to a video file
+"""
+import os
+import queue
+import threading
+import logging
+
+import cv2
+from PyQt5.QtCore import QThread, Qt, pyqtSignal
+
+_logger = logging.getLogger(__name__)
+
+
+class VideoRecorder(QThread):
+    """
+    Writes frames to a container with ``cv2.VideoWriter`` on its own thread.
+
+    Frames are pinned in the ring and handed over through a bounded queue as the camera publishes them;
+    if the writer falls behind, new frames are dropped and their sequence numbers logged. The writer
+    runs at a fixed rate, so each frame is placed by its capture timestamp rather than by when it was
+    written: frames are repeated to fill gaps and skipped if they arrive early, which keeps the clip
+    playing at true speed. Skipped frames count towards :attr:`dropped` too.
+    """
+    # Emitted with the number of frames written and dropped so far
+    progress = pyqtSignal(int, int)
+
+    FOURCC = {'.avi': 'MJPG', '.mp4': 'mp4v', '.mkv': 'XVID'}
+
+    def __init__(self, camera, filename, fps=30.0, fourcc=None, transform=None, queue_size=3, parent=None):
+        """
+
+        :type camera: camera.camera_thread.CameraThread
+        :param filename: output file; the extension picks the container
+        :param fps: frame rate of the output file
+        :param fourcc: four character codec code, defaults to one that suits the container
+        :type transform: camera.transform.FrameTransform
+        :param transform: optional rotate/flip/crop applied to every frame
+        :param queue_size: frames that may wait for the writer before new ones are dropped
+        """
+        super(VideoRecorder, self).__init__(parent=parent)
+        self._camera = camera
+        self._ring = camera.ring
+        self.filename = filename
+        self.fps = fps
+        if fourcc is None:
+            fourcc = self.FOURCC.get(os.path.splitext(filename)[1].lower(), 'MJPG')
+        self._fourcc = fourcc
+        self._transform = transform
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._recording = False
+        # stop() and a failing run() may both try to disconnect
+        self._connection_lock = threading.Lock()
+        self._connected = False
+        self.written = 0
+        self.dropped = 0
+
+    def start(self, *args, **kwargs):
+        self._recording = True
+        # Runs on the capture thread, so frames are pinned the moment they are published
+        with self._connection_lock:
+            self._camera.frameReady.connect(self.push, Qt.DirectConnection)
+            self._connected = True
+        super(VideoRecorder, self).start(*args, **kwargs)
+
+    def _disconnect(self):
+        with self._connection_lock:
+            if self._connected:
+                self._connected = False
+                self._camera.frameReady.disconnect(self.push)
+
+    def stop(self):
+        if self._recording:
+            self._recording = False
+            self._disconnect()
+            self._queue.put(None)
+
+    def push(self, seq):
+        if not self._recording:
+            return
+        frame = self._ring.hold(seq)
+        if frame is None:
+            return
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            self._ring.release(frame)
+            self.dropped += 1
+            _logger.warning('Video writer behind, dropped frame %d', seq)
+
+    def _frameSize(self):
+        if self._transform is not None:
+            height, width = self._transform.shape
+        else:
+            height, width = self._camera.frame.shape[:2]
+        return width, height
+
+    def run(self):
+        size = self._frameSize()
+        writer = cv2.VideoWriter(self.filename, cv2.VideoWriter_fourcc(*self._fourcc), self.fps, size)
+        if writer.isOpened():
+            slots = self._writeFrames(writer, size)
+            _logger.info('Recorded %d frames (%d output frames) to %s, %d dropped',
+                         self.written, slots, self.filename, self.dropped)
+        else:
+            _logger.error('Could not open %s for writing with codec %s', self.filename, self._fourcc)
+            self._recording = False
+            self._disconnect()
+        writer.release()
+
+        # Unpin anything pushed while stopping
+        while True:
+            try:
+                frame = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if frame is not None:
+                self._ring.release(frame)
+
+    def _writeFrames(self, writer, size):
+        start = None
+        slots = 0
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                return slots
+            try:
+                image = frame.image if self._transform is None else self._transform.apply(frame.image)
+                if (image.shape[1], image.shape[0]) != size:
+                    self.dropped += 1
+                    _logger.warning('Frame %d is %dx%d, expected %dx%d; dropped',
+                                    frame.seq, image.shape[1], image.shape[0], size[0], size[1])
+                    continue
+
+                # Output slot this frame belongs in according to its capture time
+                if start is None:
+                    start = frame.timestamp
+                slot = int(round((frame.timestamp - start) * self.fps))
+                if slot < slots:
+                    self.dropped += 1
+                    _logger.debug('Frame %d arrived ahead of the output rate; skipped', frame.seq)
+                    continue
+                for _ in range(slot - slots + 1):
+                    writer.write(image)
+                slots = slot + 1
+                self.written += 1
+                self.progress.emit(self.written, self.dropped)
+            finally:
+                self._ring.release(frame)
@@ -0,0 +1,189 @@
+"""
+Exporting the zoomed region at full quality
+
+The preview crop is snapped to whole pixels, and saving it writes however many pixels the crop happens to
+cover. An export instead resamples exactly the selected region, with its sub-pixel bounds, straight from the
+sensor frames: the rotate/flip and the scale to the requested size become a single affine map applied with
+``cv2.warpAffine``, so the frame is never reoriented or copied first. Several consecutive frames can be
+averaged to reduce noise. They are summed in place into one float32 buffer covering just the region, so
+averaging 16 frames needs one region-sized accumulator rather than 16 frames.
+"""
+import time
+import logging
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+
+_logger = logging.getLogger(__name__)
+
+
+def sensor_bounds(transform, rect, margin=0):
+    """
+    Whole-pixel box of the sensor frame covering ``rect``.
+
+    :type transform: camera.transform.FrameTransform
+    :param rect: (x1, y1, x2, y2) in oriented, uncropped coordinates
+    :param margin: pixels to add on every side, e.g. for the interpolation kernel
+    :return: (x1, y1, x2, y2) clipped to the frame
+    """
+    x1, y1, x2, y2 = rect
+    corners = [transform.toSensor(x, y) for x, y in ((x1, y1), (x2, y2))]
+    h, w = transform.sensor_shape
+    xs, ys = zip(*corners)
+    return (max(int(np.floor(min(xs))) - margin, 0), max(int(np.floor(min(ys))) - margin, 0),
+            min(int(np.ceil(max(xs))) + margin, w), min(int(np.ceil(max(ys))) + margin, h))
+
+
+def export_matrix(transform, rect, size, offset=(0, 0)):
+    """
+    Affine map from output pixels to source pixels for ``cv2.warpAffine`` with ``WARP_INVERSE_MAP``.
+
+    Coordinates are continuous as in :class:`~camera.transform.FrameTransform`, with pixel centres at
+    half-integers, while OpenCV puts them on integers, hence the half pixel shifts.
+
+    :param rect: (x1, y1, x2, y2) to export, in oriented, uncropped coordinates
+    :param size: (width, height) of the output
+    :param offset: sensor (x, y) of the source image's top left pixel, if it is a crop of the frame
+    :return: 2x3 float matrix
+    """
+    x1, y1, x2, y2 = rect
+    width, height = size
+    sx, sy = (x2 - x1) / float(width), (y2 - y1) / float(height)
+
+    def source(u, v):
+        # Output pixel centre -> oriented -> sensor -> source pixel index
+        x, y = transform.toSensor(x1 + (u + 0.5) * sx, y1 + (v + 0.5) * sy)
+        return np.array([x - 0.5 - offset[0], y - 0.5 - offset[1]])
+
+    origin = source(0, 0)
+    return np.column_stack([source(1, 0) - origin, source(0, 1) - origin, origin])
+
+
+def export_size(rect, scale=1.0):
+    """
+    :return: (width, height) of the region at ``scale`` times its size in sensor pixels
+    """
+    x1, y1, x2, y2 = rect
+    return max(int(round(abs(x2 - x1) * scale)), 1), max(int(round(abs(y2 - y1) * scale)), 1)
+
+
+class FrameAverager(object):
+    """
+    Running sum of one region of consecutive frames in a float32 buffer, added to in place
+    """
+    def __init__(self, bounds, shape):
+        """
+
+        :param bounds: (x1, y1, x2, y2) sensor region to accumulate
+        :param shape: shape of the frames, to size the buffer
+        """
+        x1, y1, x2, y2 = bounds
+        self.bounds = bounds
+        self.count = 0
+        self._sum = np.zeros((y2 - y1, x2 - x1) + tuple(shape[2:]), dtype=np.float32)
+
+    def add(self, image):
+        x1, y1, x2, y2 = self.bounds
+        cv2.accumulate(image[y1:y2, x1:x2], self._sum)
+        self.count += 1
+
+    def average(self):
+        """
+        Divide the sum in place and return it; call once, after the last :meth:`add`
+        """
+        if self.count > 1:
+            self._sum *= 1.0 / self.count
+        return self._sum
+
+
+class ZoomExporter(QThread):
+    """
+    Averages ``frames`` consecutive frames from the ring over the region, resamples it and queues the result
+    on an :class:`~camera.image_writer.ImageWriter`. Frames recycled before they could be added are replaced by
+    later ones and counted in :attr:`missed`. ``.npy`` files keep the float32 average, other formats are
+    rounded to 8 bits.
+    """
+    # Emitted with the number of frames added so far and the number wanted
+    progress = pyqtSignal(int, int)
+    # Emitted with the output filename once it has been queued for writing, or an empty string if it was not
+    exported = pyqtSignal(str)
+
+    def __init__(self, ring, transform, rect, filename, writer, frames=1, size=None, interpolation=cv2.INTER_CUBIC,
+                 params=(), parent=None):
+        """
+
+        :type ring: camera.frame_buffer.FrameRing
+        :type transform: camera.transform.FrameTransform
+        :param transform: orientation of the frames; its crop is ignored
+        :param rect: (x1, y1, x2, y2) region in oriented, uncropped coordinates of frames of
+            ``transform.sensor_shape``, None for the whole frame
+        :type writer: camera.image_writer.ImageWriter
+        :param frames: number of consecutive frames to average
+        :param size: (width, height) to resample to, defaults to the region's size in sensor pixels
+        :param interpolation: ``cv2.INTER_*`` flag for the resampling
+        :param params: encoder parameters for ``cv2.imwrite``
+        """
+        super(ZoomExporter, self).__init__(parent=parent)
+        self._ring = ring
+        self._transform = transform
+        if rect is None:
+            h, w = transform.oriented_shape
+            rect = (0.0, 0.0, float(w), float(h))
+        x1, y1, x2, y2 = rect
+        self.rect = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+        self.size = tuple(size) if size is not None else export_size(self.rect)
+        self.filename = filename
+        self._writer = writer
+        self.frames = max(int(frames), 1)
+        self._interpolation = interpolation
+        self._params = params
+        self._stop = False
+        self.missed = 0
+
+    def stop(self):
+        self._stop = True
+
+    def run(self):
+        start = time.monotonic()
+        shape = self._transform.sensor_shape
+        # Room for the interpolation kernel around the region; Lanczos reaches furthest
+        bounds = sensor_bounds(self._transform, self.rect, margin=4)
+        averager = None
+        seq = self._ring.seq - 1
+        while averager is None or averager.count < self.frames:
+            if self._stop:
+                self.exported.emit('')
+                return
+            frame, missed = self._ring.next(seq, timeout=1.0)
+            if frame is None:
+                continue
+            seq = frame.seq
+            frame = self._ring.hold(seq)
+            if frame is None:
+                self.missed += missed + 1
+                continue
+            try:
+                if frame.image.shape[:2] != shape:
+                    # Captured at another resolution, e.g. while switching modes
+                    self.missed += 1
+                    continue
+                if averager is None:
+                    averager = FrameAverager(bounds, frame.image.shape)
+                averager.add(frame.image)
+            finally:
+                self._ring.release(frame)
+            self.missed += missed if averager.count > 1 else 0
+            self.progress.emit(averager.count, self.frames)
+
+        matrix = export_matrix(self._transform, self.rect, self.size, offset=bounds[:2])
+        image = cv2.warpAffine(averager.average(), matrix, self.size,
+                               flags=self._interpolation | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+        if not self.filename.lower().endswith('.npy'):
+            image = np.clip(np.round(image), 0, 255).astype(np.uint8)
+        _logger.info('Exported %dx%d from %s averaging %d frames (%d missed) in %.2f s', self.size[0], self.size[1],
+                     tuple(round(v, 2) for v in self.rect), self.frames, self.missed, time.monotonic() - start)
+        if self._writer.submit(self.filename, image, self._params, block=True):
+            self.exported.emit(self.filename)
+        else:
+            self.exported.emit('')